@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import timedelta
 from typing import Any
 from app.core.config import settings
-from app.core.security import create_access_token, get_current_user, encrypt_token
+from app.core.security import create_access_token, get_current_email, get_current_user, encrypt_token, load_user
 from app.models.user import UserCreate, Token, UserInDB, User
+from app.services import etag_service, schema_warmup
 from app.services.user_service import create_user, authenticate_user
 from app.db.mongodb import MongoDB
 from fastapi import Body
@@ -16,7 +17,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login
 logger = logging.getLogger(__name__)
 
 @router.get("/me", response_model=User)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(request: Request, response: Response, email: str = Depends(get_current_email)):
+    current_etag = etag_service.etag(email, etag_service.ME)
+    if etag_service.matches(request.headers.get("if-none-match"), current_etag):
+        return etag_service.not_modified(current_etag)
+    etag_service.set_headers(response, current_etag)
+    
+    current_user = await load_user(email)
     logger.info(f"User {current_user.email} requested their information")
     return current_user
 
@@ -35,7 +42,7 @@ async def register(user: UserCreate) -> Any:
         )
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
+async def login(background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
     logger.info(f"Login attempt for user: {form_data.username}")
     user = await authenticate_user(form_data.username, form_data.password)
     if not user:
@@ -52,13 +59,18 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
     )
     
     logger.info(f"User {form_data.username} logged in successfully")
+    background_tasks.add_task(schema_warmup.warm_user_pipes, user.email)
     return {
         "access_token": access_token,
         "token_type": "bearer"
     }
 
 @router.post("/save-pipefy-token")
-async def save_pipefy_token(pipefy_token: str = Body(..., embed=True), current_user: User = Depends(get_current_user)):
+async def save_pipefy_token(
+    background_tasks: BackgroundTasks,
+    pipefy_token: str = Body(..., embed=True),
+    current_user: User = Depends(get_current_user)
+):
     logger.info(f"Attempting to save Pipefy token for user: {current_user.email}")
     encrypted_token = encrypt_token(pipefy_token)
     result = await MongoDB.database.users.update_one(
@@ -68,6 +80,8 @@ async def save_pipefy_token(pipefy_token: str = Body(..., embed=True), current_u
     if result.modified_count == 0:
         logger.error(f"Failed to save Pipefy token for user: {current_user.email}")
         raise HTTPException(status_code=400, detail="Failed to save Pipefy token")
+    etag_service.bump(current_user.email, etag_service.ME)
+    background_tasks.add_task(schema_warmup.warm_user_pipes, current_user.email)
     logger.info(f"Pipefy token saved successfully for user: {current_user.email}")
     return {"message": "Pipefy token saved successfully"}
 
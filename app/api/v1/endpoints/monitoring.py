@@ -0,0 +1,45 @@
+import logging
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.api.v1.endpoints import webhooks
+from app.core import shutdown, structured_logging
+from app.db.mongodb import MongoDB
+from app.services import admission, circuit_breaker, pipefy_scheduler, schema_cache, schema_warmup
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.get("/metrics")
+async def metrics():
+    return {
+        "pipefy_scheduler": pipefy_scheduler.scheduler.snapshot(),
+        "admission": admission.controller.snapshot(),
+        "schema_cache": schema_cache.cache.stats(),
+        "schema_warmup": dict(schema_warmup.warmup_stats),
+        "pipefy_circuits": circuit_breaker.registry.snapshot(),
+        "webhooks": dict(webhooks.webhook_stats),
+        "logging": structured_logging.stats()
+    }
+
+@router.get("/ready")
+async def ready():
+    # Sem Mongo a instância não atende; circuitos abertos do Pipefy deixam o
+    # serviço degradado, mas ele continua respondendo (com 503 rápidos)
+    try:
+        await MongoDB.database.command("ping")
+        mongo = "ok"
+    except Exception as e:
+        logger.error(f"Readiness check failed: {str(e)}")
+        mongo = "unavailable"
+
+    open_circuits = circuit_breaker.registry.open_circuits()
+    if shutdown.is_draining():
+        # Tira a instância do balanceador enquanto os jobs terminam
+        return JSONResponse(status_code=503, content={"status": "draining", "mongodb": mongo})
+    body = {
+        "status": "unavailable" if mongo != "ok" else ("degraded" if open_circuits else "ok"),
+        "mongodb": mongo,
+        "pipefy_open_circuits": open_circuits,
+        "pipefy_circuits": circuit_breaker.registry.snapshot()["circuits"]
+    }
+    return JSONResponse(status_code=200 if mongo == "ok" else 503, content=body)
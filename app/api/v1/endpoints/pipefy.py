@@ -1,17 +1,22 @@
+import asyncio
 import datetime
-import json
 import logging
+import os
 import string
+import tempfile
 from tokenize import Comment
 from fastapi import APIRouter, Depends, HTTPException, Header, File, Request, UploadFile
-from typing import Any, List, Dict
-from app.services import pipefy_service
-from app.core.security import get_current_user, decrypt_token
+from typing import Any, List, Dict, Optional
+from app.services import admission, bulk_job_service, etag_service, fanout_service, pipefy_scheduler, pipefy_service, quota_service, schema_cache, snapshot_service, template_service, upload_service, upsert_service, validation_service, xlsx_service
+from app.core.config import settings
+from app.core.responses import trusted_json
+from app.core.security import get_current_email, get_current_user, decrypt_token, load_user
+from app.core.structured_logging import log_event
 from app.models.user import User
 from app.db.mongodb import MongoDB
-from io import BytesIO
-from fastapi.responses import JSONResponse, StreamingResponse
-from openpyxl import Workbook, load_workbook
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from openpyxl.comments import Comment
 from fastapi import APIRouter, Depends, HTTPException, Header, File, Request, UploadFile, Body
 from pydantic import BaseModel
@@ -48,6 +53,50 @@ class PipeInDB(BaseModel):
 class DatabaseFieldsRequest(BaseModel):
     database_id: str
 
+async def run_bulk_job(
+    current_user: User,
+    idempotency_key: Optional[str],
+    operation: str,
+    items: List[Dict],
+    api_token: str,
+    completed: Optional[Dict[int, Dict]] = None,
+    collect: bool = True
+) -> Dict:
+    # Executa os itens como um job com checkpoints; a mesma chave de
+    # idempotência devolve o resultado já gravado em vez de reenviar ao Pipefy
+    try:
+        key, results = await bulk_job_service.execute(
+            str(current_user.id), idempotency_key, operation, items, api_token, completed,
+            plan=current_user.subscription_plan or "free", collect=collect
+        )
+    except bulk_job_service.JobConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except bulk_job_service.JobInterrupted as e:
+        raise job_interrupted(e)
+    return {"idempotency_key": key, "results": results}
+
+def job_interrupted(error: bulk_job_service.JobInterrupted) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={"message": str(error), "idempotency_key": error.key},
+        headers={"Retry-After": "30"}
+    )
+
+async def refresh_session_schema(current_user: User, user_data: Dict):
+    # Um webhook de mudança de esquema descarta os campos e membros guardados
+    # na sessão do assistente; eles são buscados de novo (pelo cache) aqui
+    missing_fields = user_data.get('phase_id') and 'fields' not in user_data
+    missing_members = user_data.get('pipe_id') and 'pipe_members' not in user_data
+    if not (missing_fields or missing_members):
+        return
+    api_token = await get_pipefy_token(current_user)
+    if missing_fields:
+        user_data['fields'] = await run_in_threadpool(
+            schema_cache.get_phase_fields, user_data['phase_id'], api_token, user_data.get('pipe_id')
+        )
+    if missing_members:
+        user_data['pipe_members'] = await run_in_threadpool(schema_cache.get_pipe_members, user_data['pipe_id'], api_token)
+
 async def get_pipefy_token(current_user: User = Depends(get_current_user)):
     logger.info(f"Retrieving Pipefy token for user: {current_user.email}")
     user = await MongoDB.database.users.find_one({"email": current_user.email})
@@ -55,6 +104,8 @@ async def get_pipefy_token(current_user: User = Depends(get_current_user)):
         logger.warning(f"Pipefy token not found for user: {current_user.email}")
         raise HTTPException(status_code=400, detail="Pipefy token not found. Please save your Pipefy token first.")
     token = decrypt_token(user["pipefy_token"])
+    pipefy_scheduler.set_tenant(current_user.id, current_user.subscription_plan)
+    await quota_service.ensure_loaded(str(current_user.id))
     logger.info(f"Successfully retrieved and decrypted token for user: {current_user.email}")
     logger.debug(f"Token: {token[:4]}...{token[-4:]}")
     return token
@@ -72,8 +123,10 @@ async def get_phases(pipe_id: str, current_user: User = Depends(get_current_user
         logger.info(f"Calling Pipefy API for pipe_id: {pipe_id}")
         
         # Buscar fases e membros do pipe
-        phases = pipefy_service.get_pipe_phases(pipe_id, api_token)
-        pipe_members = pipefy_service.get_pipe_members(pipe_id, api_token)
+        # Chamadas síncronas ao Pipefy (que podem esperar vaga no agendador)
+        # rodam fora do event loop
+        phases = await run_in_threadpool(schema_cache.get_pipe_phases, pipe_id, api_token)
+        pipe_members = await run_in_threadpool(schema_cache.get_pipe_members, pipe_id, api_token)
         
         # Armazenar no cache
         user_fields_cache[current_user.email] = {
@@ -87,15 +140,43 @@ async def get_phases(pipe_id: str, current_user: User = Depends(get_current_user
         logger.error(f"Error fetching pipe phases: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.post("/get_fields")
-async def get_fields(phase_id: str, current_user: User = Depends(get_current_user)):
+@router.post("/pipe_schema")
+async def get_pipe_schema(pipe_id: str, current_user: User = Depends(get_current_user)):
+    if pipe_id.startswith("http"):
+        pipe_id = pipe_id.split("/")[-1]
+    
     try:
         api_token = await get_pipefy_token(current_user)
-        fields = pipefy_service.get_phase_fields(phase_id, api_token)
+        schema = await run_in_threadpool(schema_cache.get_pipe_schema, pipe_id, api_token)
         
-        # Recuperar membros do pipe do cache
+        # Mesmo estado que /get_phases deixa no cache, mais o snapshot completo
+        # para que /get_fields seja atendido sem nova chamada ao Pipefy
+        user_fields_cache[current_user.email] = {
+            "pipe_id": pipe_id,
+            "phases": [{"id": phase["id"], "name": phase["name"]} for phase in schema["phases"]],
+            "pipe_members": schema["members"],
+            "schema": schema
+        }
+        
+        return schema
+    except Exception as e:
+        logger.error(f"Error fetching pipe schema: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/get_fields")
+async def get_fields(phase_id: str, current_user: User = Depends(get_current_user)):
+    try:
         user_data = user_fields_cache.get(current_user.email, {})
-        pipe_members = user_data.get('pipe_members', [])
+        schema = user_data.get('schema')
+        
+        # Usar o snapshot de /pipe_schema quando a fase pertence a ele
+        if schema and any(str(phase['id']) == str(phase_id) for phase in schema['phases']):
+            fields = template_service.phase_fields_from_schema(schema, phase_id)
+        else:
+            api_token = await get_pipefy_token(current_user)
+            fields = await run_in_threadpool(
+                schema_cache.get_phase_fields, phase_id, api_token, user_data.get('pipe_id')
+            )
         
         # Armazenar os campos e o phase_id para este usuário
         user_fields_cache[current_user.email].update({
@@ -119,6 +200,7 @@ async def prepare_fields_selection(
         if not user_data:
             raise HTTPException(status_code=400, detail="Please fetch fields first")
         
+        await refresh_session_schema(current_user, user_data)
         all_fields = user_data.get('fields', [])
         pipe_members = user_data.get('pipe_members', [])
         
@@ -180,7 +262,7 @@ async def get_pipe_members(request: Request, pipe_id: str = None, current_user:
         
         api_token = await get_pipefy_token(current_user)
         logger.info(f"Fetching members for pipe_id: {pipe_id}")
-        members = pipefy_service.get_pipe_members(pipe_id, api_token)
+        members = await run_in_threadpool(schema_cache.get_pipe_members, pipe_id, api_token)
         
         # Log da resposta para depuração
         logger.debug(f"Members fetched: {members}")
@@ -191,13 +273,18 @@ async def get_pipe_members(request: Request, pipe_id: str = None, current_user:
         raise HTTPException(status_code=400, detail=f"Error fetching pipe members: {str(e)}")
 
 @router.post("/generate_xlsx_template")
-async def generate_xlsx_template(data: TemplateGenerationModel, current_user: User = Depends(get_current_user)):
+async def generate_xlsx_template(
+    data: TemplateGenerationModel,
+    prefill: bool = False,
+    current_user: User = Depends(get_current_user)
+):
     try:
         user_data = user_fields_cache.get(current_user.email)
         
         if not user_data:
             raise HTTPException(status_code=400, detail="Please prepare field selection first")
         
+        await refresh_session_schema(current_user, user_data)
         all_fields = user_data.get('fields', [])
         
         logger.info(f"Received selected fields: {data.selected_fields}")
@@ -212,48 +299,38 @@ async def generate_xlsx_template(data: TemplateGenerationModel, current_user: Us
         
         logger.info(f"Selected field details: {selected_field_details}")
         
-        wb = Workbook()
-        ws = wb.active
-        
-        # Cabeçalho visível do XLSX (apenas labels)
-        visible_headers = ["ID do card"] + [field['label'] for field in selected_field_details]
-        ws.append(visible_headers)
-        
-        # Cabeçalho oculto com IDs dos campos
-        hidden_headers = ["card_id"] + [field['id'] for field in selected_field_details]
-        ws.append(hidden_headers)
-        
-        # Ocultar a linha com os IDs
-        ws.row_dimensions[2].hidden = True
-        
-        # Adicionar o responsável selecionado como valor padrão para campos assignee
-        for row in ws.iter_rows(min_row=3, max_row=3):
-            for cell, field in zip(row[1:], selected_field_details):
-                if field['type'] == 'assignee_select':
-                    cell.value = data.selected_user
-        
-        # Ajustar a largura das colunas
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            adjusted_width = (max_length + 2) * 1.2
-            ws.column_dimensions[column].width = adjusted_width
-        
-        # Salvar o arquivo
-        buffer = BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
-        
-        return StreamingResponse(iter([buffer.getvalue()]),
-                                 media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                 headers={"Content-Disposition": "attachment;filename=update_template.xlsx"})
+        # Com prefill, os valores atuais dos cards da fase são buscados página
+        # a página e escritos diretamente no arquivo
+        card_pages = None
+        if prefill:
+            if not user_data.get('phase_id'):
+                raise HTTPException(status_code=400, detail="Please fetch fields first")
+            pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+            api_token = await get_pipefy_token(current_user)
+            card_pages = pipefy_service.iter_phase_cards(user_data['phase_id'], api_token)
+        
+        # Gerar em disco fora do event loop e enviar em blocos
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+            path = tmp.name
+        try:
+            rows_written = await run_in_threadpool(
+                xlsx_service.write_update_template, path, selected_field_details, data.selected_user, card_pages,
+                phase_id=user_data.get('phase_id')
+            )
+        except Exception:
+            os.remove(path)
+            raise
+        
+        if prefill:
+            logger.info(f"Template pre-filled with {rows_written} cards")
+        
+        return StreamingResponse(xlsx_service.iter_file_chunks(path),
+                                 media_type=xlsx_service.XLSX_MEDIA_TYPE,
+                                 headers={"Content-Disposition": "attachment;filename=update_template.xlsx"},
+                                 background=BackgroundTask(os.remove, path))
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao gerar template XLSX: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro ao gerar template: {str(e)}")
@@ -261,57 +338,202 @@ async def generate_xlsx_template(data: TemplateGenerationModel, current_user: Us
 @router.post("/update_cards_from_xlsx")
 async def update_cards_from_xlsx(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    dry_run: bool = False,
+    annotate: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_upload_job)
 ):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
     try:
         user_data = user_fields_cache.get(current_user.email)
         
         if not user_data:
             raise HTTPException(status_code=400, detail="Please prepare field selection first")
         
-        contents = await file.read()
-        wb = load_workbook(filename=BytesIO(contents), data_only=True)
-        ws = wb.active
+        await refresh_session_schema(current_user, user_data)
+        
+        # O arquivo é lido em blocos e analisado direto do spool do upload,
+        # sem copiar o conteúdo inteiro para a memória
+        upload = await upload_service.spool_upload(file)
+        field_ids, rows = await run_in_threadpool(xlsx_service.parse_update_workbook, upload.file)
         
+        rows_with_updates = []
+        for row_index, card_id, field_updates in rows:
+            if not field_updates:
+                logger.warning(f"No updates for card {card_id}")
+                continue
+            rows_with_updates.append((row_index, card_id, field_updates))
+        
+        # Validar e normalizar todas as colunas localmente antes de enviar ao Pipefy
+        valid_rows, validation_errors = validation_service.validate_rows(
+            rows_with_updates,
+            user_data.get('fields', []),
+            user_data.get('pipe_members')
+        )
+        
+        if dry_run:
+            return {
+                "dry_run": True,
+                "total_rows": len(rows_with_updates),
+                "valid_rows": len(valid_rows),
+                "errors": validation_errors
+            }
+        
+        admission.add_rows(job, len(valid_rows))
         api_token = await get_pipefy_token(current_user)
         
-        results = []
+        normalized_updates = {row_index: field_updates for row_index, _, field_updates in valid_rows}
+        errors_by_row = validation_service.group_errors_by_row(validation_errors)
+        
+        # Linhas rejeitadas na validação entram no job já concluídas, para que
+        # os resultados mantenham a ordem da planilha
+        items = []
+        completed = {}
+        for seq, (row_index, card_id, field_updates) in enumerate(rows_with_updates):
+            if row_index in errors_by_row:
+                completed[seq] = validation_service.rejected_result(card_id, errors_by_row[row_index])
+            items.append({"card_id": card_id, "field_updates": normalized_updates.get(row_index, field_updates)})
         
-        visible_headers = [cell.value for cell in ws[1]]
-        field_ids = [cell.value for cell in ws[2]]  # Hidden row with field IDs
+        response = await run_bulk_job(current_user, idempotency_key, "update_move", items, api_token, completed)
+        
+        if not response["results"]:
+            logger.warning("No cards were updated")
+        else:
+            log_event(
+                logger, logging.INFO, "bulk.xlsx_update",
+                idempotency_key=response["idempotency_key"],
+                rows=len(response["results"]),
+                failed=sum(1 for result in response["results"] if not result.get('success'))
+            )
+        
+        if annotate:
+            # Devolve a própria planilha com status, mensagem e latência por
+            # linha, e as células com erro destacadas e comentadas
+            results_by_row = {
+                row_index: result
+                for (row_index, _, _), result in zip(rows_with_updates, response["results"])
+            }
+            with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+                path = tmp.name
+            try:
+                await run_in_threadpool(xlsx_service.write_result_workbook, upload.file, path, results_by_row)
+            except Exception:
+                os.remove(path)
+                raise
+            return StreamingResponse(xlsx_service.iter_file_chunks(path),
+                                     media_type=xlsx_service.XLSX_MEDIA_TYPE,
+                                     headers={"Content-Disposition": "attachment;filename=update_results.xlsx",
+                                              "X-Idempotency-Key": response["idempotency_key"]},
+                                     background=BackgroundTask(os.remove, path))
+        
+        return trusted_json(response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating cards from XLSX: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error updating cards: {str(e)}")
+    
+@router.post("/update_cards_from_workbook")
+async def update_cards_from_workbook(
+    file: UploadFile = File(...),
+    pipe_id: Optional[str] = None,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_upload_job)
+):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    
+    pipe_id = pipe_id or user_fields_cache.get(current_user.email, {}).get('pipe_id')
+    if not pipe_id:
+        raise HTTPException(status_code=400, detail="pipe_id is required")
+    
+    upload = await upload_service.spool_to_disk(file)
+    try:
+        api_token = await get_pipefy_token(current_user)
+        schema = await run_in_threadpool(schema_cache.get_pipe_schema, pipe_id, api_token)
         
-        for row_index, row in enumerate(ws.iter_rows(min_row=3, values_only=True), start=3):
-            if not row[0]:  # Skip if no card ID
+        # Cada aba vira um job próprio, com a chave da planilha mais o nome da
+        # aba (as abas chegam fora de ordem, então a posição não serve).
+        # Reenviar o arquivo com a mesma chave devolve as abas já concluídas
+        idempotency_key = idempotency_key or bulk_job_service.new_idempotency_key()
+        sheets = []
+        # As abas são analisadas em paralelo no pool de processos; cada uma é
+        # validada e enviada assim que fica pronta
+        async for sheet_name, field_ids, compact_rows in xlsx_service.parse_workbook_sheets(upload.file):
+            sheet = {"sheet": sheet_name, "phase_id": None, "results": [], "errors": []}
+            sheet_key = f"{idempotency_key}:{sheet_name}"
+            sheets.append(sheet)
+            
+            if not compact_rows:
                 continue
-                
-            card_id = str(row[0])
-            field_updates = {}
             
-            for i, value in enumerate(row[1:], start=1):
-                if value is not None:
-                    field_id = field_ids[i]
-                    field_updates[field_id] = str(value)
+            # A fase vem da linha oculta (fase ou template explícitos) ou, em
+            # planilhas antigas, da fase cujos campos coincidem com os ids
+            kind, target = xlsx_service.sheet_target(field_ids[0] if field_ids else None)
+            if kind == "template" and ObjectId.is_valid(target):
+                template = await MongoDB.database.templates.find_one(
+                    {"_id": ObjectId(target), "user_id": str(current_user.id)}
+                ) or {}
+                target = template.get("compiled", {}).get("phase_id") or template.get("phase_id")
+            try:
+                phase = (
+                    pipefy_service.schema_phase(schema, target) if target
+                    else pipefy_service.match_phase_by_fields(schema, field_ids[1:])
+                )
+            except Exception:
+                phase = None
+            if not phase:
+                sheet["errors"].append({"message": "Could not match this sheet to a phase of the pipe"})
+                continue
+            sheet["phase_id"] = phase["id"]
             
-            if not field_updates:
-                logger.warning(f"No updates for card {card_id}")
+            rows = []
+            for row_index, card_id, values in compact_rows:
+                field_updates = xlsx_service.row_updates(field_ids, values)
+                if field_updates:
+                    rows.append((row_index, card_id, field_updates))
+            
+            valid_rows, validation_errors = validation_service.validate_rows(rows, phase["fields"], schema["members"])
+            sheet["errors"] = validation_errors
+            
+            if dry_run:
+                sheet["total_rows"] = len(rows)
+                sheet["valid_rows"] = len(valid_rows)
                 continue
             
-            try:
-                success, message = pipefy_service.update_card_fields(card_id, field_updates, api_token)
-                results.append({"card_id": card_id, "success": success, "message": message})
-            except Exception as e:
-                logger.error(f"Error updating card {card_id}: {str(e)}", exc_info=True)
-                results.append({"card_id": card_id, "success": False, "message": str(e)})
-        
-        if not results:
-            logger.warning("No cards were updated")
-        else:
-            logger.info(f"Update results: {results}")
+            admission.add_rows(job, len(valid_rows))
+            normalized_updates = {row_index: field_updates for row_index, _, field_updates in valid_rows}
+            errors_by_row = validation_service.group_errors_by_row(validation_errors)
+            
+            # Como em update_cards_from_xlsx: as linhas rejeitadas entram no
+            # job já concluídas, na ordem da aba
+            items = []
+            completed = {}
+            for seq, (row_index, card_id, field_updates) in enumerate(rows):
+                if row_index in errors_by_row:
+                    completed[seq] = validation_service.rejected_result(card_id, errors_by_row[row_index])
+                items.append({"card_id": card_id, "field_updates": normalized_updates.get(row_index, field_updates)})
+            
+            response = await run_bulk_job(current_user, sheet_key, "update_move", items, api_token, completed)
+            sheet["idempotency_key"] = response["idempotency_key"]
+            sheet["results"] = response["results"]
+            logger.info(f"Sheet {sheet_name}: {len(valid_rows)} cards sent to phase {phase['id']}")
         
-        return {"results": results}
+        return trusted_json({
+            "dry_run": dry_run,
+            "idempotency_key": None if dry_run else idempotency_key,
+            "sha256": upload.sha256,
+            "sheets": sheets
+        })
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error updating cards from XLSX: {str(e)}", exc_info=True)
+        logger.error(f"Error updating cards from workbook: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error updating cards: {str(e)}")
+    finally:
+        os.remove(upload.file)
     
 @router.post("/pipes", response_model=PipeInDB)
 async def create_pipe(pipe: PipeCreate, current_user: User = Depends(get_current_user)):
@@ -323,6 +545,7 @@ async def create_pipe(pipe: PipeCreate, current_user: User = Depends(get_current
             user_id=str(current_user.id)
         )
         result = await MongoDB.database.pipes.insert_one(new_pipe.dict())
+        etag_service.bump(current_user.email, etag_service.PIPES)
         logger.info(f"Created new pipe with id: {result.inserted_id}")
         return new_pipe
     except Exception as e:
@@ -340,6 +563,7 @@ async def update_pipe(pipe_id: str, pipe: PipeUpdate, current_user: User = Depen
         if not updated_pipe:
             logger.warning(f"Pipe not found: {pipe_id}")
             raise HTTPException(status_code=404, detail="Pipe not found")
+        etag_service.bump(current_user.email, etag_service.PIPES)
         logger.info(f"Updated pipe: {pipe_id}")
         return PipeInDB(**{k: v for k, v in updated_pipe.items() if k != '_id'}, id=str(updated_pipe["_id"]))
     except Exception as e:
@@ -351,10 +575,19 @@ async def delete_pipe(pipe_id: str, current_user: User = Depends(get_current_use
     result = await MongoDB.database.pipes.delete_one({"_id": ObjectId(pipe_id), "user_id": str(current_user.id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Pipe not found")
+    etag_service.bump(current_user.email, etag_service.PIPES)
     return {"message": "Pipe deleted successfully"}
 
 @router.get("/pipes", response_model=List[PipeInDB])
-async def get_pipes(current_user: User = Depends(get_current_user)):
+async def get_pipes(request: Request, response: Response, email: str = Depends(get_current_email)):
+    # O ETag é calculado antes da leitura: se o cliente já tem esta versão,
+    # responde 304 sem consultar o Mongo
+    current_etag = etag_service.etag(email, etag_service.PIPES)
+    if etag_service.matches(request.headers.get("if-none-match"), current_etag):
+        return etag_service.not_modified(current_etag)
+    etag_service.set_headers(response, current_etag)
+    
+    current_user = await load_user(email)
     logger.info(f"Fetching pipes for user: {current_user.id}")
     pipes = await MongoDB.database.pipes.find({"user_id": str(current_user.id)}).to_list(None)
     logger.info(f"Found {len(pipes)} pipes")
@@ -384,13 +617,48 @@ async def save_template(
         "selected_user": template_data.get("selected_user", ""),
         "need_field_update": len(template_data["fields"]) > 0
     }
+    
+    # Compilar o snapshot do esquema para que o template possa ser aplicado
+    # sem novas consultas ao Pipefy. Reaproveita o cache do assistente quando
+    # ele corresponde ao mesmo pipe/fase.
+    try:
+        user_data = user_fields_cache.get(current_user.email, {})
+        if (
+            user_data.get("phase_id") == str(template["phase_id"])
+            and user_data.get("pipe_id") == template_service.normalize_pipe_id(template["pipe_id"])
+            and "fields" in user_data and "pipe_members" in user_data
+        ):
+            phase_fields, pipe_members = user_data["fields"], user_data["pipe_members"]
+        else:
+            api_token = await get_pipefy_token(current_user)
+            phase_fields, pipe_members = await run_in_threadpool(
+                template_service.fetch_schema, template["pipe_id"], template["phase_id"], api_token
+            )
+        template["compiled"] = template_service.compile_template(
+            template["pipe_id"], template["phase_id"], template["fields"],
+            template["selected_user"], phase_fields, pipe_members
+        )
+    except Exception as e:
+        # O template continua utilizável; será compilado na primeira aplicação
+        logger.warning(f"Could not compile template '{template['name']}': {str(e)}")
+    
     result = await MongoDB.database.templates.insert_one(template)
+    etag_service.bump(current_user.email, etag_service.TEMPLATES)
     return {"id": str(result.inserted_id), "message": "Template saved successfully"}
 
 
 @router.get("/templates")
-async def get_templates(current_user: User = Depends(get_current_user)):
-    templates = await MongoDB.database.templates.find({"user_id": str(current_user.id)}).to_list(None)
+async def get_templates(request: Request, response: Response, email: str = Depends(get_current_email)):
+    current_etag = etag_service.etag(email, etag_service.TEMPLATES)
+    if etag_service.matches(request.headers.get("if-none-match"), current_etag):
+        return etag_service.not_modified(current_etag)
+    etag_service.set_headers(response, current_etag)
+    
+    current_user = await load_user(email)
+    templates = await MongoDB.database.templates.find(
+        {"user_id": str(current_user.id)},
+        {"compiled.phase_fields": 0, "compiled.pipe_members": 0, "compiled.mutation_plan": 0}
+    ).to_list(None)
     return [
         {
             "id": str(template["_id"]),
@@ -398,11 +666,167 @@ async def get_templates(current_user: User = Depends(get_current_user)):
             "pipe_id": template.get("pipe_id", ""),
             "phase_id": template.get("phase_id", ""),
             "fields": template.get("fields", []),
-            "selected_user": template.get("selected_user", "")
+            "selected_user": template.get("selected_user", ""),
+            "schema_hash": template.get("compiled", {}).get("schema_hash")
         } 
         for template in templates
     ]
 
+@router.post("/templates/{template_id}/apply")
+async def apply_template(
+    template_id: str,
+    verify: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    template = await MongoDB.database.templates.find_one({"_id": ObjectId(template_id), "user_id": str(current_user.id)})
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    try:
+        recompiled = False
+        compiled = template.get("compiled") if template_service.is_compiled(template) else None
+        
+        if compiled is None:
+            api_token = await get_pipefy_token(current_user)
+            compiled = await run_in_threadpool(template_service.compile_from_pipefy, template, api_token)
+            recompiled = True
+        elif verify:
+            # Só recompila se o esquema atual no Pipefy tiver outro hash
+            api_token = await get_pipefy_token(current_user)
+            phase_fields, pipe_members = await run_in_threadpool(
+                template_service.fetch_schema, template["pipe_id"], template["phase_id"], api_token, use_cache=False
+            )
+            if template_service.schema_hash(phase_fields, pipe_members) != compiled["schema_hash"]:
+                compiled = template_service.compile_template(
+                    template["pipe_id"], template["phase_id"], template.get("fields", []),
+                    template.get("selected_user", ""), phase_fields, pipe_members
+                )
+                recompiled = True
+        
+        if recompiled:
+            await MongoDB.database.templates.update_one(
+                {"_id": template["_id"]},
+                {"$set": {"compiled": compiled, "schema_stale": False}}
+            )
+            etag_service.bump(current_user.email, etag_service.TEMPLATES)
+            logger.info(f"Template {template_id} recompiled with schema hash {compiled['schema_hash']}")
+        
+        # Deixar o cache pronto para /generate_xlsx_template e /update_cards_from_xlsx
+        user_fields_cache[current_user.email] = template_service.cache_entry(compiled)
+        
+        return {
+            "id": template_id,
+            "name": template.get("name", ""),
+            "pipe_id": compiled["pipe_id"],
+            "phase_id": compiled["phase_id"],
+            "schema_hash": compiled["schema_hash"],
+            "recompiled": recompiled,
+            "selected_fields": compiled["selected_field_ids"],
+            "selected_user": template.get("selected_user", ""),
+            "mutation_plan": compiled["mutation_plan"],
+            "missing_fields": compiled["missing_fields"],
+            "assignee_options": template_service.assignee_options(compiled)
+        }
+    except Exception as e:
+        logger.error(f"Error applying template {template_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=f"Error applying template: {str(e)}")
+
+class FanOutCard(BaseModel):
+    card_id: str
+    values: Dict[str, Any] = {}
+
+class FanOutPipe(BaseModel):
+    pipe_id: str
+    cards: List[FanOutCard]
+
+class FanOutModel(BaseModel):
+    pipes: List[FanOutPipe]
+    # Conjunto de atualizações (por label) aplicado a todos os cards; os
+    # valores de cada card têm precedência
+    values: Dict[str, Any] = {}
+
+@router.post("/templates/{template_id}/fan_out")
+async def fan_out_template(
+    template_id: str,
+    data: FanOutModel,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
+):
+    # Aplica o mesmo template em vários pipes salvos (cópias regionais): os
+    # ids dos campos são resolvidos por label em cada pipe e todos os pipes
+    # compartilham o mesmo limite de concorrência e a fila do agendador
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    template = await MongoDB.database.templates.find_one({"_id": ObjectId(template_id), "user_id": str(current_user.id)})
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    
+    admission.add_rows(job, sum(len(entry.cards) for entry in data.pipes))
+    api_token = await get_pipefy_token(current_user)
+    
+    try:
+        if template_service.is_compiled(template):
+            compiled = template["compiled"]
+        else:
+            compiled = await run_in_threadpool(template_service.compile_from_pipefy, template, api_token)
+    except Exception as e:
+        logger.error(f"Error compiling template {template_id}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=400, detail=f"Error compiling template: {str(e)}")
+    
+    labels = fanout_service.template_labels(compiled)
+    saved_ids = [ObjectId(entry.pipe_id) for entry in data.pipes if ObjectId.is_valid(entry.pipe_id)]
+    saved_pipes = {
+        str(pipe["_id"]): pipe
+        for pipe in await MongoDB.database.pipes.find(
+            {"_id": {"$in": saved_ids}, "user_id": str(current_user.id)}
+        ).to_list(None)
+    }
+    semaphore = asyncio.Semaphore(settings.FANOUT_MAX_CONCURRENT_PIPES)
+    
+    async def run_pipe(entry: FanOutPipe) -> Dict:
+        group = {"pipe_id": entry.pipe_id, "phase_id": None, "results": [], "errors": [], "missing_labels": []}
+        pipe = saved_pipes.get(entry.pipe_id)
+        if not pipe:
+            group["errors"].append({"message": "Pipe not found"})
+            return group
+        group["name"] = pipe.get("name")
+        
+        async with semaphore:
+            try:
+                schema = await run_in_threadpool(schema_cache.get_pipe_schema, pipe["pipeId"], api_token)
+                plan = fanout_service.plan_pipe(schema, labels, [card.dict() for card in entry.cards], data.values)
+                group.update(phase_id=plan["phase_id"], errors=plan["errors"], missing_labels=plan["missing_labels"])
+                
+                if dry_run or not plan["items"]:
+                    group["valid_rows"] = len(plan["items"]) - len(plan["completed"])
+                    return group
+                
+                key = f"{idempotency_key}:{entry.pipe_id}" if idempotency_key else None
+                response = await run_bulk_job(current_user, key, "update_move", plan["items"], api_token, plan["completed"])
+                group["idempotency_key"] = response["idempotency_key"]
+                group["results"] = response["results"]
+            except HTTPException as e:
+                group["errors"].append({"message": e.detail})
+            except Exception as e:
+                logger.error(f"Fan-out to pipe {pipe['pipeId']} failed: {str(e)}", exc_info=True)
+                group["errors"].append({"message": str(e)})
+        return group
+    
+    groups = await asyncio.gather(*(run_pipe(entry) for entry in data.pipes))
+    log_event(
+        logger, logging.INFO, "bulk.fan_out",
+        template_id=template_id, pipes=len(groups), rows=sum(len(group["results"]) for group in groups)
+    )
+    return trusted_json({
+        "template_id": template_id,
+        "dry_run": dry_run,
+        "unknown_labels": fanout_service.unknown_labels(
+            labels, data.values, [card.dict() for entry in data.pipes for card in entry.cards]
+        ),
+        "pipes": groups
+    })
+
 @router.delete("/templates/{template_id}")
 async def delete_template(
     template_id: str,
@@ -411,6 +835,7 @@ async def delete_template(
     result = await MongoDB.database.templates.delete_one({"_id": ObjectId(template_id), "user_id": str(current_user.id)})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Template not found")
+    etag_service.bump(current_user.email, etag_service.TEMPLATES)
     return {"message": "Template deleted successfully"}
 
 class MoveCardsModel(BaseModel):
@@ -420,55 +845,156 @@ class MoveCardsModel(BaseModel):
 @router.post("/move_cards")
 async def move_cards(
     data: MoveCardsModel, 
-    current_user: User = Depends(get_current_user)
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
 ):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    admission.add_rows(job, len(data.card_ids))
     try:
         api_token = await get_pipefy_token(current_user)
         
-        success, result = pipefy_service.move_cards(
-            card_ids=data.card_ids, 
-            destination_phase_id=data.destination_phase_id, 
-            api_token=api_token
-        )
+        items = [
+            {"card_id": card_id, "destination_phase_id": data.destination_phase_id}
+            for card_id in data.card_ids
+        ]
+        response = await run_bulk_job(current_user, idempotency_key, "move", items, api_token)
         
-        if not success:
-            raise HTTPException(status_code=400, detail=result)
+        if response["results"] and not any(result.get('success') for result in response["results"]):
+            raise HTTPException(status_code=400, detail=response["results"])
         
-        return {"results": result}
+        return trusted_json(response)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error moving cards: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error moving cards: {str(e)}")
 
 
+class CardFieldPredicate(BaseModel):
+    field: str
+    operator: str = "eq"
+    value: Optional[Any] = None
+
+class MoveCardsByFilterModel(BaseModel):
+    source_phase_id: str
+    destination_phase_id: str
+    predicates: List[CardFieldPredicate] = []
+    created_from: Optional[datetime.datetime] = None
+    created_to: Optional[datetime.datetime] = None
+    updated_from: Optional[datetime.datetime] = None
+    updated_to: Optional[datetime.datetime] = None
+
+async def filter_move_summary(current_user: User, key: str, pages_read: Optional[int] = None) -> Dict:
+    # Só contadores e falhas: a lista completa por card nunca é montada
+    bulk = await bulk_job_service.get_job(str(current_user.id), key)
+    summary = {
+        "idempotency_key": key,
+        "status": bulk["status"],
+        "matched": bulk["total"],
+        "moved": bulk.get("succeeded", 0),
+        "failed": bulk.get("failed", 0),
+        "failures": await bulk_job_service.job_failures(bulk["_id"])
+    }
+    if pages_read is not None:
+        summary["pages_read"] = pages_read
+    return summary
+
+@router.post("/move_cards_by_filter")
+async def move_cards_by_filter(
+    data: MoveCardsByFilterModel,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
+):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    if str(data.source_phase_id) == str(data.destination_phase_id):
+        raise HTTPException(status_code=400, detail="Source and destination phases must be different")
+    try:
+        api_token = await get_pipefy_token(current_user)
+        predicates = [predicate.dict() for predicate in data.predicates]
+        pages_read = 0
+        
+        async def matched_pages():
+            # A fase de origem é lida uma vez; cada página de ids que casam
+            # com o filtro é gravada no job "move" assim que chega
+            nonlocal pages_read
+            async for card_ids in iterate_in_threadpool(pipefy_service.iter_cards_by_filter(
+                data.source_phase_id, api_token, predicates,
+                data.created_from, data.created_to, data.updated_from, data.updated_to
+            )):
+                pages_read += 1
+                admission.add_rows(job, len(card_ids))
+                yield [
+                    {
+                        "card_id": card_id,
+                        "source_phase_id": data.source_phase_id,
+                        "destination_phase_id": data.destination_phase_id
+                    }
+                    for card_id in card_ids
+                ]
+        
+        try:
+            # O resultado do filtro muda depois que os cards são movidos: a
+            # repetição de uma chave já usada devolve o job original sem ler a fase
+            key, created = await bulk_job_service.execute_streamed(
+                str(current_user.id), idempotency_key, "move", data.dict(), matched_pages(), api_token,
+                plan=current_user.subscription_plan or "free"
+            )
+        except bulk_job_service.JobConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except bulk_job_service.JobInterrupted as e:
+            raise job_interrupted(e)
+        summary = await filter_move_summary(current_user, key, pages_read if created else None)
+        logger.info(
+            f"Move by filter from phase {data.source_phase_id}: "
+            f"{summary['moved']} moved, {summary['failed']} failed"
+        )
+        return trusted_json(summary)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error moving cards by filter: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error moving cards: {str(e)}")
+
+
 @router.post("/mass_move_update_cards")
 async def mass_move_update_cards(
     pipe_id: str = Body(...),
     cards_data: List[Dict[str, Any]] = Body(...),
-    current_user: User = Depends(get_current_user)
+    destination_phase_id: Optional[str] = Body(None),
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
 ):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    admission.add_rows(job, len(cards_data))
     try:
-        # Log detalhado dos dados recebidos
-        logger.info(f"Pipe ID recebido: {pipe_id}")
-        logger.info(f"Dados dos cards recebidos: {json.dumps(cards_data, indent=2)}")
+        log_event(logger, logging.INFO, "bulk.mass_move_update", pipe_id=pipe_id, cards=len(cards_data))
+        logger.debug("Dados dos cards recebidos: %s", cards_data)
         
         api_token = await get_pipefy_token(current_user)
         
         # Recuperar mapeamento de campos do pipe
         try:
-            field_map = {
-                field['label']: field['id'] 
-                for field in pipefy_service.get_pipe_fields(pipe_id, api_token)
-            }
-            logger.info(f"Mapeamento de campos: {json.dumps(field_map, indent=2)}")
+            pipe_fields = await run_in_threadpool(schema_cache.get_pipe_fields, pipe_id, api_token)
+            field_map = {field['label']: field['id'] for field in pipe_fields}
+            logger.debug("Mapeamento de campos: %s", field_map)
         except Exception as field_error:
             logger.error(f"Erro ao recuperar campos: {str(field_error)}")
             raise HTTPException(status_code=400, detail=f"Erro ao recuperar campos: {str(field_error)}")
         
-        results = []
+        rows = []
+        # Fase de destino por card; a do corpo da requisição vale como padrão
+        destinations = {}
         
-        for card_data in cards_data:
+        for index, card_data in enumerate(cards_data):
             card_id = card_data.get('card_id')
             fields_to_update = card_data.get('fields', [])
+            destinations[index] = card_data.get('destination_phase_id') or destination_phase_id
             
             if not card_id:
                 logger.warning("Card ID não fornecido")
@@ -481,7 +1007,7 @@ async def mass_move_update_cards(
                 value = field_update.get('value')
                 
                 # Log de cada campo sendo processado
-                logger.info(f"Processando campo: Label={field_label}, Valor={value}")
+                logger.debug("Processando campo: Label=%s, Valor=%s", field_label, value)
                 
                 # Encontrar o ID do campo pelo label
                 field_id = field_map.get(field_label)
@@ -490,25 +1016,51 @@ async def mass_move_update_cards(
                     logger.warning(f"Campo não encontrado: {field_label}")
                     continue
                 
-                field_updates[field_id] = str(value)
-            
-            logger.info(f"Atualizações para o card {card_id}: {json.dumps(field_updates, indent=2)}")
-            
-            # Atualizar campos do card
-            success, message = pipefy_service.update_card_fields(
-                card_id=card_id, 
-                field_updates=field_updates, 
-                api_token=api_token
-            )
+                if value is None:
+                    continue
+                
+                field_updates[field_id] = value
             
-            results.append({
-                'card_id': card_id,
-                'success': success,
-                'message': message
+            rows.append((index, str(card_id), field_updates))
+        
+        # Membros só são buscados se algum campo assignee for atualizado
+        pipe_members = None
+        updated_field_ids = {field_id for _, _, field_updates in rows for field_id in field_updates}
+        if validation_service.needs_members(pipe_fields, updated_field_ids):
+            pipe_members = await run_in_threadpool(schema_cache.get_pipe_members, pipe_id, api_token)
+        
+        valid_rows, validation_errors = validation_service.validate_rows(rows, pipe_fields, pipe_members)
+        
+        if dry_run:
+            return {
+                "dry_run": True,
+                "total_rows": len(rows),
+                "valid_rows": len(valid_rows),
+                "errors": validation_errors
+            }
+        
+        errors_by_row = validation_service.group_errors_by_row(validation_errors)
+        normalized_updates = {index: field_updates for index, _, field_updates in valid_rows}
+        
+        # Atualizações e movimentação de cada card vão no mesmo documento de
+        # mutation (campos primeiro, depois o moveCardToPhase)
+        items = []
+        completed = {}
+        for seq, (index, card_id, field_updates) in enumerate(rows):
+            if index in errors_by_row:
+                completed[seq] = validation_service.rejected_result(card_id, errors_by_row[index])
+            else:
+                logger.debug("Atualizações para o card %s: %s", card_id, normalized_updates[index])
+            items.append({
+                "card_id": card_id,
+                "field_updates": normalized_updates.get(index, field_updates),
+                "destination_phase_id": destinations[index]
             })
         
-        return {"results": results}
+        return trusted_json(await run_bulk_job(current_user, idempotency_key, "update_move", items, api_token, completed))
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro ao atualizar cards em massa: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -523,7 +1075,7 @@ async def get_database_fields(
     try:
         api_token = await get_pipefy_token(current_user)
         logger.info(f"Fetching fields for database ID: {request.database_id}")
-        fields = pipefy_service.get_database_fields(request.database_id, api_token)
+        fields = await run_in_threadpool(pipefy_service.get_database_fields, request.database_id, api_token)
         logger.info(f"Retrieved {len(fields)} fields")
         logger.debug(f"Fields: {fields}")  # Adicione este log para ver todos os campos retornados
         return {"table_fields": fields}
@@ -535,12 +1087,163 @@ async def get_database_fields(
 async def create_database_records(
     database_id: str = Body(...),
     records: List[Dict[str, Any]] = Body(...),
-    current_user: User = Depends(get_current_user)
+    upsert_key_field: Optional[str] = Body(None),
+    idempotency_key: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
 ):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    admission.add_rows(job, len(records))
     try:
         api_token = await get_pipefy_token(current_user)
-        results = pipefy_service.create_database_records(database_id, records, api_token)
-        return {"results": results}
+        if not upsert_key_field:
+            items = [{"database_id": database_id, "record": record} for record in records]
+            return trusted_json(await run_bulk_job(current_user, idempotency_key, "create_record", items, api_token))
+
+        # O plano de um upsert depende do estado atual da tabela: a repetição de
+        # uma chave já usada devolve o job original em vez de replanejar
+        existing = await bulk_job_service.get_job(str(current_user.id), idempotency_key) if idempotency_key else None
+        if existing:
+            if existing["status"] != bulk_job_service.COMPLETED:
+                raise HTTPException(status_code=409, detail=f"Bulk job {idempotency_key} is {existing['status']}; use the resume endpoint to continue it")
+            return trusted_json({
+                "idempotency_key": idempotency_key,
+                "results": await bulk_job_service.job_results(existing["_id"])
+            })
+
+        # Upsert: índice dos registros existentes pela chave escolhida, e só as
+        # linhas novas ou alteradas viram mutations
+        index = await run_in_threadpool(upsert_service.build_index, database_id, upsert_key_field, api_token)
+        plan = upsert_service.plan_upsert(database_id, records, upsert_key_field, index)
+        logger.info(f"Upsert into table {database_id}: {plan['counts']}")
+        response = await run_bulk_job(
+            current_user, idempotency_key, "upsert_record", plan["items"], api_token, plan["completed"]
+        )
+        response["summary"] = plan["counts"]
+        return trusted_json(response)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating database records: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/bulk_jobs/{idempotency_key}")
+async def get_bulk_job(idempotency_key: str, current_user: User = Depends(get_current_user)):
+    job = await bulk_job_service.get_job(str(current_user.id), idempotency_key)
+    if not job:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    return bulk_job_service.job_summary(job)
+
+@router.post("/bulk_jobs/{idempotency_key}/resume")
+async def resume_bulk_job(
+    idempotency_key: str,
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
+):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    bulk = await bulk_job_service.get_job(str(current_user.id), idempotency_key)
+    if not bulk:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    if bulk["status"] == bulk_job_service.COMPLETED:
+        return trusted_json({"idempotency_key": idempotency_key, "results": await bulk_job_service.job_results(bulk["_id"])})
+    
+    # Só um resume por vez: o job é reivindicado atomicamente no Mongo
+    bulk = await bulk_job_service.claim_for_resume(str(current_user.id), idempotency_key)
+    if not bulk:
+        raise HTTPException(status_code=409, detail="Bulk job is still running")
+    
+    try:
+        pending = bulk["total"] - bulk.get("succeeded", 0) - bulk.get("failed", 0)
+        admission.add_rows(job, pending)
+        api_token = await get_pipefy_token(current_user)
+        quota_service.check_budget(
+            str(current_user.id), current_user.subscription_plan or "free",
+            quota_service.estimate_calls(bulk["operation"], pending)
+        )
+    except (HTTPException, quota_service.QuotaExceeded):
+        await bulk_job_service.mark_interrupted(bulk["_id"])
+        raise
+    
+    logger.info(f"Resuming bulk job {idempotency_key} ({bulk['operation']})")
+    try:
+        results = await bulk_job_service.run_job(bulk, api_token)
+    except bulk_job_service.JobInterrupted as e:
+        raise job_interrupted(e)
+    return trusted_json({"idempotency_key": idempotency_key, "results": results})
+
+@router.post("/bulk_jobs/{idempotency_key}/undo")
+async def undo_bulk_job(
+    idempotency_key: str,
+    undo_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
+):
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    bulk = await bulk_job_service.get_job(str(current_user.id), idempotency_key)
+    if not bulk:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    if bulk["operation"] not in snapshot_service.OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Bulk jobs of type {bulk['operation']} cannot be undone")
+    if bulk["status"] != bulk_job_service.COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Bulk job is {bulk['status']}; resume it before undoing")
+
+    try:
+        states = await snapshot_service.load(bulk["_id"])
+    except snapshot_service.SnapshotNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    # Só os itens que o Pipefy aceitou são revertidos, e o undo é ele mesmo um
+    # job em massa (com checkpoints e snapshot próprios)
+    inverse = snapshot_service.inverse_operations(await bulk_job_service.succeeded_payloads(bulk["_id"]), states)
+    admission.add_rows(job, len(inverse["items"]))
+    try:
+        api_token = await get_pipefy_token(current_user)
+        response = await run_bulk_job(
+            current_user, undo_key or f"undo:{idempotency_key}", "update_move", inverse["items"], api_token
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error undoing bulk job {idempotency_key}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error undoing bulk job: {str(e)}")
+    response["undone_job"] = idempotency_key
+    response["not_restorable"] = inverse["not_restorable"]
+    return trusted_json(response)
+
+@router.get("/dead_letters")
+async def get_dead_letters(idempotency_key: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    letters = await bulk_job_service.list_dead_letters(str(current_user.id), idempotency_key)
+    return trusted_json({"dead_letters": letters, "total": await bulk_job_service.count_dead_letters(str(current_user.id), idempotency_key)})
+
+@router.post("/dead_letters/retry")
+async def retry_dead_letters(
+    idempotency_key: Optional[str] = Body(None, embed=True),
+    current_user: User = Depends(get_current_user),
+    job: admission.BulkJob = Depends(admission.bulk_job)
+):
+    # Reenvia em massa apenas as linhas que falharam definitivamente,
+    # opcionalmente só as de um job
+    pipefy_scheduler.set_priority(pipefy_scheduler.BULK)
+    total = await bulk_job_service.count_dead_letters(str(current_user.id), idempotency_key)
+    if not total:
+        return {"retried": []}
+    admission.add_rows(job, total)
+    try:
+        api_token = await get_pipefy_token(current_user)
+        return trusted_json({"retried": await bulk_job_service.retry_dead_letters(
+            str(current_user.id), idempotency_key, api_token, plan=current_user.subscription_plan or "free"
+        )})
+    except bulk_job_service.JobInterrupted as e:
+        raise job_interrupted(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrying dead letters: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error retrying dead letters: {str(e)}")
+
+@router.get("/usage")
+async def get_pipefy_usage(days: int = 7, current_user: User = Depends(get_current_user)):
+    # Chamadas ao Pipefy por operação e por dia, com o orçamento do plano
+    days = min(max(days, 1), 90)
+    return await quota_service.usage(str(current_user.id), current_user.subscription_plan or "free", days)
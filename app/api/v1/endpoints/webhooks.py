@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import json
+import logging
+from typing import Any, Dict, Set
+from fastapi import APIRouter, HTTPException, Request
+from app.api.v1.endpoints.pipefy import user_fields_cache
+from app.core.config import settings
+from app.db.mongodb import MongoDB
+from app.services import etag_service, schema_cache
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Pipefy-Signature"
+
+# Prefixos de ações que alteram a estrutura do pipe (fases, campos, membros)
+SCHEMA_ACTION_PREFIXES = ("pipe.", "phase.", "field.", "member.")
+
+webhook_stats: Dict[str, int] = {}
+
+def verify_signature(body: bytes, signature: str) -> bool:
+    if not signature:
+        return False
+    expected = hmac.new(settings.PIPEFY_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    if signature.startswith("sha256="):
+        signature = signature[len("sha256="):]
+    return hmac.compare_digest(expected, signature)
+
+def _id(value: Any):
+    if isinstance(value, dict):
+        value = value.get("id")
+    return str(value) if value not in (None, "") else None
+
+def extract_targets(payload: Dict) -> Dict[str, Any]:
+    data = payload.get("data", payload)
+    action = data.get("action", "")
+    card = data.get("card") or {}
+    field = data.get("field") or {}
+
+    card_ids: Set[str] = {card_id for card_id in [_id(card)] if card_id}
+    phase_ids: Set[str] = {
+        phase_id for phase_id in [
+            _id(data.get("from")), _id(data.get("to")), _id(data.get("phase")),
+            _id(data.get("phase_id")), _id(card.get("current_phase")),
+            _id(field.get("phase")), _id(field.get("phase_id"))
+        ] if phase_id
+    }
+    pipe_ids: Set[str] = {
+        pipe_id for pipe_id in [_id(data.get("pipe")), _id(data.get("pipe_id")), _id(card.get("pipe_id"))]
+        if pipe_id
+    }
+
+    return {
+        "action": action,
+        "schema_change": action.startswith(SCHEMA_ACTION_PREFIXES),
+        "pipe_ids": pipe_ids,
+        "phase_ids": phase_ids,
+        "card_ids": card_ids
+    }
+
+def session_affected(user_data: Dict, pipe_ids: Set[str], phase_ids: Set[str]) -> bool:
+    # Sessão do assistente que usa o pipe ou alguma das fases alteradas
+    schema = user_data.get("schema") or {}
+    phases = (user_data.get("phases") or []) + (schema.get("phases") or [])
+    session_phases = {str(phase["id"]) for phase in phases}
+    if user_data.get("phase_id"):
+        session_phases.add(str(user_data["phase_id"]))
+    return str(user_data.get("pipe_id")) in pipe_ids or bool(session_phases & phase_ids)
+
+async def apply_invalidation(targets: Dict[str, Any]) -> Dict[str, int]:
+    if not targets["schema_change"]:
+        # Eventos de card não mudam o esquema e não há cache de cards: nada a invalidar
+        return {"cache_entries": 0, "templates": 0, "wizard_sessions": 0}
+
+    pipe_ids, phase_ids = targets["pipe_ids"], targets["phase_ids"]
+    removed = schema_cache.invalidate(pipe_ids=pipe_ids, phase_ids=phase_ids)
+
+    # Esquema, campos e membros guardados no assistente são descartados e
+    # voltam a ser buscados antes do próximo uso
+    wizard_sessions = 0
+    for user_data in user_fields_cache.values():
+        if session_affected(user_data, pipe_ids, phase_ids):
+            for key in ("schema", "fields", "pipe_members"):
+                user_data.pop(key, None)
+            wizard_sessions += 1
+
+    # Templates compilados desse pipe/fase serão recompilados ao serem aplicados
+    templates = 0
+    if pipe_ids or phase_ids:
+        result = await MongoDB.database.templates.update_many(
+            {"$or": [
+                {"compiled.pipe_id": {"$in": list(pipe_ids)}},
+                {"pipe_id": {"$in": list(pipe_ids)}},
+                {"phase_id": {"$in": list(phase_ids)}}
+            ]},
+            {"$set": {"schema_stale": True}}
+        )
+        templates = result.modified_count
+        if templates:
+            etag_service.bump_all(etag_service.TEMPLATES)
+
+    return {"cache_entries": removed, "templates": templates, "wizard_sessions": wizard_sessions}
+
+@router.post("/pipefy")
+async def pipefy_webhook(request: Request):
+    if not settings.PIPEFY_WEBHOOK_SECRET:
+        logger.error("Pipefy webhook received but PIPEFY_WEBHOOK_SECRET is not configured")
+        raise HTTPException(status_code=503, detail="Webhook secret not configured")
+
+    body = await request.body()
+    if not verify_signature(body, request.headers.get(SIGNATURE_HEADER, "")):
+        logger.warning("Pipefy webhook rejected: invalid signature")
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    targets = extract_targets(payload)
+    invalidated = await apply_invalidation(targets)
+    webhook_stats[targets["action"] or "unknown"] = webhook_stats.get(targets["action"] or "unknown", 0) + 1
+
+    logger.info(f"Pipefy webhook {targets['action']} processed: {invalidated}")
+    return {"action": targets["action"], "invalidated": invalidated}
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+MISSING = object()
+
+class TTLCache:
+    # Cache em memória com expiração e invalidação por tags. É usado tanto
+    # pelo event loop quanto pelas threads do threadpool, por isso o lock.
+    # Cada invalidação avança uma geração e marca as tags atingidas com ela:
+    # quem carrega um valor fora do lock informa a geração em que começou
+    # (since) e o set é descartado se alguma tag foi invalidada no meio.
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+        self._tags: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated_at: "OrderedDict[str, int]" = OrderedDict()
+        # Marcas mais antigas que isto foram descartadas: cargas iniciadas
+        # antes dela não podem mais ser verificadas e não são gravadas
+        self._forgotten_before = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        tags: Iterable[str] = (),
+        ttl_seconds: Optional[float] = None,
+        since: Optional[int] = None
+    ) -> bool:
+        expires_at = time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
+        tags = tuple(tags)
+        with self._lock:
+            if since is not None and (
+                since < self._forgotten_before
+                or any(self._invalidated_at.get(tag, 0) > since for tag in tags)
+            ):
+                # Invalidado enquanto era carregado: o valor pode estar velho
+                self.stale_sets += 1
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        removed = 0
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                self._invalidated_at.pop(tag, None)
+                self._invalidated_at[tag] = self._generation
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            while len(self._invalidated_at) > self.max_entries:
+                _, generation = self._invalidated_at.popitem(last=False)
+                self._forgotten_before = generation
+            self.invalidations += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "stale_sets": self.stale_sets
+            }
+
+    def _remove(self, key: Hashable):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -1,3 +1,4 @@
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -10,6 +11,87 @@ class Settings(BaseSettings):
     DB_NAME: str
     ENCRYPTION_KEY: str
 
+    # Cache de esquema do Pipefy (invalidado por webhooks, por isso TTL longo)
+    SCHEMA_CACHE_TTL_SECONDS: int = 60 * 60 * 6
+    SCHEMA_CACHE_MAX_ENTRIES: int = 5000
+    PIPEFY_WEBHOOK_SECRET: Optional[str] = None
+
+    # Aquecimento do cache de esquema no login/salvamento do token
+    SCHEMA_WARMUP_CONCURRENCY: int = 2
+    SCHEMA_WARMUP_MAX_PIPES: int = 50
+
+    # Agendamento das chamadas ao Pipefy: concorrência total do processo e
+    # peso de cada plano na fila justa entre usuários
+    PIPEFY_MAX_CONCURRENCY: int = 8
+    PIPEFY_PLAN_WEIGHTS: Dict[str, float] = {"free": 1.0, "pro": 3.0, "enterprise": 6.0}
+    # Cada chamada na fila segura uma thread do threadpool (40 por padrão):
+    # bulk e background têm filas curtas para sempre sobrarem threads às
+    # requisições interativas. Acima do limite ou após o timeout de espera, a
+    # chamada falha com SchedulerBusy
+    PIPEFY_QUEUE_LIMITS: Dict[str, int] = {"interactive": 24, "bulk": 12, "background": 4}
+    PIPEFY_QUEUE_TIMEOUT_SECONDS: float = 60.0
+
+    # Timeouts das chamadas ao Pipefy e circuit breaker por operação e token
+    PIPEFY_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    PIPEFY_READ_TIMEOUT_SECONDS: float = 30.0
+    PIPEFY_BREAKER_FAILURE_THRESHOLD: int = 5
+    PIPEFY_BREAKER_RESET_SECONDS: float = 30.0
+
+    # Orçamento diário de chamadas ao Pipefy por plano; os contadores são
+    # gravados no Mongo a cada QUOTA_FLUSH_INTERVAL_SECONDS
+    PIPEFY_DAILY_CALL_BUDGETS: Dict[str, int] = {"free": 2000, "pro": 20000, "enterprise": 100000}
+    QUOTA_FLUSH_INTERVAL_SECONDS: float = 10.0
+
+    # Controle de admissão dos endpoints em massa (global e por usuário)
+    BULK_MAX_CONCURRENT_JOBS: int = 8
+    BULK_MAX_CONCURRENT_JOBS_PER_USER: int = 2
+    BULK_MAX_INFLIGHT_ROWS: int = 100000
+    BULK_MAX_INFLIGHT_ROWS_PER_USER: int = 30000
+    BULK_MAX_UPLOAD_BYTES: int = 200 * 1024 * 1024
+    BULK_MAX_UPLOAD_BYTES_PER_USER: int = 50 * 1024 * 1024
+
+    # Tamanho máximo de um arquivo enviado (rejeitado antes do fim do upload)
+    UPLOAD_MAX_BYTES: int = 50 * 1024 * 1024
+
+    # Processos para analisar planilhas com várias abas (0 = um por CPU)
+    XLSX_PARSE_WORKERS: int = 0
+
+    # Pipes processados ao mesmo tempo ao aplicar um template em vários pipes
+    FANOUT_MAX_CONCURRENT_PIPES: int = 4
+
+    # Checkpoints dos jobs em massa: gravação em lotes de N itens ou a cada
+    # intervalo, e tempo sem sinal de vida para um job poder ser retomado
+    BULK_CHECKPOINT_BATCH: int = 100
+    BULK_CHECKPOINT_INTERVAL_SECONDS: float = 2.0
+    BULK_JOB_STALE_SECONDS: int = 120
+
+    # Snapshots para desfazer jobs em massa: cards lidos por query com aliases,
+    # cards por documento comprimido no Mongo e dias de retenção
+    SNAPSHOT_READ_BATCH: int = 25
+    SNAPSHOT_STORE_BATCH: int = 500
+    SNAPSHOT_RETENTION_DAYS: int = 30
+
+    # Retentativas de falhas transitórias antes de irem para a dead-letter
+    BULK_RETRY_MAX_ATTEMPTS: int = 4
+    BULK_RETRY_BASE_DELAY_SECONDS: float = 2.0
+    BULK_RETRY_MAX_DELAY_SECONDS: float = 60.0
+
+    # Compressão gzip das respostas: tamanho mínimo e nível
+    RESPONSE_GZIP_MIN_BYTES: int = 1024
+    RESPONSE_GZIP_LEVEL: int = 6
+
+    # Logging estruturado: fila limitada (registros excedentes são descartados),
+    # tamanho máximo por campo e taxa de amostragem por evento
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_FIELD_MAX_CHARS: int = 512
+    LOG_MESSAGE_MAX_CHARS: int = 2048
+    LOG_SAMPLE_RATES: Dict[str, float] = {"pipefy.request": 0.1}
+
+    # Prazo para os jobs em massa terminarem após o SIGTERM
+    SHUTDOWN_DRAIN_SECONDS: int = 25
+
     class Config:
         env_file = ".env"
 
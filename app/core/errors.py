@@ -0,0 +1,14 @@
+from typing import Optional, Type, TypeVar
+
+E = TypeVar("E", bound=BaseException)
+
+def find_cause(error: Optional[BaseException], error_type: Type[E]) -> Optional[E]:
+    # Os serviços costumam relançar exceções genéricas; a original continua
+    # acessível pela cadeia __cause__/__context__
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, error_type):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
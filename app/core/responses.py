@@ -0,0 +1,36 @@
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from starlette.types import Receive, Scope, Send
+
+def trusted_json(content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> ORJSONResponse:
+    # Respostas montadas pelo próprio serviço (resultados em massa, resumos)
+    # vão direto para o orjson, sem passar pelo jsonable_encoder do FastAPI
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
+
+# Rotas que devolvem planilhas (XLSX já é um zip: recomprimir só gasta CPU).
+# (sufixo do caminho, parâmetro de query que ativa a planilha ou None)
+XLSX_ROUTES: Tuple[Tuple[str, Optional[str]], ...] = (
+    ("/generate_xlsx_template", None),
+    ("/update_cards_from_xlsx", "annotate"),
+)
+
+def streams_xlsx(scope: Scope) -> bool:
+    path = scope.get("path", "")
+    for suffix, flag in XLSX_ROUTES:
+        if not path.endswith(suffix):
+            continue
+        if flag is None:
+            return True
+        values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get(flag, [])
+        return any(value.lower() in ("1", "true", "yes", "on") for value in values)
+    return False
+
+class JSONGZipMiddleware(GZipMiddleware):
+    # GZip das respostas JSON grandes; as planilhas passam direto
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and streams_xlsx(scope):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
@@ -6,7 +6,7 @@ from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from cryptography.fernet import Fernet
 from app.core.config import settings
-from app.models.user import TokenData, UserInDB
+from app.models.user import UserInDB
 from app.db.mongodb import MongoDB
 import logging
 
@@ -44,27 +44,42 @@ def decrypt_token(encrypted_token: str) -> str:
     logger.info("Token decrypted successfully")
     return decrypted
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def get_current_email(token: str = Depends(oauth2_scheme)) -> str:
+    # Só valida o JWT, sem consultar o Mongo (usado nas respostas condicionais)
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             logger.warning("Token payload does not contain 'sub' claim")
-            raise credentials_exception
-        token_data = TokenData(email=email)
+            raise _credentials_exception()
+        return email
     except JWTError as e:
         logger.error(f"JWT decoding error: {str(e)}")
-        raise credentials_exception
-    user = await MongoDB.get_user_by_email(token_data.email)
+        raise _credentials_exception()
+
+def email_from_token(token: str) -> Optional[str]:
+    # Para middlewares, que não passam pelas dependências: None se inválido
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+async def get_current_user(email: str = Depends(get_current_email)):
+    return await load_user(email)
+
+async def load_user(email: str) -> UserInDB:
+    user = await MongoDB.get_user_by_email(email)
     if user is None:
-        logger.warning(f"User not found for email: {token_data.email}")
-        raise credentials_exception
-    logger.info(f"User authenticated: {token_data.email}")
+        logger.warning(f"User not found for email: {email}")
+        raise _credentials_exception()
+    logger.info(f"User authenticated: {email}")
     return UserInDB(**user)
 
 # Adicione esta função para verificar se o token é válido
@@ -0,0 +1,50 @@
+import signal
+import threading
+import time
+from typing import Optional
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sinalizado no SIGTERM: novos trabalhos em massa são recusados e os que já
+# estão rodando têm até o prazo para terminar antes de gravar o checkpoint
+_draining = threading.Event()
+_deadline: Optional[float] = None
+
+def begin_drain():
+    global _deadline
+    if _draining.is_set():
+        return
+    _deadline = time.monotonic() + settings.SHUTDOWN_DRAIN_SECONDS
+    _draining.set()
+    logger.warning(f"Draining: bulk work has {settings.SHUTDOWN_DRAIN_SECONDS}s to finish")
+
+def is_draining() -> bool:
+    return _draining.is_set()
+
+def past_deadline() -> bool:
+    return _deadline is not None and time.monotonic() >= _deadline
+
+def remaining_seconds() -> float:
+    return max(_deadline - time.monotonic(), 0.0) if _deadline is not None else float(settings.SHUTDOWN_DRAIN_SECONDS)
+
+def install_signal_handlers():
+    # Encadeia com o handler do servidor (uvicorn), que continua responsável
+    # por parar de aceitar conexões e encerrar o processo
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(signum)
+
+        def handler(received, frame, previous=previous):
+            begin_drain()
+            if callable(previous):
+                previous(received, frame)
+            elif previous == signal.SIG_DFL:
+                raise SystemExit(128 + received)
+
+        try:
+            signal.signal(signum, handler)
+        except ValueError:
+            # Fora da thread principal (ex.: alguns runners de teste)
+            logger.warning("Could not install drain signal handler")
+            return
@@ -0,0 +1,157 @@
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import reprlib
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+from app.core.config import settings
+
+# Tokens do Pipefy, JWTs e cabeçalhos Authorization nunca chegam ao log
+REDACT_PATTERNS = [
+    (re.compile(r"(Bearer\s+)[A-Za-z0-9._\-]+", re.IGNORECASE), r"\1[REDACTED]"),
+    (re.compile(r"eyJ[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+\.[A-Za-z0-9_\-]+"), "[REDACTED]"),
+    (
+        re.compile(r"""(["']?(?:api_token|pipefy_token|access_token|password|authorization)["']?\s*[:=]\s*["']?)[^"',\s}]+""", re.IGNORECASE),
+        r"\1[REDACTED]"
+    ),
+]
+
+_listener: Optional[QueueListener] = None
+
+def redact(text: str) -> str:
+    for pattern, replacement in REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def _bounded_repr(limit: int) -> reprlib.Repr:
+    # repr com custo limitado: listas e dicts grandes são cortados sem serem
+    # percorridos por inteiro
+    bounded = reprlib.Repr()
+    bounded.maxstring = limit
+    bounded.maxother = limit
+    bounded.maxlist = bounded.maxtuple = bounded.maxset = bounded.maxdict = 20
+    bounded.maxlevel = 4
+    return bounded
+
+def truncate(value: Any, limit: int, bounded: Optional[reprlib.Repr] = None) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}...(+{len(value) - limit} chars)"
+    text = (bounded or _bounded_repr(limit)).repr(value)
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
+class SizeBoundedQueueHandler(QueueHandler):
+    # Nunca bloqueia quem está logando: com a fila cheia o registro é
+    # descartado e contado. Só o trabalho barato acontece aqui; a formatação
+    # JSON, a redação e a escrita ficam na thread do QueueListener
+    def __init__(self, log_queue: queue.Queue, field_limit: int):
+        super().__init__(log_queue)
+        self.field_limit = field_limit
+        self.bounded = _bounded_repr(field_limit)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Os argumentos são congelados com repr limitado antes de cruzar a
+        # thread, para que objetos grandes ou mutáveis não sejam formatados aqui
+        record = copy.copy(record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(truncate(arg, self.field_limit, self.bounded) for arg in record.args)
+        fields = getattr(record, "fields", None)
+        if fields:
+            record.fields = {key: truncate(value, self.field_limit, self.bounded) for key, value in fields.items()}
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class SamplingFilter(logging.Filter):
+    # Eventos de alto volume (ex.: pipefy.request) são amostrados pela taxa
+    # configurada; avisos e erros passam sempre
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, message_limit: int):
+        super().__init__()
+        self.message_limit = message_limit
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), self.message_limit)
+        }
+        event = getattr(record, "event", None)
+        if event:
+            entry["event"] = event
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return redact(json.dumps(entry, ensure_ascii=False, default=str))
+
+class RedactingTextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return redact(text)
+
+def log_event(logger: logging.Logger, level: int, event: str, message: str = "", **fields):
+    # Campos estruturados só são montados se o nível estiver habilitado
+    if logger.isEnabledFor(level):
+        logger.log(level, message or event, extra={"event": event, "fields": fields})
+
+def configure_logging(stream=None):
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        output.setFormatter(StructuredFormatter(settings.LOG_MESSAGE_MAX_CHARS))
+    else:
+        output.setFormatter(RedactingTextFormatter("%(levelname)s:%(name)s:%(message)s"))
+
+    handler = SizeBoundedQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE), settings.LOG_FIELD_MAX_CHARS)
+    handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(settings.LOG_LEVEL)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging():
+    # Esvazia a fila antes de encerrar o processo
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def stats() -> Dict[str, int]:
+    handlers = [handler for handler in logging.getLogger().handlers if isinstance(handler, SizeBoundedQueueHandler)]
+    return {
+        "queued": sum(handler.queue.qsize() for handler in handlers),
+        "dropped": sum(handler.dropped for handler in handlers)
+    }
@@ -0,0 +1,102 @@
+import logging
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+class UploadSizeLimitMiddleware:
+    # Rejeita uploads multipart acima do limite antes do corpo terminar de
+    # chegar: pelo Content-Length quando informado e, senão, contando os bytes
+    # à medida que são recebidos. Com um orçamento (budget), os mesmos bytes
+    # são reservados na admissão: de uma vez pelo Content-Length e, sem ele
+    # (upload chunked) ou se o cliente mandar mais do que declarou, a cada
+    # bloco recebido. A reserva é liberada quando a requisição termina.
+    def __init__(self, app, max_bytes: int, budget=None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            logger.warning(f"Upload rejected by Content-Length: {int(content_length)} bytes")
+            return await self._reject(scope, receive, send)
+
+        owner = self.budget.owner(scope) if self.budget else None
+        reserved = 0
+
+        def reserve(size: int):
+            nonlocal reserved
+            if owner is None or size <= 0:
+                return None
+            rejection = self.budget.reserve(owner, size, reserved + size)
+            if rejection is None:
+                reserved += size
+            return rejection
+
+        try:
+            # Resposta rápida, antes de ler qualquer byte do corpo
+            rejection = reserve(int(content_length)) if content_length and content_length.isdigit() else None
+            if rejection is not None:
+                logger.warning(f"Upload of {int(content_length)} bytes rejected by admission control")
+                return await rejection(scope, receive, send)
+            await self._stream(scope, receive, send, reserve, lambda: reserved)
+        finally:
+            if reserved:
+                self.budget.release(owner, reserved)
+
+    async def _stream(self, scope, receive, send, reserve, reserved):
+        received = 0
+        rejected = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if response_started:
+                    return message
+                if received > self.max_bytes:
+                    # Responde 413 já e faz a aplicação enxergar uma desconexão,
+                    # interrompendo a leitura do restante do corpo
+                    logger.warning(f"Upload rejected after {received} bytes")
+                    rejected = True
+                    await self._reject(scope, receive, send)
+                    return {"type": "http.disconnect"}
+                rejection = reserve(received - reserved())
+                if rejection is not None:
+                    logger.warning(f"Upload rejected by admission control after {received} bytes")
+                    rejected = True
+                    await rejection(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def _reject(self, scope, receive, send):
+        response = JSONResponse(
+            status_code=413,
+            content={"detail": f"File exceeds the maximum size of {self.max_bytes} bytes"}
+        )
+        await response(scope, receive, send)
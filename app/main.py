@@ -1,21 +1,46 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1.endpoints import auth, pipefy
+from fastapi.responses import JSONResponse, ORJSONResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from app.api.v1.endpoints import auth, monitoring, pipefy, webhooks
+from app.core import shutdown
 from app.core.config import settings
+from app.core.errors import find_cause
+from app.core.responses import JSONGZipMiddleware
+from app.core.structured_logging import configure_logging, shutdown_logging
+from app.core.upload_limits import UploadSizeLimitMiddleware
 from app.db.mongodb import MongoDB
+from app.services import admission, bulk_job_service, circuit_breaker, pipefy_scheduler, pipefy_service, quota_service, snapshot_service, xlsx_service
+import asyncio
 import logging
+from typing import Union
 
-# Configuração de logging
-logging.basicConfig(level=logging.INFO)
+# Logging estruturado com escrita em segundo plano
+configure_logging()
 logger = logging.getLogger(__name__)
 
 try:
     app = FastAPI(
         title=settings.PROJECT_NAME,
         description="API para automação de cards no Pipefy",
-        version=getattr(settings, 'VERSION', '1.0.0')  # Use um valor padrão se VERSION não existir
+        version=getattr(settings, 'VERSION', '1.0.0'),  # Use um valor padrão se VERSION não existir
+        default_response_class=ORJSONResponse
     )
 
+    # Compressão das respostas acima do limite (listas de resultados grandes);
+    # as planilhas XLSX, já compactadas, ficam de fora
+    app.add_middleware(
+        JSONGZipMiddleware,
+        minimum_size=settings.RESPONSE_GZIP_MIN_BYTES,
+        compresslevel=settings.RESPONSE_GZIP_LEVEL
+    )
+
+    # Limite de tamanho dos uploads e orçamento de bytes da admissão, contados
+    # enquanto o corpo chega (registrado antes do CORS para que as respostas
+    # 413/429 também recebam os cabeçalhos CORS)
+    app.add_middleware(UploadSizeLimitMiddleware, max_bytes=settings.UPLOAD_MAX_BYTES, budget=admission.upload_budget)
+
     # Configuração CORS
     app.add_middleware(
         CORSMiddleware,
@@ -30,21 +55,80 @@ try:
         allow_headers=["*"],
     )
 
+    def pipefy_unavailable(error: Union[circuit_breaker.CircuitOpenError, pipefy_scheduler.SchedulerBusy]) -> JSONResponse:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": str(error)},
+            headers={"Retry-After": str(error.retry_after)}
+        )
+
+    @app.exception_handler(circuit_breaker.CircuitOpenError)
+    async def circuit_open_handler(request: Request, exc: circuit_breaker.CircuitOpenError):
+        return pipefy_unavailable(exc)
+
+    def quota_exhausted(error: quota_service.QuotaExceeded) -> JSONResponse:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": str(error)},
+            headers={"Retry-After": str(error.retry_after)}
+        )
+
+    @app.exception_handler(pipefy_scheduler.SchedulerBusy)
+    async def scheduler_busy_handler(request: Request, exc: pipefy_scheduler.SchedulerBusy):
+        return pipefy_unavailable(exc)
+
+    @app.exception_handler(quota_service.QuotaExceeded)
+    async def quota_exceeded_handler(request: Request, exc: quota_service.QuotaExceeded):
+        return quota_exhausted(exc)
+
+    @app.exception_handler(StarletteHTTPException)
+    async def http_error_handler(request: Request, exc: StarletteHTTPException):
+        # Os endpoints convertem erros do Pipefy em 400/500 genéricos; se a
+        # causa foi um circuito aberto, o agendador lotado ou a cota do plano, o cliente recebe
+        # 503/429 com Retry-After
+        if exc.status_code in (400, 500):
+            open_circuit = circuit_breaker.find_open_circuit(exc)
+            if open_circuit:
+                return pipefy_unavailable(open_circuit)
+            busy = find_cause(exc, pipefy_scheduler.SchedulerBusy)
+            if busy:
+                return pipefy_unavailable(busy)
+            exhausted = find_cause(exc, quota_service.QuotaExceeded)
+            if exhausted:
+                return quota_exhausted(exhausted)
+        return await http_exception_handler(request, exc)
+
     @app.on_event("startup")
     async def startup_db_client():
         logger.info("Connecting to database...")
         await MongoDB.connect_to_database()
+        await bulk_job_service.ensure_indexes()
+        await snapshot_service.ensure_indexes()
         logger.info("Connected to database successfully")
+        shutdown.install_signal_handlers()
+        app.state.quota_flusher = asyncio.create_task(quota_service.flush_periodically())
 
     @app.on_event("shutdown")
     async def shutdown_db_client():
+        # Ordem: drenar os jobs em massa (que gravam checkpoint ao atingir o
+        # prazo), fechar o pool HTTP do Pipefy e só então o Mongo, que os
+        # checkpoints ainda usam
+        shutdown.begin_drain()
+        await bulk_job_service.wait_for_active_jobs(shutdown.remaining_seconds() + 5)
+        pipefy_service.close_http_session()
+        xlsx_service.shutdown_parse_pool()
+        app.state.quota_flusher.cancel()
+        await quota_service.flush()
         logger.info("Closing database connection...")
         await MongoDB.close_database_connection()
         logger.info("Database connection closed")
+        shutdown_logging()
 
     # Rotas
     app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
     app.include_router(pipefy.router, prefix=f"{settings.API_V1_STR}/pipefy", tags=["pipefy"])
+    app.include_router(webhooks.router, prefix=f"{settings.API_V1_STR}/webhooks", tags=["webhooks"])
+    app.include_router(monitoring.router, prefix=f"{settings.API_V1_STR}/monitoring", tags=["monitoring"])
 
     @app.get("/")
     async def root():
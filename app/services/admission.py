@@ -0,0 +1,242 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from fastapi import Depends, HTTPException
+from starlette.responses import JSONResponse, Response
+from app.core import shutdown
+from app.core.config import settings
+from app.core.security import email_from_token, get_current_user
+from app.models.user import User
+import logging
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_WINDOW_SECONDS = 60
+DEFAULT_ROWS_PER_SECOND = 5.0
+DEFAULT_UPLOAD_BYTES_PER_SECOND = 1024 * 1024
+MAX_RETRY_AFTER_SECONDS = 300
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class BulkJob:
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.rows = 0
+        self.started_at = time.monotonic()
+        self.released = False
+
+    def add_rows(self, rows: int):
+        self.controller.add_rows(self, rows)
+
+    def release(self):
+        self.controller.release(self)
+
+class AdmissionController:
+    # Limites globais e por usuário para trabalhos em massa. Acima do limite a
+    # requisição recebe 429 imediatamente, com Retry-After estimado pela vazão
+    # recente, em vez de disputar memória e sockets com as que já estão rodando.
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._jobs = set()
+        self._uploads: Dict[str, int] = {}
+        self._completed = deque()
+        self._uploaded = deque()
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _user_jobs(self, user_id: str):
+        return [job for job in self._jobs if job.user_id == user_id]
+
+    def _rows_per_second(self) -> float:
+        now = time.monotonic()
+        while self._completed and self._completed[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._completed.popleft()
+        rows = sum(count for _, count in self._completed)
+        return rows / THROUGHPUT_WINDOW_SECONDS if rows else DEFAULT_ROWS_PER_SECOND
+
+    def _retry_after(self, rows_to_free: int) -> int:
+        seconds = math.ceil(max(rows_to_free, 1) / self._rows_per_second())
+        return min(max(seconds, 1), MAX_RETRY_AFTER_SECONDS)
+
+    def _upload_retry_after(self, bytes_to_free: int) -> int:
+        # Mesma estimativa, pela vazão recente de bytes recebidos em uploads
+        now = time.monotonic()
+        while self._uploaded and self._uploaded[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._uploaded.popleft()
+        received = sum(size for _, size in self._uploaded)
+        bytes_per_second = received / THROUGHPUT_WINDOW_SECONDS if received else DEFAULT_UPLOAD_BYTES_PER_SECOND
+        seconds = math.ceil(max(bytes_to_free, 1) / bytes_per_second)
+        return min(max(seconds, 1), MAX_RETRY_AFTER_SECONDS)
+
+    def _smallest_job_rows(self, jobs) -> int:
+        return min((job.rows for job in jobs), default=1)
+
+    def _reject(self, reason: str, rows_to_free: int, retry_after: Optional[int] = None):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, retry_after if retry_after is not None else self._retry_after(rows_to_free))
+
+    def admit(self, user_id: str) -> BulkJob:
+        with self._lock:
+            user_jobs = self._user_jobs(user_id)
+            if len(self._jobs) >= self.limits["max_jobs"]:
+                self._reject("max_jobs", self._smallest_job_rows(self._jobs))
+            if len(user_jobs) >= self.limits["max_jobs_per_user"]:
+                self._reject("max_jobs_per_user", self._smallest_job_rows(user_jobs))
+
+            job = BulkJob(self, user_id)
+            self._jobs.add(job)
+            self.admitted += 1
+            return job
+
+    def add_rows(self, job: BulkJob, rows: int):
+        with self._lock:
+            total_rows = sum(other.rows for other in self._jobs) + rows
+            user_rows = sum(other.rows for other in self._user_jobs(job.user_id)) + rows
+            if rows > self.limits["max_rows_per_user"]:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Too many rows in one request ({rows}); the limit is {self.limits['max_rows_per_user']}"
+                )
+            if total_rows > self.limits["max_rows"]:
+                self._reject("max_rows", total_rows - self.limits["max_rows"])
+            if user_rows > self.limits["max_rows_per_user"]:
+                self._reject("max_rows_per_user", user_rows - self.limits["max_rows_per_user"])
+            job.rows += rows
+
+    def reserve_upload(self, owner: str, size: int, request_bytes: int):
+        # Bytes de upload em trânsito, reservados pelo middleware à medida que
+        # o corpo chega (ou de uma vez, pelo Content-Length). request_bytes é o
+        # total já reservado pela requisição, incluindo este incremento
+        with self._lock:
+            owner_bytes = self._uploads.get(owner, 0) + size
+            if request_bytes > self.limits["max_upload_bytes_per_user"]:
+                raise HTTPException(status_code=413, detail="Upload exceeds the maximum allowed size")
+            total_bytes = sum(self._uploads.values()) + size
+            if total_bytes > self.limits["max_upload_bytes"]:
+                self._reject("max_upload_bytes", 0, self._upload_retry_after(total_bytes - self.limits["max_upload_bytes"]))
+            if owner_bytes > self.limits["max_upload_bytes_per_user"]:
+                self._reject(
+                    "max_upload_bytes_per_user", 0,
+                    self._upload_retry_after(owner_bytes - self.limits["max_upload_bytes_per_user"])
+                )
+            self._uploads[owner] = owner_bytes
+
+    def release_upload(self, owner: str, size: int):
+        with self._lock:
+            self._uploaded.append((time.monotonic(), size))
+            remaining = self._uploads.get(owner, 0) - size
+            if remaining > 0:
+                self._uploads[owner] = remaining
+            else:
+                self._uploads.pop(owner, None)
+
+    def release(self, job: BulkJob):
+        with self._lock:
+            if job.released:
+                return
+            job.released = True
+            self._jobs.discard(job)
+            if job.rows:
+                self._completed.append((time.monotonic(), job.rows))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            users: Dict[str, Dict[str, int]] = {}
+            for job in self._jobs:
+                usage = users.setdefault(job.user_id, {"jobs": 0, "rows": 0})
+                usage["jobs"] += 1
+                usage["rows"] += job.rows
+            return {
+                "limits": dict(self.limits),
+                "jobs": len(self._jobs),
+                "rows": sum(job.rows for job in self._jobs),
+                "upload_bytes": sum(self._uploads.values()),
+                "uploads_in_flight": len(self._uploads),
+                "rows_per_second": round(self._rows_per_second(), 2),
+                "admitted": self.admitted,
+                "rejected": dict(self.rejected),
+                "users": users
+            }
+
+controller = AdmissionController({
+    "max_jobs": settings.BULK_MAX_CONCURRENT_JOBS,
+    "max_jobs_per_user": settings.BULK_MAX_CONCURRENT_JOBS_PER_USER,
+    "max_rows": settings.BULK_MAX_INFLIGHT_ROWS,
+    "max_rows_per_user": settings.BULK_MAX_INFLIGHT_ROWS_PER_USER,
+    "max_upload_bytes": settings.BULK_MAX_UPLOAD_BYTES,
+    "max_upload_bytes_per_user": settings.BULK_MAX_UPLOAD_BYTES_PER_USER
+})
+
+def too_many_requests(error: AdmissionRejected) -> HTTPException:
+    logger.warning(f"Bulk request rejected by admission control: {error.reason}")
+    return HTTPException(
+        status_code=429,
+        detail=f"Server is busy ({error.reason}). Retry in {error.retry_after} seconds.",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def _open_job(user_id: str) -> BulkJob:
+    if shutdown.is_draining():
+        raise HTTPException(
+            status_code=503,
+            detail="Server is shutting down. Retry shortly.",
+            headers={"Retry-After": str(max(int(shutdown.remaining_seconds()), 1))}
+        )
+    try:
+        return controller.admit(user_id)
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+
+# Dependências FastAPI: admitem o trabalho antes do handler e liberam a
+# capacidade quando a requisição termina
+async def bulk_job(current_user: User = Depends(get_current_user)):
+    job = _open_job(str(current_user.id))
+    try:
+        yield job
+    finally:
+        job.release()
+
+# Os bytes do upload já foram admitidos pelo UploadSizeLimitMiddleware
+# enquanto o corpo chegava; aqui resta o limite de jobs
+bulk_upload_job = bulk_job
+
+class UploadBudget:
+    # Orçamento de bytes de upload usado pelo UploadSizeLimitMiddleware. O
+    # dono é o usuário do JWT, lido sem consultar o Mongo; requisições sem
+    # token válido ficam só com o limite por requisição (e recebem 401)
+    def owner(self, scope) -> Optional[str]:
+        for name, value in scope.get("headers") or []:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                return email_from_token(token) if scheme.lower() == "bearer" else None
+        return None
+
+    def reserve(self, owner: str, size: int, request_bytes: int) -> Optional[Response]:
+        try:
+            controller.reserve_upload(owner, size, request_bytes)
+        except AdmissionRejected as e:
+            error = too_many_requests(e)
+        except HTTPException as e:
+            error = e
+        else:
+            return None
+        return JSONResponse(status_code=error.status_code, content={"detail": error.detail}, headers=error.headers)
+
+    def release(self, owner: str, size: int):
+        controller.release_upload(owner, size)
+
+upload_budget = UploadBudget()
+
+def add_rows(job: BulkJob, rows: int):
+    try:
+        job.add_rows(rows)
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
@@ -0,0 +1,587 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from app.core import shutdown
+from app.core.config import settings
+from app.db.mongodb import MongoDB
+from app.services import pipefy_service, quota_service, snapshot_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCANNING = "scanning"
+RUNNING = "running"
+COMPLETED = "completed"
+INTERRUPTED = "interrupted"
+
+PENDING = "pending"
+DONE = "done"
+
+ITEM_INSERT_CHUNK = 1000
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# Falhas que costumam passar sozinhas: indisponibilidade, limite de taxa,
+# timeouts e erros de conexão. O restante (validação, permissão, card
+# inexistente) não muda com uma nova tentativa
+TRANSIENT_PATTERN = re.compile(
+    r"Pipefy API error: (429|5\d\d)\b|timed? ?out|timeout|connection|rate limit|too many requests"
+    r"|temporarily|try again|service unavailable|bad gateway|internal server error",
+    re.IGNORECASE
+)
+
+DEAD_LETTER_LIST_LIMIT = 500
+
+class JobConflict(Exception):
+    pass
+
+class JobInterrupted(Exception):
+    # O processo está encerrando: o que foi feito está no checkpoint e o
+    # restante pode ser retomado pela mesma chave
+    def __init__(self, key: str):
+        super().__init__(f"Bulk job {key} interrupted by shutdown; resume it with the same idempotency key")
+        self.key = key
+
+# Jobs rodando neste processo, aguardados no shutdown
+_active_jobs = 0
+
+def _dispatch_update_move(payloads: List[Dict], api_token: str) -> List[Dict]:
+    return pipefy_service.update_and_move_cards(payloads, api_token, batch_size=len(payloads))
+
+def _error_message(error: Exception) -> str:
+    # O nome da exceção (ConnectionError, ReadTimeout...) ajuda a classificar
+    return f"{type(error).__name__}: {str(error)}"
+
+def _failure(error: Exception, **extra) -> Dict:
+    return dict(extra, success=False, message=_error_message(error), transient=pipefy_service.is_transient_error(error))
+
+def _dispatch_move(payloads: List[Dict], api_token: str) -> List[Dict]:
+    # Movimentações vão no mesmo documento com aliases do update_move
+    operations = [
+        {"card_id": payload['card_id'], "field_updates": {}, "destination_phase_id": payload['destination_phase_id']}
+        for payload in payloads
+    ]
+    return pipefy_service.update_and_move_cards(operations, api_token, batch_size=len(operations))
+
+def _dispatch_create_record(payloads: List[Dict], api_token: str) -> List[Dict]:
+    # Um registro por chamada: uma falha no meio não pode marcar como falhos
+    # (e depois recriar) registros que já foram criados
+    results = []
+    for payload in payloads:
+        try:
+            results.extend(pipefy_service.create_database_records(payload['database_id'], [payload['record']], api_token))
+        except Exception as e:
+            results.append(_failure(e))
+    return results
+
+def _dispatch_upsert_record(payloads: List[Dict], api_token: str) -> List[Dict]:
+    # Itens planejados por upsert_service: com record_id é update dos campos
+    # alterados, sem record_id é create
+    results = []
+    for payload in payloads:
+        try:
+            if payload.get('record_id'):
+                result = pipefy_service.update_table_record(payload['record_id'], payload['record'], api_token)
+                results.append(dict(result, action="update"))
+            else:
+                created = pipefy_service.create_database_records(payload['database_id'], [payload['record']], api_token)
+                results.append(dict(created[0], action="create"))
+        except Exception as e:
+            results.append(_failure(e, action="update" if payload.get('record_id') else "create"))
+    return results
+
+# Operações que um job em massa sabe executar e retomar
+DISPATCHERS: Dict[str, Tuple[Callable[[List[Dict], str], List[Dict]], int]] = {
+    "update_move": (_dispatch_update_move, 10),
+    "move": (_dispatch_move, 10),
+    "create_record": (_dispatch_create_record, 10),
+    "upsert_record": (_dispatch_upsert_record, 10),
+}
+
+def payload_hash(operation: str, items: List[Dict]) -> str:
+    encoded = json.dumps([operation, items], sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def classify_failure(result: Dict) -> str:
+    # O tipo da exceção, marcado pelo dispatcher, vale mais que a mensagem; o
+    # padrão cobre erros que só chegam como texto (respostas da API)
+    if result.get('transient'):
+        return TRANSIENT
+    return TRANSIENT if TRANSIENT_PATTERN.search(str(result.get('message') or "")) else PERMANENT
+
+def retry_delay(attempts: int) -> float:
+    # Backoff exponencial com jitter, limitado a BULK_RETRY_MAX_DELAY_SECONDS
+    delay = min(settings.BULK_RETRY_BASE_DELAY_SECONDS * (2 ** (attempts - 1)), settings.BULK_RETRY_MAX_DELAY_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+def new_idempotency_key() -> str:
+    return uuid.uuid4().hex
+
+async def ensure_indexes():
+    # Itens são lidos por job na ordem e os checkpoints atualizam por (job, seq)
+    await MongoDB.database.bulk_job_items.create_index([("job_id", 1), ("seq", 1)], unique=True)
+    await MongoDB.database.bulk_job_items.create_index([("job_id", 1), ("status", 1), ("seq", 1)])
+    await MongoDB.database.bulk_dead_letters.create_index([("user_id", 1), ("job_key", 1), ("created_at", 1)])
+
+def job_document_id(user_id: str, key: str) -> str:
+    return f"{user_id}:{key}"
+
+class Checkpointer:
+    # Acumula a conclusão dos itens e grava no Mongo em lotes periódicos,
+    # em vez de uma escrita por item
+    def __init__(self, job: Dict):
+        self.job = job
+        self.job_id = job["_id"]
+        self._pending: List[UpdateOne] = []
+        self._dead_letters: List[Dict] = []
+        self._last_flush = time.monotonic()
+        self.done = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def record(self, item: Dict, result: Dict):
+        attempts = item.get("attempts", 0) + 1
+        kind = None if result.get('success') else classify_failure(result)
+
+        if kind == TRANSIENT and attempts < settings.BULK_RETRY_MAX_ATTEMPTS:
+            # Continua pendente, mas só volta a ser enviado depois do backoff
+            self._pending.append(UpdateOne(
+                {"job_id": self.job_id, "seq": item["seq"]},
+                {"$set": {
+                    "attempts": attempts,
+                    "retry_at": datetime.utcnow() + timedelta(seconds=retry_delay(attempts)),
+                    "last_error": result.get('message')
+                }}
+            ))
+            self.retried += 1
+        else:
+            self._pending.append(UpdateOne(
+                {"job_id": self.job_id, "seq": item["seq"]},
+                {"$set": {"status": DONE, "result": result, "attempts": attempts}}
+            ))
+            if kind:
+                self.failed += 1
+                self._dead_letters.append({
+                    "user_id": self.job["user_id"],
+                    "job_id": self.job_id,
+                    "job_key": self.job["key"],
+                    "operation": self.job["operation"],
+                    "seq": item["seq"],
+                    "payload": item["payload"],
+                    "error": result.get('message'),
+                    "kind": kind,
+                    "attempts": attempts,
+                    "created_at": datetime.utcnow()
+                })
+            else:
+                self.done += 1
+
+        if (
+            len(self._pending) >= settings.BULK_CHECKPOINT_BATCH
+            or time.monotonic() - self._last_flush >= settings.BULK_CHECKPOINT_INTERVAL_SECONDS
+        ):
+            await self.flush()
+
+    async def flush(self):
+        if self._pending:
+            await MongoDB.database.bulk_job_items.bulk_write(self._pending, ordered=False)
+            self._pending = []
+        if self._dead_letters:
+            await MongoDB.database.bulk_dead_letters.insert_many(self._dead_letters, ordered=False)
+            self._dead_letters = []
+        self._last_flush = time.monotonic()
+        await MongoDB.database.bulk_jobs.update_one(
+            {"_id": self.job_id},
+            {
+                "$inc": {"succeeded": self.done, "failed": self.failed, "retries": self.retried},
+                "$set": {"updated_at": datetime.utcnow()}
+            }
+        )
+        self.done = 0
+        self.failed = 0
+        self.retried = 0
+
+async def get_job(user_id: str, key: str) -> Optional[Dict]:
+    return await MongoDB.database.bulk_jobs.find_one({"_id": job_document_id(user_id, key)})
+
+def _existing_job(existing: Dict, operation: str, digest: str) -> Dict:
+    if existing["payload_hash"] != digest or existing["operation"] != operation:
+        raise JobConflict("Idempotency key already used with a different payload")
+    return existing
+
+async def _open_job(user_id: str, key: str, operation: str, digest: str, total: int, status: str) -> Tuple[Dict, bool]:
+    # Retorna (job, criado). Um job existente com a mesma chave é devolvido
+    # sem reexecução, desde que o conteúdo enviado seja o mesmo
+    job_id = job_document_id(user_id, key)
+    existing = await MongoDB.database.bulk_jobs.find_one({"_id": job_id})
+    if existing:
+        return _existing_job(existing, operation, digest), False
+
+    now = datetime.utcnow()
+    job = {
+        "_id": job_id,
+        "user_id": user_id,
+        "key": key,
+        "operation": operation,
+        "payload_hash": digest,
+        "status": status,
+        "total": total,
+        "succeeded": 0,
+        "failed": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+    try:
+        await MongoDB.database.bulk_jobs.insert_one(job)
+    except DuplicateKeyError:
+        # Outra requisição com a mesma chave criou o job entre a leitura e o
+        # insert: segue o mesmo caminho de uma chave já usada
+        existing = await MongoDB.database.bulk_jobs.find_one({"_id": job_id})
+        if existing is None:
+            raise
+        return _existing_job(existing, operation, digest), False
+    return job, True
+
+async def _insert_items(job_id: str, items: List[Dict], completed: Optional[Dict[int, Dict]] = None, first_seq: int = 0):
+    # Itens já resolvidos localmente (ex.: rejeitados na validação) entram
+    # como concluídos, para que o resultado final mantenha a ordem original
+    completed = completed or {}
+    documents = [
+        {
+            "job_id": job_id,
+            "seq": first_seq + seq,
+            "payload": item,
+            "status": DONE if seq in completed else PENDING,
+            "result": completed.get(seq)
+        }
+        for seq, item in enumerate(items)
+    ]
+    for start in range(0, len(documents), ITEM_INSERT_CHUNK):
+        await MongoDB.database.bulk_job_items.insert_many(documents[start:start + ITEM_INSERT_CHUNK], ordered=False)
+    if completed:
+        await MongoDB.database.bulk_jobs.update_one(
+            {"_id": job_id},
+            {"$inc": {"failed": sum(1 for result in completed.values() if not result.get('success'))}}
+        )
+
+async def create_job(
+    user_id: str,
+    key: str,
+    operation: str,
+    items: List[Dict],
+    completed: Optional[Dict[int, Dict]] = None
+) -> Tuple[Dict, bool]:
+    job, created = await _open_job(user_id, key, operation, payload_hash(operation, items), len(items), RUNNING)
+    if created:
+        await _insert_items(job["_id"], items, completed)
+    return job, created
+
+async def discard_job(job_id: str):
+    # Só para jobs que ainda não enviaram nada ao Pipefy
+    await MongoDB.database.bulk_job_items.delete_many({"job_id": job_id})
+    await snapshot_service.discard(job_id)
+    await MongoDB.database.bulk_jobs.delete_one({"_id": job_id})
+
+async def claim_for_resume(user_id: str, key: str) -> Optional[Dict]:
+    # Só retoma jobs interrompidos ou cujo processo parou de dar sinal de vida
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.BULK_JOB_STALE_SECONDS)
+    return await MongoDB.database.bulk_jobs.find_one_and_update(
+        {
+            "_id": job_document_id(user_id, key),
+            "$or": [
+                {"status": INTERRUPTED},
+                {"status": RUNNING, "updated_at": {"$lt": stale_before}}
+            ]
+        },
+        {"$set": {"status": RUNNING, "updated_at": datetime.utcnow()}, "$inc": {"resumes": 1}},
+        return_document=True
+    )
+
+async def mark_interrupted(job_id: str):
+    await MongoDB.database.bulk_jobs.update_one({"_id": job_id}, {"$set": {"status": INTERRUPTED}})
+
+async def _run_due_items(job: Dict, dispatch, batch_size: int, api_token: str, checkpointer: Checkpointer):
+    # Envia os itens pendentes cujo backoff (se houver) já venceu
+    cursor = MongoDB.database.bulk_job_items.find(
+        {
+            "job_id": job["_id"],
+            "status": PENDING,
+            "$or": [{"retry_at": None}, {"retry_at": {"$lte": datetime.utcnow()}}]
+        },
+        {"seq": 1, "payload": 1, "attempts": 1}
+    ).sort("seq", 1)
+
+    batch: List[Dict] = []
+    async for item in cursor:
+        if shutdown.past_deadline():
+            raise JobInterrupted(job["key"])
+        batch.append(item)
+        if len(batch) >= batch_size:
+            await _run_batch(batch, dispatch, api_token, checkpointer)
+            batch = []
+    if batch:
+        await _run_batch(batch, dispatch, api_token, checkpointer)
+    await checkpointer.flush()
+
+async def _next_retry_at(job_id: str) -> Optional[datetime]:
+    item = await MongoDB.database.bulk_job_items.find_one(
+        {"job_id": job_id, "status": PENDING}, {"retry_at": 1}, sort=[("retry_at", 1)]
+    )
+    if not item:
+        return None
+    return item.get("retry_at") or datetime.utcnow()
+
+async def run_job(job: Dict, api_token: str, collect: bool = True) -> List[Dict]:
+    global _active_jobs
+    dispatch, batch_size = DISPATCHERS[job["operation"]]
+    checkpointer = Checkpointer(job)
+
+    _active_jobs += 1
+    try:
+        # Primeira passada em todos os itens; depois, a fila de retentativas é
+        # esvaziada conforme cada backoff vence
+        await _run_due_items(job, dispatch, batch_size, api_token, checkpointer)
+        while True:
+            retry_at = await _next_retry_at(job["_id"])
+            if retry_at is None:
+                break
+            if shutdown.is_draining():
+                # Não espera backoff durante o encerramento; fica para o resume
+                raise JobInterrupted(job["key"])
+            wait = (retry_at - datetime.utcnow()).total_seconds()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await _run_due_items(job, dispatch, batch_size, api_token, checkpointer)
+        await MongoDB.database.bulk_jobs.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": COMPLETED, "completed_at": datetime.utcnow()}}
+        )
+    except BaseException:
+        # Grava o que já foi concluído; o restante fica pendente para o resume
+        await checkpointer.flush()
+        await mark_interrupted(job["_id"])
+        raise
+    finally:
+        _active_jobs -= 1
+
+    # Jobs muito grandes podem dispensar a lista completa de resultados
+    return await job_results(job["_id"]) if collect else []
+
+async def _run_batch(batch: List[Dict], dispatch, api_token: str, checkpointer: Checkpointer):
+    payloads = [item["payload"] for item in batch]
+    started = time.perf_counter()
+    try:
+        results = await run_in_threadpool(dispatch, payloads, api_token)
+    except Exception as e:
+        logger.error(f"Bulk batch failed: {str(e)}", exc_info=True)
+        results = [_failure(e) for _ in payloads]
+    # Latência do lote (uma mutation com aliases atende todos os itens dele)
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    for item, result in zip(batch, results):
+        await checkpointer.record(item, dict(result, latency_ms=latency_ms))
+
+async def wait_for_active_jobs(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while _active_jobs and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    if _active_jobs:
+        logger.warning(f"{_active_jobs} bulk jobs still running at shutdown")
+    return not _active_jobs
+
+async def job_results(job_id: str) -> List[Dict]:
+    items = await MongoDB.database.bulk_job_items.find(
+        {"job_id": job_id}, {"result": 1, "status": 1}
+    ).sort("seq", 1).to_list(None)
+    return [item["result"] for item in items if item["status"] == DONE]
+
+async def job_failures(job_id: str, limit: int = DEAD_LETTER_LIST_LIMIT) -> List[Dict]:
+    items = await MongoDB.database.bulk_job_items.find(
+        {"job_id": job_id, "status": DONE, "result.success": False}, {"result": 1}
+    ).sort("seq", 1).to_list(limit)
+    return [item["result"] for item in items]
+
+async def succeeded_payloads(job_id: str) -> List[Dict]:
+    # Payloads dos itens que o Pipefy aceitou, na ordem original
+    items = await MongoDB.database.bulk_job_items.find(
+        {"job_id": job_id, "status": DONE, "result.success": True}, {"payload": 1}
+    ).sort("seq", 1).to_list(None)
+    return [item["payload"] for item in items]
+
+def job_summary(job: Dict) -> Dict:
+    return {
+        "idempotency_key": job["key"],
+        "operation": job["operation"],
+        "status": job["status"],
+        "total": job["total"],
+        "succeeded": job.get("succeeded", 0),
+        "failed": job.get("failed", 0),
+        "retries": job.get("retries", 0),
+        "created_at": job["created_at"],
+        "updated_at": job.get("updated_at")
+    }
+
+async def execute(
+    user_id: str,
+    key: Optional[str],
+    operation: str,
+    items: List[Dict],
+    api_token: str,
+    completed: Optional[Dict[int, Dict]] = None,
+    plan: Optional[str] = None,
+    collect: bool = True
+) -> Tuple[str, List[Dict]]:
+    # Ponto de entrada dos endpoints: cria o job (ou reaproveita o existente)
+    # e devolve (chave, resultados na ordem dos itens)
+    key = key or new_idempotency_key()
+    if not await get_job(user_id, key):
+        pending = [item for seq, item in enumerate(items) if seq not in (completed or {})]
+        snapshot = operation in snapshot_service.OPERATIONS
+        if plan is not None:
+            # Recusa antes de qualquer leitura ou mutation se a cota do dia não
+            # comporta o job (incluindo as leituras do snapshot)
+            estimated = quota_service.estimate_calls(operation, len(pending))
+            if snapshot:
+                estimated += snapshot_service.estimate_reads(pending)
+            quota_service.check_budget(user_id, plan, estimated)
+        if snapshot and not await snapshot_service.has_snapshot(job_document_id(user_id, key)):
+            # Estado anterior dos cards, lido logo antes da primeira mutation,
+            # para que o job possa ser desfeito
+            await snapshot_service.capture(job_document_id(user_id, key), operation, pending, api_token)
+    job, created = await create_job(user_id, key, operation, items, completed)
+    if created:
+        return key, await run_job(job, api_token, collect)
+
+    if job["status"] == COMPLETED:
+        logger.info(f"Bulk job {key} already completed; returning stored result")
+        return key, await job_results(job["_id"]) if collect else []
+    raise JobConflict(f"Bulk job {key} is {job['status']}; use the resume endpoint to continue it")
+
+async def execute_streamed(
+    user_id: str,
+    key: Optional[str],
+    operation: str,
+    request: Dict,
+    pages: AsyncIterator[List[Dict]],
+    api_token: str,
+    plan: Optional[str] = None
+) -> Tuple[str, bool]:
+    # Para jobs cujos itens saem de uma leitura paginada (ex.: mover por
+    # filtro): cada página é gravada no job assim que chega, sem montar a
+    # lista inteira em memória, e a chave é amarrada ao pedido, já que os
+    # itens mudam depois do envio. Os envios só começam quando a leitura
+    # termina: mover cards da fase durante a paginação deslocaria o cursor e
+    # pularia cards. Retorna (chave, criado)
+    key = key or new_idempotency_key()
+    job, created = await _open_job(user_id, key, operation, payload_hash(operation, [request]), 0, SCANNING)
+    if not created:
+        return key, False
+
+    total = 0
+    snapshot_batches = 0
+    try:
+        async for items in pages:
+            if not items:
+                continue
+            await _insert_items(job["_id"], items, first_seq=total)
+            total += len(items)
+            if operation in snapshot_service.OPERATIONS:
+                snapshot_batches += await snapshot_service.save(
+                    job["_id"], operation, snapshot_service.known_states(items), first_batch=snapshot_batches
+                )
+        if plan is not None:
+            quota_service.check_budget(user_id, plan, quota_service.estimate_calls(operation, total))
+    except BaseException:
+        # Nada foi enviado ainda: a chave fica livre para uma nova tentativa
+        await discard_job(job["_id"])
+        raise
+
+    job = await MongoDB.database.bulk_jobs.find_one_and_update(
+        {"_id": job["_id"]},
+        {"$set": {"status": RUNNING, "total": total, "updated_at": datetime.utcnow()}},
+        return_document=True
+    )
+    await run_job(job, api_token, collect=False)
+    return key, True
+
+def _dead_letter_filter(user_id: str, key: Optional[str]) -> Dict:
+    query = {"user_id": user_id}
+    if key:
+        query["job_key"] = key
+    return query
+
+async def list_dead_letters(user_id: str, key: Optional[str] = None) -> List[Dict]:
+    letters = await MongoDB.database.bulk_dead_letters.find(
+        _dead_letter_filter(user_id, key)
+    ).sort("created_at", 1).to_list(DEAD_LETTER_LIST_LIMIT)
+    for letter in letters:
+        letter["id"] = str(letter.pop("_id"))
+    return letters
+
+async def count_dead_letters(user_id: str, key: Optional[str] = None) -> int:
+    return await MongoDB.database.bulk_dead_letters.count_documents(_dead_letter_filter(user_id, key))
+
+async def _settle_dead_letters(retry_job_id: str, group: List[Dict]):
+    # Remove as cartas cujo item já tem resultado no job de retry: sucesso ou
+    # nova falha, que já virou outra carta
+    settled = await MongoDB.database.bulk_job_items.find(
+        {"job_id": retry_job_id, "status": DONE}, {"seq": 1}
+    ).to_list(None)
+    await MongoDB.database.bulk_dead_letters.delete_many(
+        {"_id": {"$in": [group[item["seq"]]["_id"] for item in settled]}}
+    )
+
+async def retry_dead_letters(user_id: str, key: Optional[str], api_token: str, plan: Optional[str] = None) -> List[Dict]:
+    # Reenvia as falhas como novos jobs (um por operação). As cartas ficam
+    # marcadas durante o envio e só saem da coleção depois que o item tem
+    # resultado; uma queda no meio não perde nenhuma
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.BULK_JOB_STALE_SECONDS)
+    letters = await MongoDB.database.bulk_dead_letters.find({
+        **_dead_letter_filter(user_id, key),
+        "$or": [{"retrying_at": {"$exists": False}}, {"retrying_at": {"$lt": stale_before}}]
+    }).sort([("job_key", 1), ("seq", 1)]).to_list(None)
+
+    by_operation: Dict[str, List[Dict]] = {}
+    for letter in letters:
+        by_operation.setdefault(letter["operation"], []).append(letter)
+
+    if plan is not None:
+        quota_service.check_budget(user_id, plan, sum(
+            quota_service.estimate_calls(operation, len(group)) for operation, group in by_operation.items()
+        ))
+
+    retried = []
+    for operation, group in by_operation.items():
+        retry_key = new_idempotency_key()
+        letter_ids = [letter["_id"] for letter in group]
+        await MongoDB.database.bulk_dead_letters.update_many(
+            {"_id": {"$in": letter_ids}},
+            {"$set": {"retrying_at": datetime.utcnow(), "retry_key": retry_key}}
+        )
+        try:
+            _, results = await execute(user_id, retry_key, operation, [letter["payload"] for letter in group], api_token, plan=plan)
+        except JobInterrupted:
+            # O job de retry pode ser retomado pela chave; as cartas ainda
+            # pendentes continuam marcadas com ela
+            await _settle_dead_letters(job_document_id(user_id, retry_key), group)
+            raise
+        except BaseException:
+            await _settle_dead_letters(job_document_id(user_id, retry_key), group)
+            await MongoDB.database.bulk_dead_letters.update_many(
+                {"_id": {"$in": letter_ids}},
+                {"$unset": {"retrying_at": "", "retry_key": ""}}
+            )
+            raise
+        await _settle_dead_letters(job_document_id(user_id, retry_key), group)
+        logger.info(f"Retried {len(group)} dead letters for {operation} as bulk job {retry_key}")
+        retried.append({"operation": operation, "idempotency_key": retry_key, "results": results})
+    return retried
@@ -0,0 +1,154 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from app.core.config import settings
+from app.core.errors import find_cause
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Primeiro campo raiz do documento GraphQL (ignorando um alias, se houver)
+ROOT_FIELD_PATTERN = re.compile(r"\{\s*(?:\w+\s*:\s*)?(\w+)")
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"Pipefy API temporarily unavailable ({endpoint}); retry in {retry_after} seconds")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    # Abre após N falhas seguidas (timeouts, erros de conexão, 5xx). Aberto,
+    # falha na hora; depois de reset_seconds deixa passar uma única chamada de
+    # teste (half-open), que fecha o circuito se der certo ou o reabre se falhar
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+
+    def retry_after(self) -> int:
+        remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+        return max(math.ceil(remaining), 1)
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self.probe_in_flight = False
+
+    def snapshot(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after() if self.state == OPEN else 0
+        }
+
+class BreakerRegistry:
+    # Um circuito por (operação do Pipefy, token): um token revogado ou uma
+    # operação degradada não derruba as chamadas dos outros usuários
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def _breaker(self, key: Tuple[str, str]) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        return breaker
+
+    def before_call(self, endpoint: str, token_key: str):
+        with self._lock:
+            breaker = self._breaker((endpoint, token_key))
+            if not breaker.allow():
+                raise CircuitOpenError(endpoint, breaker.retry_after())
+
+    def record(self, endpoint: str, token_key: str, success: bool):
+        with self._lock:
+            breaker = self._breaker((endpoint, token_key))
+            previous = breaker.state
+            if success:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            if breaker.state != previous:
+                logger.warning(f"Pipefy circuit {endpoint} ({token_key}) {previous} -> {breaker.state}")
+
+    def abandon(self, endpoint: str, token_key: str):
+        # A chamada liberada não chegou a ser feita: sem sucesso nem falha
+        with self._lock:
+            self._breaker((endpoint, token_key)).probe_in_flight = False
+
+    def open_circuits(self) -> int:
+        with self._lock:
+            return sum(1 for breaker in self._breakers.values() if breaker.state != CLOSED)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "failure_threshold": self.failure_threshold,
+                "reset_seconds": self.reset_seconds,
+                "circuits": {
+                    f"{endpoint}:{token_key}": breaker.snapshot()
+                    for (endpoint, token_key), breaker in self._breakers.items()
+                    if breaker.state != CLOSED or breaker.trips
+                }
+            }
+
+registry = BreakerRegistry(settings.PIPEFY_BREAKER_FAILURE_THRESHOLD, settings.PIPEFY_BREAKER_RESET_SECONDS)
+
+@lru_cache(maxsize=256)
+def endpoint_name(query: str) -> str:
+    match = ROOT_FIELD_PATTERN.search(query)
+    return match.group(1) if match else "unknown"
+
+def token_key(api_token: str) -> str:
+    return hashlib.sha256(api_token.encode()).hexdigest()[:12]
+
+def before_call(query: str, api_token: str) -> Tuple[str, str]:
+    circuit = (endpoint_name(query), token_key(api_token))
+    registry.before_call(*circuit)
+    return circuit
+
+def record(circuit: Tuple[str, str], success: bool):
+    registry.record(circuit[0], circuit[1], success)
+
+def abandon(circuit: Tuple[str, str]):
+    registry.abandon(circuit[0], circuit[1])
+
+def find_open_circuit(error: Optional[BaseException]) -> Optional[CircuitOpenError]:
+    return find_cause(error, CircuitOpenError)
@@ -0,0 +1,64 @@
+import hashlib
+import threading
+import uuid
+from typing import Dict, Optional, Tuple
+from fastapi import Response
+
+ME = "me"
+PIPES = "pipes"
+TEMPLATES = "templates"
+
+# Os contadores vivem em memória: o id do processo entra no ETag para que,
+# após um restart (ou em outra instância), um ETag antigo nunca coincida.
+# Isso supõe um worker por instância (ver render.yaml): com vários, cada
+# requisição cairia num processo com outro BOOT_ID e nunca daria 304
+BOOT_ID = uuid.uuid4().hex[:8]
+
+_lock = threading.Lock()
+_versions: Dict[Tuple[str, str], int] = {}
+_global_versions: Dict[str, int] = {}
+
+def _user_key(email: str) -> str:
+    return hashlib.sha256(email.lower().encode()).hexdigest()[:12]
+
+def bump(email: str, *resources: str):
+    # Chamado por toda escrita que muda o que o GET correspondente devolve
+    key = _user_key(email)
+    with _lock:
+        for resource in resources:
+            _versions[(key, resource)] = _versions.get((key, resource), 0) + 1
+
+def bump_all(resource: str):
+    # Para escritas que atingem vários usuários de uma vez (ex.: webhooks)
+    with _lock:
+        _global_versions[resource] = _global_versions.get(resource, 0) + 1
+
+def etag(email: str, resource: str) -> str:
+    key = _user_key(email)
+    with _lock:
+        version = _versions.get((key, resource), 0)
+        global_version = _global_versions.get(resource, 0)
+    # ETag fraco de propósito: o JSONGZipMiddleware recomprime o corpo sem
+    # mexer no cabeçalho, e um ETag forte precisa mudar com a codificação
+    # (RFC 9110, 8.8.3). A versão identifica o conteúdo, não os bytes
+    return f'W/"{resource}-{key}-{BOOT_ID}-{global_version}.{version}"'
+
+def matches(if_none_match: Optional[str], current: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Comparação fraca: W/"x" e "x" são equivalentes
+    weak = current[2:] if current.startswith("W/") else current
+    return "*" in candidates or any(
+        (candidate[2:] if candidate.startswith("W/") else candidate) == weak
+        for candidate in candidates
+    )
+
+def set_headers(response: Response, current: str):
+    response.headers["ETag"] = current
+    response.headers["Cache-Control"] = "private, no-cache"
+
+def not_modified(current: str) -> Response:
+    response = Response(status_code=304)
+    set_headers(response, current)
+    return response
@@ -0,0 +1,72 @@
+from typing import Any, Dict, List, Optional
+from app.services import validation_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+def template_labels(compiled: Dict) -> List[str]:
+    # Os pipes regionais são cópias: o que vale entre eles é o label, não o id
+    return [step["label"] for step in compiled["mutation_plan"]]
+
+def match_phase_by_labels(schema: Dict, labels: List[str]) -> Optional[Dict]:
+    wanted = set(labels)
+    best, best_overlap = None, 0
+    for phase in schema["phases"]:
+        overlap = len(wanted & set(phase["label_to_id"]))
+        if overlap > best_overlap:
+            best, best_overlap = phase, overlap
+    return best
+
+def plan_pipe(
+    schema: Dict,
+    labels: List[str],
+    cards: List[Dict],
+    defaults: Dict[str, Any]
+) -> Dict[str, Any]:
+    # Um passe sobre o esquema do pipe: escolhe a fase, traduz labels em ids e
+    # valida as linhas. Retorna as operações prontas para o dispatch em lote
+    phase = match_phase_by_labels(schema, labels)
+    if phase is None:
+        return {"phase_id": None, "items": [], "completed": {}, "errors": [
+            {"message": "No phase of this pipe has the template's fields"}
+        ], "missing_labels": labels}
+
+    label_to_id = phase["label_to_id"]
+    missing_labels = [label for label in labels if label not in label_to_id]
+    allowed = [label for label in labels if label in label_to_id]
+
+    rows = []
+    for index, card in enumerate(cards):
+        values = dict(defaults, **(card.get("values") or {}))
+        field_updates = {
+            label_to_id[label]: values[label]
+            for label in allowed
+            if values.get(label) is not None
+        }
+        rows.append((index, str(card["card_id"]), field_updates))
+
+    valid_rows, errors = validation_service.validate_rows(rows, phase["fields"], schema["members"])
+    errors_by_row = validation_service.group_errors_by_row(errors)
+    normalized = {index: field_updates for index, _, field_updates in valid_rows}
+
+    items: List[Dict] = []
+    completed: Dict[int, Dict] = {}
+    for index, card_id, field_updates in rows:
+        if index in errors_by_row:
+            completed[index] = validation_service.rejected_result(card_id, errors_by_row[index])
+        items.append({"card_id": card_id, "field_updates": normalized.get(index, field_updates)})
+
+    return {
+        "phase_id": phase["id"],
+        "items": items,
+        "completed": completed,
+        "errors": errors,
+        "missing_labels": missing_labels
+    }
+
+def unknown_labels(labels: List[str], defaults: Dict[str, Any], cards: List[Dict]) -> List[str]:
+    known = set(labels)
+    sent = set(defaults)
+    for card in cards:
+        sent.update(card.get("values") or {})
+    return sorted(sent - known)
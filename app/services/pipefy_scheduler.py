@@ -0,0 +1,222 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Classes de prioridade, da mais urgente para a menos urgente
+INTERACTIVE = "interactive"
+BULK = "bulk"
+BACKGROUND = "background"
+PRIORITY_RANK = {INTERACTIVE: 0, BULK: 1, BACKGROUND: 2}
+
+# Identificação de quem está chamando o Pipefy, definida por requisição
+current_tenant: ContextVar[Optional[Tuple[str, str]]] = ContextVar("pipefy_tenant", default=None)
+current_priority: ContextVar[Optional[str]] = ContextVar("pipefy_priority", default=None)
+
+def set_tenant(user_id: str, subscription_plan: str):
+    current_tenant.set((str(user_id), subscription_plan or "free"))
+
+def set_priority(name: str):
+    # Vale até o fim da requisição atual (cada requisição roda no seu contexto)
+    current_priority.set(name)
+
+@contextmanager
+def priority_class(name: str):
+    token = current_priority.set(name)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+# Acima disto, fluxos ociosos são removidos de _last_finish
+FLOW_PRUNE_THRESHOLD = 1024
+
+class SchedulerBusy(Exception):
+    # Fila da classe cheia ou espera longa demais por uma vaga; nenhuma
+    # chamada foi feita ao Pipefy
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Ticket:
+    __slots__ = ("tenant", "priority", "enqueued_at", "event", "cancelled")
+
+    def __init__(self, tenant: str, priority: str):
+        self.tenant = tenant
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.cancelled = False
+
+class _TenantStats:
+    __slots__ = ("queued", "in_flight", "dispatched", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.queued = {name: 0 for name in PRIORITY_RANK}
+        self.in_flight = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+class FairScheduler:
+    # Fila justa ponderada (start-time fair queueing) entre usuários dentro de
+    # cada classe de prioridade; classes mais urgentes sempre passam à frente.
+    # As chamadas ao Pipefy são síncronas (requests), então a espera é feita
+    # com threading.Event na thread que vai executar a chamada. Por isso
+    # pipefy_request nunca deve rodar direto no event loop: os endpoints
+    # assíncronos chamam o Pipefy via run_in_threadpool. Como cada espera
+    # ocupa uma thread, a fila de cada classe é limitada e a espera tem timeout.
+    def __init__(
+        self,
+        capacity: int,
+        plan_weights: Dict[str, float],
+        queue_limits: Optional[Dict[str, int]] = None,
+        wait_timeout: Optional[float] = None
+    ):
+        self.capacity = capacity
+        self.plan_weights = plan_weights
+        self.queue_limits = queue_limits or {}
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._heap = []
+        self._queued = {name: 0 for name in PRIORITY_RANK}
+        self.rejected = {name: 0 for name in PRIORITY_RANK}
+        self.timed_out = {name: 0 for name in PRIORITY_RANK}
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._active = 0
+        self._stats: Dict[str, _TenantStats] = {}
+
+    def _weight(self, plan: str) -> float:
+        return max(self.plan_weights.get(plan, self.plan_weights.get("free", 1.0)), 0.01)
+
+    def acquire(self, tenant: str, plan: str, priority: str) -> _Ticket:
+        ticket = _Ticket(tenant, priority)
+        with self._lock:
+            limit = self.queue_limits.get(priority)
+            if limit is not None and self._active >= self.capacity and self._queued[priority] >= limit:
+                self.rejected[priority] += 1
+                raise SchedulerBusy(
+                    f"Too many Pipefy calls queued for {priority} requests ({limit}); try again shortly",
+                    self._retry_after()
+                )
+            if len(self._last_finish) > FLOW_PRUNE_THRESHOLD:
+                self._prune_flows()
+            flow = (tenant, priority)
+            start = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+            finish = start + 1.0 / self._weight(plan)
+            self._last_finish[flow] = finish
+            heapq.heappush(self._heap, (PRIORITY_RANK.get(priority, 1), start, next(self._sequence), ticket))
+            self._queued[priority] += 1
+            self._stats.setdefault(tenant, _TenantStats()).queued[priority] += 1
+            self._dispatch()
+        if ticket.event.wait(self.wait_timeout):
+            return ticket
+        with self._lock:
+            if ticket.event.is_set():
+                # A vaga chegou junto com o timeout
+                return ticket
+            # Sai da fila; o heap descarta o ticket quando chegar a vez dele
+            ticket.cancelled = True
+            self._queued[priority] -= 1
+            self._stats[tenant].queued[priority] -= 1
+            self.timed_out[priority] += 1
+        raise SchedulerBusy(
+            f"Timed out after {self.wait_timeout:g}s waiting for a Pipefy call slot ({priority})",
+            self._retry_after()
+        )
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil((self.wait_timeout or 60) / 4))
+
+    def _prune_flows(self):
+        # Um fluxo cujo último término já ficou para trás do tempo virtual
+        # recomeçaria do tempo virtual de qualquer forma: pode ser esquecido.
+        # Sem ninguém na fila, o tempo virtual avança até o maior término (como
+        # no SFQ ocioso), o que libera todos os fluxos sem chamadas pendentes
+        if not any(self._queued.values()):
+            self._virtual_time = max([self._virtual_time] + list(self._last_finish.values()))
+        self._last_finish = {
+            flow: finish for flow, finish in self._last_finish.items() if finish > self._virtual_time
+        }
+
+    def release(self, ticket: _Ticket):
+        with self._lock:
+            self._active -= 1
+            self._stats[ticket.tenant].in_flight -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.capacity and self._heap:
+            _, start, _, ticket = heapq.heappop(self._heap)
+            if ticket.cancelled:
+                continue
+            self._virtual_time = max(self._virtual_time, start)
+            self._active += 1
+            self._queued[ticket.priority] -= 1
+
+            wait = time.monotonic() - ticket.enqueued_at
+            stats = self._stats[ticket.tenant]
+            stats.queued[ticket.priority] -= 1
+            stats.in_flight += 1
+            stats.dispatched += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+
+            ticket.event.set()
+
+    @contextmanager
+    def slot(self, tenant: str, plan: str, priority: str):
+        ticket = self.acquire(tenant, plan, priority)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "active": self._active,
+                "queued": sum(self._queued.values()),
+                "queued_by_class": dict(self._queued),
+                "queue_limits": dict(self.queue_limits),
+                "rejected": dict(self.rejected),
+                "timed_out": dict(self.timed_out),
+                "tenants": {
+                    tenant: {
+                        "queued": dict(stats.queued),
+                        "in_flight": stats.in_flight,
+                        "dispatched": stats.dispatched,
+                        "avg_wait_ms": round(stats.total_wait / stats.dispatched * 1000, 2) if stats.dispatched else 0.0,
+                        "max_wait_ms": round(stats.max_wait * 1000, 2)
+                    }
+                    for tenant, stats in self._stats.items()
+                }
+            }
+
+scheduler = FairScheduler(
+    settings.PIPEFY_MAX_CONCURRENCY,
+    settings.PIPEFY_PLAN_WEIGHTS,
+    settings.PIPEFY_QUEUE_LIMITS,
+    settings.PIPEFY_QUEUE_TIMEOUT_SECONDS
+)
+
+@contextmanager
+def pipefy_slot(query: str):
+    tenant, plan = current_tenant.get() or ("anonymous", "free")
+    priority = current_priority.get()
+    if priority is None:
+        # Sem indicação explícita: leituras são interativas, mutations são bulk
+        priority = BULK if query.lstrip().startswith("mutation") else INTERACTIVE
+    with scheduler.slot(tenant, plan, priority):
+        yield
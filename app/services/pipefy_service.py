@@ -1,20 +1,72 @@
-import json
+import time
+from datetime import datetime, timezone
 from fastapi import logger
 import requests
-from typing import Any, List, Dict, Tuple
+from typing import Any, Iterator, List, Dict, Optional, Tuple
+from app.core.config import settings
+from app.core.errors import find_cause
+from app.core.structured_logging import log_event
+from app.services import circuit_breaker, pipefy_scheduler, quota_service
 import logging
 
 logger = logging.getLogger(__name__)
 
 PIPEFY_API_URL = "https://api.pipefy.com/graphql"
 
+# Conexões reaproveitadas entre chamadas; o pool acompanha a concorrência
+# máxima do agendador e é fechado no shutdown
+http_session = requests.Session()
+http_session.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=1, pool_maxsize=settings.PIPEFY_MAX_CONCURRENCY
+))
+
+def close_http_session():
+    http_session.close()
+
 def pipefy_request(query: str, variables: Dict, api_token: str) -> Dict:
     headers = {"Authorization": f"Bearer {api_token}"}
-    logger.info(f"Sending request to Pipefy API. Query: {query}, Variables: {variables}")
-    response = requests.post(PIPEFY_API_URL, json={"query": query, "variables": variables}, headers=headers)
+    # Documento e variáveis completos só em DEBUG, formatados sob demanda
+    logger.debug("Pipefy request query=%s variables=%s", query, variables)
+    # Cota diária do plano do usuário: conta a chamada (em memória) ou recusa
+    tenant = pipefy_scheduler.current_tenant.get()
+    operation = circuit_breaker.endpoint_name(query)
+    quota_service.record_call(tenant, operation)
+    # Circuito aberto falha na hora, sem ocupar vaga no agendador
+    try:
+        circuit = circuit_breaker.before_call(query, api_token)
+    except circuit_breaker.CircuitOpenError:
+        quota_service.refund_call(tenant, operation)
+        raise
+    started = time.perf_counter()
+    try:
+        # Toda chamada passa pelo agendador justo entre usuários
+        with pipefy_scheduler.pipefy_slot(query):
+            try:
+                response = http_session.post(
+                    PIPEFY_API_URL,
+                    json={"query": query, "variables": variables},
+                    headers=headers,
+                    timeout=(settings.PIPEFY_CONNECT_TIMEOUT_SECONDS, settings.PIPEFY_READ_TIMEOUT_SECONDS)
+                )
+            except Exception:
+                # Timeouts e erros de conexão contam como falha do circuito
+                circuit_breaker.record(circuit, False)
+                raise
+    except pipefy_scheduler.SchedulerBusy:
+        # Sem vaga no agendador a chamada não foi feita: nada conta
+        circuit_breaker.abandon(circuit)
+        quota_service.refund_call(tenant, operation)
+        raise
+    circuit_breaker.record(circuit, response.status_code < 500)
     
-    logger.info(f"Pipefy API response status code: {response.status_code}")
-    logger.info(f"Pipefy API response content: {response.text}")
+    log_event(
+        logger, logging.INFO if response.status_code == 200 else logging.WARNING, "pipefy.request",
+        endpoint=circuit[0],
+        status=response.status_code,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        response_bytes=len(response.content)
+    )
+    logger.debug("Pipefy response content=%s", response.text)
     
     if response.status_code == 200:
         return response.json()
@@ -48,6 +100,7 @@ def get_phase_fields(phase_id: str, api_token: str) -> List[Dict]:
           id
           label
           type
+          options
         }
       }
     }
@@ -87,9 +140,8 @@ def update_card_fields(card_id: str, field_updates: Dict, api_token: str) -> Tup
                 }
             }
             
-            logger.info(f"Sending update for card {card_id}, field {field_id}: {string_value}")
+            logger.debug("Sending update for card %s, field %s: %s", card_id, field_id, string_value)
             response = pipefy_request(mutation, variables, api_token)
-            logger.info(f"Pipefy API response: {response}")
             
             if 'errors' in response:
                 error_message = "; ".join([error['message'] for error in response['errors']])
@@ -106,6 +158,130 @@ def update_card_fields(card_id: str, field_updates: Dict, api_token: str) -> Tup
         logger.error(f"Error updating card fields: {str(e)}", exc_info=True)
         return False, f"Error updating card fields: {str(e)}"
 
+def _clean_field_updates(field_updates: Dict) -> Dict[str, str]:
+    # Mesmas regras de update_card_fields: valores vazios são ignorados
+    cleaned = {}
+    for field_id, new_value in field_updates.items():
+        if new_value is None or new_value == '':
+            continue
+        string_value = str(new_value).strip()
+        if string_value:
+            cleaned[str(field_id)] = string_value
+    return cleaned
+
+def build_card_mutation_document(operations: List[Dict]) -> Tuple[str, Dict, Dict[str, Tuple[int, str]]]:
+    # Um único documento com aliases para vários cards. Campos de mutation
+    # são executados em série, na ordem do documento: primeiro as
+    # atualizações de cada card e depois o seu moveCardToPhase
+    declarations = []
+    selections = []
+    variables = {}
+    aliases = {}
+
+    for index, operation in enumerate(operations):
+        card_id = str(operation['card_id'])
+        for field_index, (field_id, value) in enumerate(operation['field_updates'].items()):
+            alias = f"c{index}_f{field_index}"
+            declarations.append(f"${alias}: UpdateCardFieldInput!")
+            selections.append(f"{alias}: updateCardField(input: ${alias}) {{ success }}")
+            variables[alias] = {"card_id": card_id, "field_id": field_id, "new_value": value}
+            aliases[alias] = (index, f"field {field_id}")
+
+        if operation.get('destination_phase_id'):
+            alias = f"c{index}_move"
+            declarations.append(f"${alias}: MoveCardToPhaseInput!")
+            selections.append(f"{alias}: moveCardToPhase(input: ${alias}) {{ card {{ id }} }}")
+            variables[alias] = {"card_id": card_id, "destination_phase_id": str(operation['destination_phase_id'])}
+            aliases[alias] = (index, f"move to phase {operation['destination_phase_id']}")
+
+    document = "mutation BulkUpdateMove(" + ", ".join(declarations) + ") {\n  " + "\n  ".join(selections) + "\n}"
+    return document, variables, aliases
+
+def _dispatch_card_batch(operations: List[Dict], api_token: str) -> List[Dict]:
+    failures: Dict[int, List[str]] = {index: [] for index in range(len(operations))}
+    document, variables, aliases = build_card_mutation_document(operations)
+
+    if aliases:
+        response = pipefy_request(document, variables, api_token)
+        data = response.get('data') or {}
+        errored_aliases = set()
+        batch_error = False
+
+        for error in response.get('errors') or []:
+            path = error.get('path') or []
+            target = aliases.get(path[0]) if path else None
+            if target:
+                errored_aliases.add(path[0])
+                failures[target[0]].append(f"{target[1]}: {error.get('message')}")
+            else:
+                # Erro sem caminho (validação do documento): afeta o lote todo
+                batch_error = True
+                for messages in failures.values():
+                    messages.append(error.get('message', 'Unknown error'))
+
+        if not batch_error:
+            for alias, (index, description) in aliases.items():
+                if alias in errored_aliases:
+                    continue
+                result = data.get(alias)
+                if alias.endswith("_move"):
+                    ok = bool(result and result.get('card'))
+                else:
+                    ok = bool(result and result.get('success'))
+                if not ok:
+                    failures[index].append(f"{description}: failed")
+
+    results = []
+    for index, operation in enumerate(operations):
+        moved = bool(operation.get('destination_phase_id'))
+        if failures[index]:
+            message = "Pipefy API error: " + "; ".join(failures[index])
+        elif not operation['field_updates'] and not moved:
+            message = "No fields to update"
+        elif not operation['field_updates']:
+            message = f"Card moved to phase {operation['destination_phase_id']}"
+        else:
+            message = "All fields updated successfully" + (
+                f" and card moved to phase {operation['destination_phase_id']}" if moved else ""
+            )
+        results.append({
+            'card_id': operation['card_id'],
+            'success': not failures[index],
+            'message': message
+        })
+    return results
+
+def is_transient_error(error: Exception) -> bool:
+    # Circuito aberto, agendador lotado e cota do dia esgotada passam
+    # sozinhos, seja qual for a mensagem da exceção que chegou até aqui
+    return any(
+        find_cause(error, error_type)
+        for error_type in (circuit_breaker.CircuitOpenError, pipefy_scheduler.SchedulerBusy, quota_service.QuotaExceeded)
+    )
+
+def update_and_move_cards(operations: List[Dict], api_token: str, batch_size: int = 10) -> List[Dict]:
+    # operations: [{"card_id", "field_updates", "destination_phase_id" (opcional)}]
+    prepared = [
+        dict(operation, field_updates=_clean_field_updates(operation.get('field_updates') or {}))
+        for operation in operations
+    ]
+    results = []
+
+    for start in range(0, len(prepared), batch_size):
+        batch = prepared[start:start + batch_size]
+        try:
+            logger.info(f"Sending combined update/move mutation for {len(batch)} cards")
+            results.extend(_dispatch_card_batch(batch, api_token))
+        except Exception as e:
+            logger.error(f"Error in combined update/move batch: {str(e)}", exc_info=True)
+            transient = is_transient_error(e)
+            results.extend(
+                {'card_id': operation['card_id'], 'success': False, 'message': f"Error updating card: {str(e)}", 'transient': transient}
+                for operation in batch
+            )
+
+    return results
+
 def get_pipe_fields(pipe_id: str, api_token: str) -> List[Dict]:
     # Extrair apenas o número do pipe se for uma URL
     if pipe_id.startswith('http'):
@@ -118,12 +294,14 @@ def get_pipe_fields(pipe_id: str, api_token: str) -> List[Dict]:
           id
           label
           type
+          options
         }
         phases {
           fields {
             id
             label
             type
+            options
           }
         }
       }
@@ -134,8 +312,7 @@ def get_pipe_fields(pipe_id: str, api_token: str) -> List[Dict]:
     try:
         data = pipefy_request(query, variables, api_token)
         
-        # Log detalhado da resposta
-        logger.info(f"Resposta da API de campos: {json.dumps(data, indent=2)}")
+        logger.debug("Resposta da API de campos: %s", data)
         
         # Verificar se há erros na resposta
         if 'errors' in data:
@@ -200,57 +377,222 @@ def get_pipe_members(pipe_id: str, api_token: str) -> List[Dict]:
         logger.error(f"Error fetching pipe members: {str(e)}")
         raise Exception(f"Error fetching pipe members: {str(e)}")
 
-def move_cards(card_ids: List[str], destination_phase_id: str, api_token: str) -> Tuple[bool, str]:
-    mutation = """
-    mutation MoveCardToPhase($input: MoveCardToPhaseInput!) {
-      moveCardToPhase(input: $input) {
-        card {
+def pipe_schema(pipe_id: str, api_token: str) -> Dict:
+    if pipe_id.startswith('http'):
+        pipe_id = pipe_id.split('/')[-1]
+
+    # Fases, campos por fase, formulário inicial e membros numa única consulta
+    query = """
+    query PipeSchema($pipeId: ID!) {
+      pipe(id: $pipeId) {
+        id
+        name
+        start_form_fields {
           id
-          title
+          label
+          type
+          options
+          required
+        }
+        phases {
+          id
+          name
+          fields {
+            id
+            label
+            type
+            options
+            required
+          }
+        }
+        members {
+          user {
+            id
+            name
+            email
+          }
         }
       }
     }
     """
+    variables = {"pipeId": pipe_id}
+
+    try:
+        data = pipefy_request(query, variables, api_token)
+
+        if 'errors' in data:
+            error_messages = [error.get('message', 'Unknown error') for error in data['errors']]
+            raise Exception(f"Pipefy API errors: {'; '.join(error_messages)}")
+
+        pipe = data.get('data', {}).get('pipe')
+        if not pipe:
+            raise Exception("Pipe não encontrado ou acesso negado")
+
+        return build_schema_snapshot(pipe)
+    except Exception as e:
+        logger.error(f"Error fetching pipe schema: {str(e)}", exc_info=True)
+        raise Exception(f"Error fetching pipe schema: {str(e)}")
+
+def build_schema_snapshot(pipe: Dict) -> Dict:
+    start_form_fields = [
+        dict(field, phase_id=None) for field in pipe.get('start_form_fields') or []
+    ]
+    phases = []
+    for phase in pipe.get('phases') or []:
+        fields = [dict(field, phase_id=phase['id']) for field in phase.get('fields') or []]
+        phases.append({
+            "id": phase['id'],
+            "name": phase['name'],
+            "fields": fields,
+            "label_to_id": {field['label']: field['id'] for field in fields}
+        })
+
+    all_fields = start_form_fields + [field for phase in phases for field in phase['fields']]
+
+    return {
+        "pipe_id": str(pipe.get('id')),
+        "name": pipe.get('name'),
+        "phases": phases,
+        "start_form_fields": start_form_fields,
+        "members": pipe.get('members') or [],
+        # Mesma precedência de get_field_labels_and_ids: o último label vence
+        "label_to_id": {field['label']: field['id'] for field in all_fields},
+        "fields_by_id": {field['id']: field for field in all_fields}
+    }
+
+def schema_phase(schema: Dict, phase_id: str) -> Dict:
+    for phase in schema['phases']:
+        if str(phase['id']) == str(phase_id):
+            return phase
+    raise Exception(f"Phase {phase_id} not found in pipe {schema['pipe_id']}")
+
+def match_phase_by_fields(schema: Dict, field_ids: List[Any]) -> Optional[Dict]:
+    # Fase cujos campos mais coincidem com os ids da linha oculta da planilha
+    wanted = {str(field_id) for field_id in field_ids if field_id}
+    best, best_overlap = None, 0
+    for phase in schema['phases']:
+        overlap = len(wanted & {str(field['id']) for field in phase['fields']})
+        if overlap > best_overlap:
+            best, best_overlap = phase, overlap
+    return best
+
+def card_field_values(card: Dict) -> Dict[str, str]:
+    # Campos de múltiplos valores (assignee, checklist, etiquetas) vêm em array_value
+    values = {}
+    for card_field in card.get('fields') or []:
+        array_value = card_field.get('array_value')
+        if array_value:
+            values[card_field['field']['id']] = ", ".join(str(item) for item in array_value)
+        else:
+            values[card_field['field']['id']] = card_field.get('value')
+    return values
+
+PHASE_CARDS_QUERY = """
+query PhaseCards($phaseId: ID!, $first: Int!, $after: String) {
+  phase(id: $phaseId) {
+    cards(first: $first, after: $after) {
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      edges {
+        node {
+          id
+          title
+          createdAt
+          updated_at
+          fields {
+            field {
+              id
+              label
+            }
+            value
+            array_value
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+def fetch_phase_cards_page(phase_id: str, api_token: str, page_size: int = 50, after: Optional[str] = None) -> Tuple[List[Dict], bool, Optional[str]]:
+    variables = {"phaseId": phase_id, "first": page_size, "after": after}
+    data = pipefy_request(PHASE_CARDS_QUERY, variables, api_token)
+
+    if 'errors' in data:
+        error_message = "; ".join([error['message'] for error in data['errors']])
+        raise Exception(f"Error fetching phase cards: {error_message}")
+
+    cards = data['data']['phase']['cards']
+    return (
+        [edge['node'] for edge in cards['edges']],
+        cards['pageInfo']['hasNextPage'],
+        cards['pageInfo']['endCursor']
+    )
+
+def iter_phase_cards(phase_id: str, api_token: str, page_size: int = 50) -> Iterator[List[Dict]]:
+    cursor = None
+
+    # Uma página por vez: quem consome decide o que manter em memória
+    while True:
+        cards, has_next_page, cursor = fetch_phase_cards_page(phase_id, api_token, page_size, cursor)
+        yield cards
+
+        if not has_next_page:
+            break
+
+MOVE_CARD_MUTATION = """
+mutation MoveCardToPhase($input: MoveCardToPhaseInput!) {
+  moveCardToPhase(input: $input) {
+    card {
+      id
+      title
+    }
+  }
+}
+"""
+
+def move_card(card_id: str, destination_phase_id: str, api_token: str) -> Dict:
+    variables = {
+        "input": {
+            "card_id": str(card_id),
+            "destination_phase_id": str(destination_phase_id)
+        }
+    }
+    
+    logger.debug("Moving card %s to phase %s", card_id, destination_phase_id)
+    response = pipefy_request(MOVE_CARD_MUTATION, variables, api_token)
     
+    # Verificar a estrutura da resposta
+    if 'errors' in response:
+        error_message = "; ".join([error['message'] for error in response['errors']])
+        return {
+            'card_id': card_id,
+            'success': False,
+            'message': f"Pipefy API error: {error_message}"
+        }
+    
+    if 'data' not in response or 'moveCardToPhase' not in response['data']:
+        return {
+            'card_id': card_id,
+            'success': False,
+            'message': f"Unexpected response structure from Pipefy API: {response}"
+        }
+    
+    # Se chegou aqui, o card foi movido com sucesso
+    return {
+        'card_id': card_id,
+        'success': True,
+        'message': f"Card {card_id} moved successfully"
+    }
+
+def move_cards(card_ids: List[str], destination_phase_id: str, api_token: str) -> Tuple[bool, str]:
     results = []
     
     try:
         for card_id in card_ids:
-            variables = {
-                "input": {
-                    "card_id": str(card_id),
-                    "destination_phase_id": str(destination_phase_id)
-                }
-            }
-            
-            logger.info(f"Moving card {card_id} to phase {destination_phase_id}")
-            response = pipefy_request(mutation, variables, api_token)
-            logger.info(f"Pipefy API response: {response}")
-            
-            # Verificar a estrutura da resposta
-            if 'errors' in response:
-                error_message = "; ".join([error['message'] for error in response['errors']])
-                results.append({
-                    'card_id': card_id,
-                    'success': False,
-                    'message': f"Pipefy API error: {error_message}"
-                })
-                continue
-            
-            if 'data' not in response or 'moveCardToPhase' not in response['data']:
-                results.append({
-                    'card_id': card_id,
-                    'success': False,
-                    'message': f"Unexpected response structure from Pipefy API: {response}"
-                })
-                continue
-            
-            # Se chegou aqui, o card foi movido com sucesso
-            results.append({
-                'card_id': card_id,
-                'success': True,
-                'message': f"Card {card_id} moved successfully"
-            })
+            results.append(move_card(card_id, destination_phase_id, api_token))
         
         # Verificar se todos os cards falharam
         if all(not result['success'] for result in results):
@@ -262,6 +604,92 @@ def move_cards(card_ids: List[str], destination_phase_id: str, api_token: str) -
         logger.error(f"Error moving cards: {str(e)}", exc_info=True)
         return False, f"Error moving cards: {str(e)}"
 
+def _parse_pipefy_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _predicate_matches(predicate: Dict, card_values: Dict[str, Any], card_labels: Dict[str, Any]) -> bool:
+    field = str(predicate['field'])
+    operator = predicate.get('operator', 'eq')
+    # O campo pode ser informado pelo id ou pelo label
+    actual = card_values.get(field, card_labels.get(field.lower()))
+    actual_text = str(actual).strip().lower() if actual not in (None, "") else ""
+    expected = predicate.get('value')
+
+    if operator == 'empty':
+        return actual_text == ""
+    if operator == 'not_empty':
+        return actual_text != ""
+    if operator == 'eq':
+        return actual_text == str(expected).strip().lower()
+    if operator == 'neq':
+        return actual_text != str(expected).strip().lower()
+    if operator == 'contains':
+        return str(expected).strip().lower() in actual_text
+    if operator == 'in':
+        return actual_text in {str(item).strip().lower() for item in expected or []}
+    raise ValueError(f"Unsupported operator '{operator}'")
+
+def card_matches(
+    card: Dict,
+    predicates: List[Dict],
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    updated_from: Optional[datetime] = None,
+    updated_to: Optional[datetime] = None
+) -> bool:
+    created_at = _parse_pipefy_datetime(card.get('createdAt'))
+    updated_at = _parse_pipefy_datetime(card.get('updated_at'))
+
+    for bound, value, is_lower in (
+        (created_from, created_at, True), (created_to, created_at, False),
+        (updated_from, updated_at, True), (updated_to, updated_at, False)
+    ):
+        bound = _as_utc(bound)
+        if bound is None:
+            continue
+        if value is None or (value < bound if is_lower else value > bound):
+            return False
+
+    if not predicates:
+        return True
+
+    card_values = card_field_values(card)
+    card_labels = {
+        card_field['field']['label'].lower(): card_values.get(card_field['field']['id'])
+        for card_field in card.get('fields') or []
+        if card_field['field'].get('label')
+    }
+    return all(_predicate_matches(predicate, card_values, card_labels) for predicate in predicates)
+
+def iter_cards_by_filter(
+    source_phase_id: str,
+    api_token: str,
+    predicates: Optional[List[Dict]] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    updated_from: Optional[datetime] = None,
+    updated_to: Optional[datetime] = None,
+    page_size: int = 50
+) -> Iterator[List[str]]:
+    # Percorre a fase uma única vez e entrega, página a página, os ids dos
+    # cards que casam com o filtro (lista vazia quando nenhum casa). Quem
+    # consome não deve mover cards da fase antes do fim da leitura, para que
+    # a paginação continue estável
+    predicates = predicates or []
+    for cards in iter_phase_cards(source_phase_id, api_token, page_size):
+        yield [
+            card['id'] for card in cards
+            if card_matches(card, predicates, created_from, created_to, updated_from, updated_to)
+        ]
+
 def get_database_fields(database_id: str, api_token: str) -> List[Dict]:
     query = """
     query ($databaseId: ID!) {
@@ -339,4 +767,99 @@ def create_database_records(database_id: str, records: List[Dict[str, Any]], api
         return results
     except Exception as e:
         logger.error(f"Error creating database records: {str(e)}", exc_info=True)
-        raise Exception(f"Error creating database records: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error creating database records: {str(e)}")
+
+
+TABLE_RECORDS_QUERY = """
+query TableRecords($tableId: ID!, $first: Int!, $after: String) {
+  table_records(table_id: $tableId, first: $first, after: $after) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    edges {
+      node {
+        id
+        title
+        record_fields {
+          field {
+            id
+          }
+          value
+          array_value
+        }
+      }
+    }
+  }
+}
+"""
+
+def fetch_table_records_page(table_id: str, api_token: str, page_size: int = 50, after: Optional[str] = None) -> Tuple[List[Dict], bool, Optional[str]]:
+    variables = {"tableId": table_id, "first": page_size, "after": after}
+    data = pipefy_request(TABLE_RECORDS_QUERY, variables, api_token)
+
+    if 'errors' in data:
+        error_message = "; ".join([error['message'] for error in data['errors']])
+        raise Exception(f"Error fetching table records: {error_message}")
+
+    records = data['data']['table_records']
+    return (
+        [edge['node'] for edge in records['edges']],
+        records['pageInfo']['hasNextPage'],
+        records['pageInfo']['endCursor']
+    )
+
+def iter_table_records(table_id: str, api_token: str, page_size: int = 50) -> Iterator[List[Dict]]:
+    cursor = None
+
+    while True:
+        records, has_next_page, cursor = fetch_table_records_page(table_id, api_token, page_size, cursor)
+        yield records
+
+        if not has_next_page:
+            break
+
+def record_field_values(record: Dict) -> Dict[str, Any]:
+    # Mesmo formato de card_field_values; listas ficam como listas para a
+    # comparação do upsert não depender do separador
+    values = {}
+    for record_field in record.get('record_fields') or []:
+        array_value = record_field.get('array_value')
+        values[record_field['field']['id']] = array_value if array_value else record_field.get('value')
+    return values
+
+def update_table_record(record_id: str, field_updates: Dict[str, Any], api_token: str) -> Dict:
+    # Todos os campos do registro num único documento com aliases
+    declarations = []
+    selections = []
+    variables = {}
+    aliases = {}
+    for index, (field_id, value) in enumerate(field_updates.items()):
+        alias = f"f{index}"
+        declarations.append(f"${alias}: SetTableRecordFieldValueInput!")
+        selections.append(f"{alias}: setTableRecordFieldValue(input: ${alias}) {{ table_record {{ id }} }}")
+        variables[alias] = {"table_record_id": str(record_id), "field_id": field_id, "value": value}
+        aliases[alias] = field_id
+
+    if not aliases:
+        return {'id': record_id, 'success': True, 'message': "No fields to update"}
+
+    document = "mutation UpdateTableRecord(" + ", ".join(declarations) + ") {\n  " + "\n  ".join(selections) + "\n}"
+    response = pipefy_request(document, variables, api_token)
+    data = response.get('data') or {}
+
+    failures = []
+    errored_aliases = set()
+    for error in response.get('errors') or []:
+        path = error.get('path') or []
+        if path and path[0] in aliases:
+            errored_aliases.add(path[0])
+            failures.append(f"field {aliases[path[0]]}: {error.get('message')}")
+        else:
+            failures.append(error.get('message', 'Unknown error'))
+    for alias, field_id in aliases.items():
+        if alias not in errored_aliases and not (data.get(alias) or {}).get('table_record'):
+            failures.append(f"field {field_id}: failed")
+    if failures:
+        return {'id': record_id, 'success': False, 'message': "Pipefy API error: " + "; ".join(failures)}
+    return {'id': record_id, 'success': True, 'message': f"{len(aliases)} fields updated"}
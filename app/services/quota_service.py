@@ -0,0 +1,188 @@
+import asyncio
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from app.core.config import settings
+from app.db.mongodb import MongoDB
+import logging
+
+logger = logging.getLogger(__name__)
+
+class QuotaExceeded(Exception):
+    def __init__(self, used: int, limit: int, retry_after: int):
+        super().__init__(f"Daily Pipefy API budget exhausted ({used}/{limit} calls); resets in {retry_after} seconds")
+        self.used = used
+        self.limit = limit
+        self.retry_after = retry_after
+
+def today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def seconds_until_reset() -> int:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(math.ceil((midnight - now).total_seconds()), 1)
+
+def daily_limit(plan: str) -> int:
+    budgets = settings.PIPEFY_DAILY_CALL_BUDGETS
+    return budgets.get(plan or "free", budgets.get("free", 0))
+
+class QuotaTracker:
+    # Contagem em memória por (usuário, dia, operação). A chamada ao Pipefy só
+    # incrementa um dict sob lock; o Mongo recebe os totais em lotes de $inc
+    # com upsert a cada QUOTA_FLUSH_INTERVAL_SECONDS
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._used: Dict[Tuple[str, str], int] = {}
+        self._loaded: Dict[str, str] = {}
+        self._pending: Dict[Tuple[str, str, str], int] = {}
+        self._plans: Dict[str, str] = {}
+
+    def is_loaded(self, user_id: str) -> bool:
+        return self._loaded.get(user_id) == today()
+
+    def load(self, user_id: str, day: str, persisted: int):
+        with self._lock:
+            # Soma o que já foi gravado (inclusive por outras instâncias) ao que
+            # este processo contou e ainda não gravou
+            unflushed = sum(count for (user, pending_day, _), count in self._pending.items()
+                            if user == user_id and pending_day == day)
+            self._used[(user_id, day)] = persisted + unflushed
+            self._loaded[user_id] = day
+
+    def remaining(self, user_id: str, plan: str) -> int:
+        with self._lock:
+            return daily_limit(plan) - self._used.get((user_id, today()), 0)
+
+    def consume(self, user_id: str, plan: str, operation: str, calls: int = 1):
+        day = today()
+        limit = daily_limit(plan)
+        with self._lock:
+            used = self._used.get((user_id, day), 0)
+            if used + calls > limit:
+                raise QuotaExceeded(used, limit, seconds_until_reset())
+            self._used[(user_id, day)] = used + calls
+            key = (user_id, day, operation)
+            self._pending[key] = self._pending.get(key, 0) + calls
+            self._plans[user_id] = plan
+
+    def pending_for(self, user_id: str) -> Dict[Tuple[str, str], int]:
+        with self._lock:
+            return {
+                (day, operation): count
+                for (user, day, operation), count in self._pending.items()
+                if user == user_id
+            }
+
+    def drain(self) -> Tuple[Dict[Tuple[str, str, str], int], Dict[str, str]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            day = today()
+            # Contadores de dias anteriores não são mais consultados
+            self._used = {key: value for key, value in self._used.items() if key[1] == day}
+            return pending, dict(self._plans)
+
+    def restore(self, pending: Dict[Tuple[str, str, str], int]):
+        with self._lock:
+            for key, count in pending.items():
+                self._pending[key] = self._pending.get(key, 0) + count
+
+tracker = QuotaTracker()
+
+async def ensure_loaded(user_id: str):
+    # Chamado no caminho assíncrono (antes das chamadas ao Pipefy), uma vez
+    # por usuário por dia
+    if tracker.is_loaded(user_id):
+        return
+    day = today()
+    document = await MongoDB.database.pipefy_usage.find_one({"user_id": user_id, "day": day}, {"total": 1})
+    tracker.load(user_id, day, (document or {}).get("total", 0))
+
+def record_call(tenant: Optional[Tuple[str, str]], operation: str):
+    # Chamadas sem usuário identificado (ex.: tarefas internas) não consomem cota
+    if tenant is None:
+        return
+    user_id, plan = tenant
+    tracker.consume(user_id, plan, operation)
+
+def refund_call(tenant: Optional[Tuple[str, str]], operation: str):
+    # A chamada não chegou ao Pipefy (ex.: circuito aberto)
+    if tenant is None:
+        return
+    user_id, plan = tenant
+    tracker.consume(user_id, plan, operation, calls=-1)
+
+async def flush():
+    pending, plans = tracker.drain()
+    if not pending:
+        return 0
+
+    by_user_day: Dict[Tuple[str, str], Dict[str, int]] = {}
+    for (user_id, day, operation), count in pending.items():
+        by_user_day.setdefault((user_id, day), {})[operation] = count
+
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "day": day},
+            {
+                "$inc": dict({f"operations.{name}": count for name, count in counts.items()}, total=sum(counts.values())),
+                "$set": {"plan": plans.get(user_id, "free"), "updated_at": datetime.utcnow()}
+            },
+            upsert=True
+        )
+        for (user_id, day), counts in by_user_day.items()
+    ]
+    try:
+        await MongoDB.database.pipefy_usage.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # Devolve as contagens para a próxima tentativa
+        tracker.restore(pending)
+        logger.error(f"Failed to flush Pipefy usage counters: {str(e)}")
+        return 0
+    return len(operations)
+
+async def flush_periodically():
+    while True:
+        await asyncio.sleep(settings.QUOTA_FLUSH_INTERVAL_SECONDS)
+        await flush()
+
+def estimate_calls(operation: str, items: int) -> int:
+    # Mutations de update/move vão em documentos com até 10 cards
+    if operation in ("update_move", "move"):
+        return math.ceil(items / 10)
+    return items
+
+def check_budget(user_id: str, plan: str, estimated_calls: int):
+    remaining = tracker.remaining(user_id, plan)
+    if estimated_calls > remaining:
+        raise QuotaExceeded(daily_limit(plan) - remaining, daily_limit(plan), seconds_until_reset())
+
+async def usage(user_id: str, plan: str, days: int) -> Dict:
+    first_day = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    documents = await MongoDB.database.pipefy_usage.find(
+        {"user_id": user_id, "day": {"$gte": first_day}}
+    ).sort("day", 1).to_list(None)
+
+    per_day: Dict[str, Dict[str, int]] = {
+        document["day"]: dict(document.get("operations", {})) for document in documents
+    }
+    for (day, operation), count in tracker.pending_for(user_id).items():
+        operations = per_day.setdefault(day, {})
+        operations[operation] = operations.get(operation, 0) + count
+
+    limit = daily_limit(plan)
+    used_today = sum(per_day.get(today(), {}).values())
+    history: List[Dict] = [
+        {"day": day, "total": sum(operations.values()), "operations": operations}
+        for day, operations in sorted(per_day.items())
+    ]
+    return {
+        "plan": plan,
+        "daily_limit": limit,
+        "used_today": used_today,
+        "remaining_today": max(limit - used_today, 0),
+        "resets_in": seconds_until_reset(),
+        "days": history
+    }
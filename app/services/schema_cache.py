@@ -0,0 +1,122 @@
+import hashlib
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from app.core.cache import MISSING, TTLCache
+from app.core.config import settings
+from app.services import pipefy_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Os valores em cache são compartilhados entre requisições: não devem ser alterados
+cache = TTLCache(settings.SCHEMA_CACHE_TTL_SECONDS, settings.SCHEMA_CACHE_MAX_ENTRIES)
+
+# Pipe de cada fase já vista, para que os campos de fase também recebam a tag
+# do pipe: webhooks de campo/fase às vezes trazem só o id do pipe
+_phase_pipes: Dict[str, str] = {}
+
+def _remember_phases(pipe_id: str, phases: Iterable[Dict]):
+    for phase in phases:
+        _phase_pipes[str(phase["id"])] = pipe_id
+
+def _phase_tags(phase_id: str, pipe_id: Optional[str] = None) -> List[str]:
+    pipe_id = pipe_id or _phase_pipes.get(phase_id)
+    return [f"phase:{phase_id}"] + ([f"pipe:{pipe_id}"] if pipe_id else [])
+
+def _token_key(api_token: str) -> str:
+    # A chave inclui o token para que um usuário nunca receba o esquema
+    # carregado com as permissões de outro
+    return hashlib.sha256(api_token.encode()).hexdigest()[:16]
+
+def _normalize_pipe_id(pipe_id: str) -> str:
+    pipe_id = str(pipe_id)
+    if pipe_id.startswith('http'):
+        pipe_id = pipe_id.split('/')[-1]
+    return pipe_id
+
+def _cached(kind: str, ident: str, api_token: str, tags: Callable[[Any], Iterable[str]], loader: Callable[[], Any]) -> Any:
+    key = (kind, _token_key(api_token), str(ident))
+    value = cache.get(key)
+    if value is MISSING:
+        # A carga roda fora do lock; se um webhook invalidar as tags no meio,
+        # o valor é devolvido a quem pediu, mas não fica em cache
+        since = cache.generation()
+        value = loader()
+        cache.set(key, value, tags(value), since=since)
+    return value
+
+def get_pipe_schema(pipe_id: str, api_token: str) -> Dict:
+    pipe_id = _normalize_pipe_id(pipe_id)
+    schema = _cached(
+        "pipe_schema", pipe_id, api_token,
+        lambda schema: [f"pipe:{pipe_id}"] + [f"phase:{phase['id']}" for phase in schema['phases']],
+        lambda: pipefy_service.pipe_schema(pipe_id, api_token)
+    )
+    _remember_phases(pipe_id, schema['phases'])
+    return schema
+
+def get_pipe_phases(pipe_id: str, api_token: str) -> List[Dict]:
+    pipe_id = _normalize_pipe_id(pipe_id)
+    phases = _cached(
+        "pipe_phases", pipe_id, api_token,
+        lambda phases: [f"pipe:{pipe_id}"],
+        lambda: pipefy_service.get_pipe_phases(pipe_id, api_token)
+    )
+    _remember_phases(pipe_id, phases)
+    return phases
+
+def get_pipe_members(pipe_id: str, api_token: str) -> List[Dict]:
+    pipe_id = _normalize_pipe_id(pipe_id)
+    return _cached(
+        "pipe_members", pipe_id, api_token,
+        lambda members: [f"pipe:{pipe_id}"],
+        lambda: pipefy_service.get_pipe_members(pipe_id, api_token)
+    )
+
+def get_pipe_fields(pipe_id: str, api_token: str) -> List[Dict]:
+    pipe_id = _normalize_pipe_id(pipe_id)
+    return _cached(
+        "pipe_fields", pipe_id, api_token,
+        lambda fields: [f"pipe:{pipe_id}"],
+        lambda: pipefy_service.get_pipe_fields(pipe_id, api_token)
+    )
+
+def get_phase_fields(phase_id: str, api_token: str, pipe_id: Optional[str] = None) -> List[Dict]:
+    phase_id = str(phase_id)
+    pipe_id = _normalize_pipe_id(pipe_id) if pipe_id else None
+    return _cached(
+        "phase_fields", phase_id, api_token,
+        lambda fields: _phase_tags(phase_id, pipe_id),
+        lambda: pipefy_service.get_phase_fields(phase_id, api_token)
+    )
+
+def prime_from_schema(schema: Dict, api_token: str, since: Optional[int] = None):
+    # Deriva as entradas de fases, membros e campos de fase de um snapshot já
+    # carregado, sem novas chamadas ao Pipefy. since é a geração do cache de
+    # antes da carga do snapshot (ver TTLCache.set)
+    pipe_id = schema["pipe_id"]
+    token_key = _token_key(api_token)
+    _remember_phases(pipe_id, schema["phases"])
+    cache.set(
+        ("pipe_phases", token_key, pipe_id),
+        [{"id": phase["id"], "name": phase["name"]} for phase in schema["phases"]],
+        [f"pipe:{pipe_id}"],
+        since=since
+    )
+    cache.set(("pipe_members", token_key, pipe_id), schema["members"], [f"pipe:{pipe_id}"], since=since)
+    for phase in schema["phases"]:
+        cache.set(
+            ("phase_fields", token_key, str(phase["id"])),
+            [
+                {"id": field["id"], "label": field["label"], "type": field["type"], "options": field.get("options")}
+                for field in phase["fields"]
+            ],
+            _phase_tags(str(phase["id"]), pipe_id),
+            since=since
+        )
+
+def invalidate(pipe_ids: Iterable[str] = (), phase_ids: Iterable[str] = ()) -> int:
+    tags = [f"pipe:{pipe_id}" for pipe_id in pipe_ids] + [f"phase:{phase_id}" for phase_id in phase_ids]
+    removed = cache.invalidate_tags(tags)
+    if removed:
+        logger.info(f"Invalidated {removed} schema cache entries for {tags}")
+    return removed
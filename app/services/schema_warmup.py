@@ -0,0 +1,65 @@
+import asyncio
+from typing import Dict, Set
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.core.security import decrypt_token
+from app.db.mongodb import MongoDB
+from app.services import pipefy_scheduler, quota_service, schema_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Usuários com aquecimento em andamento (evita repetir em logins seguidos)
+_in_progress: Set[str] = set()
+
+warmup_stats: Dict[str, int] = {"runs": 0, "pipes_warmed": 0, "pipes_failed": 0, "skipped": 0}
+
+def _warm_pipe(pipe_id: str, api_token: str, user_id: str, plan: str):
+    # Roda no threadpool: a prioridade BACKGROUND faz estas chamadas cederem
+    # a vez para qualquer requisição interativa ou em massa
+    pipefy_scheduler.set_tenant(user_id, plan)
+    since = schema_cache.cache.generation()
+    with pipefy_scheduler.priority_class(pipefy_scheduler.BACKGROUND):
+        schema = schema_cache.get_pipe_schema(pipe_id, api_token)
+    schema_cache.prime_from_schema(schema, api_token, since=since)
+
+async def warm_user_pipes(email: str):
+    # Carrega em segundo plano o esquema dos pipes salvos do usuário, para
+    # que o assistente abra sem esperar o Pipefy
+    if email in _in_progress:
+        warmup_stats["skipped"] += 1
+        return
+    _in_progress.add(email)
+    try:
+        user = await MongoDB.get_user_by_email(email)
+        if not user or not user.get("pipefy_token"):
+            return
+        api_token = decrypt_token(user["pipefy_token"])
+        user_id, plan = str(user["_id"]), user.get("subscription_plan") or "free"
+        await quota_service.ensure_loaded(user_id)
+
+        pipes = await MongoDB.database.pipes.find(
+            {"user_id": user_id}, {"pipeId": 1}
+        ).to_list(settings.SCHEMA_WARMUP_MAX_PIPES)
+        pipe_ids = list(dict.fromkeys(str(pipe["pipeId"]) for pipe in pipes if pipe.get("pipeId")))
+        if not pipe_ids:
+            return
+
+        warmup_stats["runs"] += 1
+        semaphore = asyncio.Semaphore(settings.SCHEMA_WARMUP_CONCURRENCY)
+
+        async def warm(pipe_id: str):
+            async with semaphore:
+                try:
+                    await run_in_threadpool(_warm_pipe, pipe_id, api_token, user_id, plan)
+                    warmup_stats["pipes_warmed"] += 1
+                except Exception as e:
+                    warmup_stats["pipes_failed"] += 1
+                    logger.warning(f"Schema warm-up failed for pipe {pipe_id}: {str(e)}")
+
+        await asyncio.gather(*(warm(pipe_id) for pipe_id in pipe_ids))
+        logger.info(f"Schema warm-up for {email}: {len(pipe_ids)} pipes")
+    except Exception as e:
+        logger.error(f"Schema warm-up failed for {email}: {str(e)}", exc_info=True)
+    finally:
+        _in_progress.discard(email)
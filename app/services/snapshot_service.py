@@ -0,0 +1,161 @@
+import json
+import math
+import zlib
+from datetime import datetime
+from typing import Dict, List
+from bson import Binary
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+from app.core.config import settings
+from app.db.mongodb import MongoDB
+from app.services import pipefy_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Operações de jobs em massa que alteram cards e podem ser desfeitas
+OPERATIONS = {"update_move", "move"}
+
+class SnapshotNotFound(Exception):
+    pass
+
+async def ensure_indexes():
+    await MongoDB.database.bulk_snapshots.create_index([("job_id", ASCENDING), ("batch", ASCENDING)], unique=True)
+    await MongoDB.database.bulk_snapshots.create_index(
+        "created_at", expireAfterSeconds=settings.SNAPSHOT_RETENTION_DAYS * 86400
+    )
+
+def build_card_state_query(card_ids: List[str]) -> str:
+    # Um documento com aliases para vários cards: fase atual e campos
+    declarations = ", ".join(f"$c{index}: ID!" for index in range(len(card_ids)))
+    selections = "\n  ".join(
+        f"c{index}: card(id: $c{index}) {{ id current_phase {{ id }} fields {{ field {{ id }} value array_value }} }}"
+        for index in range(len(card_ids))
+    )
+    return f"query CardSnapshot({declarations}) {{\n  {selections}\n}}"
+
+def estimate_reads(items: List[Dict]) -> int:
+    # Queries de leitura que capture fará para estes itens
+    return math.ceil(len({str(item["card_id"]) for item in items}) / settings.SNAPSHOT_READ_BATCH)
+
+def read_card_states(items: List[Dict], api_token: str) -> Dict[str, Dict]:
+    # Só os campos que o job vai alterar são guardados, o que mantém o
+    # snapshot pequeno mesmo em pipes com muitos campos
+    wanted: Dict[str, set] = {}
+    for item in items:
+        wanted.setdefault(str(item["card_id"]), set()).update(str(field_id) for field_id in (item.get("field_updates") or {}))
+
+    card_ids = list(wanted)
+    states: Dict[str, Dict] = {}
+    batch_size = settings.SNAPSHOT_READ_BATCH
+    for start in range(0, len(card_ids), batch_size):
+        batch = card_ids[start:start + batch_size]
+        response = pipefy_service.pipefy_request(
+            build_card_state_query(batch),
+            {f"c{index}": card_id for index, card_id in enumerate(batch)},
+            api_token
+        )
+        errors = [error for error in response.get("errors") or [] if not error.get("path")]
+        if errors:
+            raise Exception("Error reading cards for snapshot: " + "; ".join(error.get("message", "") for error in errors))
+
+        data = response.get("data") or {}
+        for index, card_id in enumerate(batch):
+            card = data.get(f"c{index}")
+            if not card:
+                # Card inexistente ou sem acesso: a mutation também vai falhar
+                continue
+            values = pipefy_service.card_field_values(card)
+            states[card_id] = {
+                "phase_id": (card.get("current_phase") or {}).get("id"),
+                "fields": {field_id: values.get(field_id) for field_id in wanted[card_id]}
+            }
+    return states
+
+def _compress(states: Dict[str, Dict]) -> Binary:
+    return Binary(zlib.compress(json.dumps(states, separators=(",", ":")).encode("utf-8")))
+
+def _decompress(data: bytes) -> Dict[str, Dict]:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+async def has_snapshot(job_id: str) -> bool:
+    return bool(await MongoDB.database.bulk_snapshots.find_one({"job_id": job_id}, {"_id": 1}))
+
+def known_states(items: List[Dict]) -> Dict[str, Dict]:
+    # Itens que já trazem a fase de origem, lida na mesma passada que os
+    # selecionou (mover por filtro), dispensam as queries de leitura
+    return {str(item["card_id"]): {"phase_id": str(item["source_phase_id"]), "fields": {}} for item in items}
+
+async def save(job_id: str, operation: str, states: Dict[str, Dict], first_batch: int = 0) -> int:
+    # Retorna quantos lotes foram gravados; first_batch permite gravar o
+    # snapshot em partes, página a página
+    card_ids = list(states)
+    batch_size = settings.SNAPSHOT_STORE_BATCH
+    now = datetime.utcnow()
+    documents = [
+        {
+            "job_id": job_id,
+            "batch": batch,
+            "operation": operation,
+            "cards": len(card_ids[start:start + batch_size]),
+            "data": _compress({card_id: states[card_id] for card_id in card_ids[start:start + batch_size]}),
+            "created_at": now
+        }
+        for batch, start in enumerate(range(0, len(card_ids), batch_size), first_batch)
+    ]
+    if documents:
+        try:
+            await MongoDB.database.bulk_snapshots.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Duas requisições com a mesma chave leram o mesmo estado anterior;
+            # o snapshot que chegou primeiro vale
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            logger.info(f"Snapshot for job {job_id} already stored by a concurrent request")
+    return len(documents)
+
+async def discard(job_id: str):
+    await MongoDB.database.bulk_snapshots.delete_many({"job_id": job_id})
+
+async def load(job_id: str) -> Dict[str, Dict]:
+    states: Dict[str, Dict] = {}
+    found = False
+    async for document in MongoDB.database.bulk_snapshots.find({"job_id": job_id}).sort("batch", ASCENDING):
+        found = True
+        states.update(_decompress(document["data"]))
+    if not found:
+        raise SnapshotNotFound(f"No snapshot stored for job {job_id}")
+    return states
+
+def inverse_operations(payloads: List[Dict], states: Dict[str, Dict]) -> Dict:
+    # Para cada card alterado com sucesso: volta os campos ao valor anterior e
+    # move de volta para a fase em que estava. Campos que estavam vazios não
+    # podem ser restaurados (o Pipefy ignora valores vazios no update)
+    operations: Dict[str, Dict] = {}
+    not_restorable: List[Dict] = []
+    for payload in payloads:
+        card_id = str(payload["card_id"])
+        state = states.get(card_id)
+        if state is None:
+            continue
+        operation = operations.setdefault(card_id, {"card_id": card_id, "field_updates": {}})
+        for field_id in payload.get("field_updates") or {}:
+            previous = state["fields"].get(str(field_id))
+            if previous in (None, ""):
+                not_restorable.append({"card_id": card_id, "field_id": field_id})
+            else:
+                operation["field_updates"][str(field_id)] = previous
+        if payload.get("destination_phase_id") and state.get("phase_id") and state["phase_id"] != str(payload["destination_phase_id"]):
+            operation["destination_phase_id"] = state["phase_id"]
+
+    items = [operation for operation in operations.values() if operation["field_updates"] or operation.get("destination_phase_id")]
+    return {"items": items, "not_restorable": not_restorable}
+
+async def capture(job_id: str, operation: str, pending: List[Dict], api_token: str):
+    # Chamado por bulk_job_service.execute depois das checagens de cota e de
+    # idempotência e antes do primeiro envio. Só os itens que serão enviados
+    # (sem os rejeitados na validação) entram
+    states = await run_in_threadpool(read_card_states, pending, api_token)
+    await save(job_id, operation, states)
+    logger.info(f"Stored snapshot of {len(states)} cards for job {job_id}")
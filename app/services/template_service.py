@@ -0,0 +1,135 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, List
+from app.services import pipefy_service, schema_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMPILED_VERSION = 1
+
+def normalize_pipe_id(pipe_id: str) -> str:
+    pipe_id = str(pipe_id)
+    if pipe_id.startswith("http"):
+        pipe_id = pipe_id.split("/")[-1]
+    return pipe_id
+
+def compact_members(pipe_members: List[Dict]) -> List[Dict]:
+    return [
+        {
+            "id": member['user']['id'],
+            "name": member['user']['name'],
+            "email": member['user']['email']
+        }
+        for member in pipe_members
+    ]
+
+def schema_hash(phase_fields: List[Dict], pipe_members: List[Dict]) -> str:
+    # Hash estável do esquema: só o que afeta a planilha e as mutações
+    canonical = {
+        "fields": sorted(
+            [
+                [str(field['id']), field.get('label'), field.get('type'), sorted(field.get('options') or [])]
+                for field in phase_fields
+            ]
+        ),
+        "members": sorted(str(member['user']['id']) for member in pipe_members)
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def compile_template(
+    pipe_id: str,
+    phase_id: str,
+    selected: List[str],
+    selected_user: str,
+    phase_fields: List[Dict],
+    pipe_members: List[Dict]
+) -> Dict:
+    # Os campos do template podem ter sido salvos por id ou por label
+    wanted = {str(value) for value in selected}
+    selected_fields = [
+        field for field in phase_fields
+        if str(field['id']) in wanted or field.get('label') in wanted
+    ]
+
+    missing = wanted - {str(field['id']) for field in selected_fields} - {field.get('label') for field in selected_fields}
+    if missing:
+        logger.warning(f"Template fields no longer present in phase {phase_id}: {sorted(missing)}")
+
+    mutation_plan = [
+        {
+            "column": column,
+            "field_id": field['id'],
+            "label": field['label'],
+            "type": field['type'],
+            "mutation": "updateCardField",
+            "default_value": selected_user if field['type'] == 'assignee_select' else None
+        }
+        for column, field in enumerate(selected_fields, start=1)
+    ]
+
+    return {
+        "version": COMPILED_VERSION,
+        "pipe_id": normalize_pipe_id(pipe_id),
+        "phase_id": str(phase_id),
+        "schema_hash": schema_hash(phase_fields, pipe_members),
+        "compiled_at": datetime.utcnow(),
+        "phase_fields": phase_fields,
+        "selected_field_ids": [field['id'] for field in selected_fields],
+        "pipe_members": pipe_members,
+        "mutation_plan": mutation_plan,
+        "missing_fields": sorted(missing)
+    }
+
+def phase_fields_from_schema(schema: Dict, phase_id: str) -> List[Dict]:
+    # Remove a chave phase_id adicionada pelo snapshot para manter o mesmo
+    # formato retornado por get_phase_fields
+    phase = pipefy_service.schema_phase(schema, phase_id)
+    return [{k: v for k, v in field.items() if k != 'phase_id'} for field in phase['fields']]
+
+def fetch_schema(pipe_id: str, phase_id: str, api_token: str, use_cache: bool = True):
+    if use_cache:
+        schema = schema_cache.get_pipe_schema(pipe_id, api_token)
+    else:
+        schema = pipefy_service.pipe_schema(normalize_pipe_id(pipe_id), api_token)
+    return phase_fields_from_schema(schema, phase_id), schema['members']
+
+def compile_from_pipefy(template: Dict, api_token: str) -> Dict:
+    phase_fields, pipe_members = fetch_schema(template["pipe_id"], template["phase_id"], api_token)
+    return compile_template(
+        template["pipe_id"],
+        template["phase_id"],
+        template.get("fields", []),
+        template.get("selected_user", ""),
+        phase_fields,
+        pipe_members
+    )
+
+def is_compiled(template: Dict) -> bool:
+    compiled = template.get("compiled")
+    return bool(compiled) and compiled.get("version") == COMPILED_VERSION and not template.get("schema_stale")
+
+def cache_entry(compiled: Dict) -> Dict:
+    # Mesmo formato que /get_phases, /get_fields e /prepare_fields_selection
+    # deixam em user_fields_cache
+    selected_ids = set(compiled["selected_field_ids"])
+    selected_fields = [field for field in compiled["phase_fields"] if field['id'] in selected_ids]
+    return {
+        "pipe_id": compiled["pipe_id"],
+        "phase_id": compiled["phase_id"],
+        "fields": compiled["phase_fields"],
+        "pipe_members": compiled["pipe_members"],
+        "selected_fields": [field['label'] for field in selected_fields],
+        "assignee_fields": [field for field in selected_fields if field['type'] == 'assignee_select'],
+        "schema_hash": compiled["schema_hash"]
+    }
+
+def assignee_options(compiled: Dict) -> List[Dict]:
+    members = compact_members(compiled["pipe_members"])
+    return [
+        {"field_label": step["label"], "members": members}
+        for step in compiled["mutation_plan"]
+        if step["type"] == 'assignee_select'
+    ]
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Union
+from fastapi import HTTPException, UploadFile
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+@dataclass
+class SpooledUpload:
+    file: Union[BinaryIO, str]
+    filename: str
+    size: int
+    sha256: str
+
+async def spool_upload(file: UploadFile, max_bytes: int = None) -> SpooledUpload:
+    # O Starlette já grava o upload num SpooledTemporaryFile (em disco acima de
+    # 1 MB). Aqui ele é percorrido em blocos para medir e calcular o checksum,
+    # sem nunca carregar o conteúdo inteiro em memória. O checksum não é
+    # calculado durante a chegada: o middleware de limite só vê o corpo
+    # multipart bruto (com delimitadores e outros campos), e o parser do
+    # Starlette não expõe os blocos do arquivo. A releitura é sequencial e o
+    # limite de bytes já foi aplicado na chegada (UploadSizeLimitMiddleware).
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    digest = hashlib.sha256()
+    size = 0
+
+    await file.seek(0)
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds the maximum size of {max_bytes} bytes")
+        digest.update(chunk)
+    await file.seek(0)
+
+    logger.info(f"Upload {file.filename} spooled: {size} bytes, sha256 {digest.hexdigest()[:12]}")
+    return SpooledUpload(file=file.file, filename=file.filename, size=size, sha256=digest.hexdigest())
+
+async def spool_to_disk(file: UploadFile, max_bytes: int = None, suffix: str = ".xlsx") -> SpooledUpload:
+    # Para quem precisa de um caminho em disco (ex.: processos do pool de
+    # análise), copia o upload em blocos para um arquivo temporário
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    digest = hashlib.sha256()
+    size = 0
+
+    await file.seek(0)
+    tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with tmp:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the maximum size of {max_bytes} bytes")
+                digest.update(chunk)
+                tmp.write(chunk)
+    except Exception:
+        os.remove(tmp.name)
+        raise
+
+    logger.info(f"Upload {file.filename} written to disk: {size} bytes, sha256 {digest.hexdigest()[:12]}")
+    return SpooledUpload(file=tmp.name, filename=file.filename, size=size, sha256=digest.hexdigest())
@@ -0,0 +1,101 @@
+import json
+from typing import Any, Dict, List, Optional
+from app.services import pipefy_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+CREATE = "create"
+UPDATE = "update"
+SKIP = "skip"
+
+def normalize_value(value: Any) -> Any:
+    # O Pipefy devolve tudo como texto (listas como '["a", "b"]'); a planilha
+    # manda números, listas e espaços sobrando. Compara-se a forma normalizada
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith("["):
+            try:
+                value = json.loads(text)
+            except ValueError:
+                return text
+        else:
+            return text
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return tuple(sorted(str(item).strip() for item in value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def build_index(table_id: str, key_field_id: str, api_token: str) -> Dict[Any, Dict]:
+    # Uma passada paginada pela tabela: valor da chave -> registro existente.
+    # Só a chave e os valores dos campos ficam em memória
+    index: Dict[Any, Dict] = {}
+    duplicates = 0
+    for records in pipefy_service.iter_table_records(table_id, api_token):
+        for record in records:
+            values = pipefy_service.record_field_values(record)
+            key = normalize_value(values.get(key_field_id))
+            if key == "":
+                continue
+            if key in index:
+                # Chave repetida na tabela: o primeiro registro é o que recebe updates
+                duplicates += 1
+                continue
+            index[key] = {"id": record["id"], "values": values}
+    if duplicates:
+        logger.warning(f"Table {table_id} has {duplicates} records with a repeated value in field {key_field_id}")
+    return index
+
+def changed_fields(record: Dict[str, Any], existing: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        field_id: value
+        for field_id, value in record.items()
+        if normalize_value(value) != normalize_value(existing.get(field_id))
+    }
+
+def plan_upsert(
+    database_id: str,
+    records: List[Dict[str, Any]],
+    key_field_id: str,
+    index: Dict[Any, Dict]
+) -> Dict[str, Any]:
+    # Cada linha vira create, update (só com os campos que mudaram) ou skip.
+    # Skips e conflitos entram como resultados já concluídos, sem mutation
+    items: List[Dict] = []
+    completed: Dict[int, Dict] = {}
+    counts = {CREATE: 0, UPDATE: 0, SKIP: 0, "rejected": 0}
+    seen: Dict[Any, int] = {}
+
+    for position, record in enumerate(records):
+        key = normalize_value(record.get(key_field_id))
+        item = {"database_id": database_id, "record": record}
+        items.append(item)
+
+        if key != "" and key in seen:
+            completed[position] = {
+                "success": False,
+                "action": SKIP,
+                "message": f"Key {record.get(key_field_id)!r} repeats row {seen[key]} of this import"
+            }
+            counts["rejected"] += 1
+            continue
+        if key != "":
+            seen[key] = position
+
+        existing: Optional[Dict] = index.get(key) if key != "" else None
+        if existing is None:
+            counts[CREATE] += 1
+            continue
+
+        changes = changed_fields(record, existing["values"])
+        if not changes:
+            completed[position] = {"success": True, "action": SKIP, "id": existing["id"], "message": "Unchanged"}
+            counts[SKIP] += 1
+            continue
+        item.update(record_id=existing["id"], record=changes)
+        counts[UPDATE] += 1
+
+    return {"items": items, "completed": completed, "counts": counts}
@@ -0,0 +1,235 @@
+import re
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FieldValueError(ValueError):
+    pass
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)(:[0-5]\d)?$")
+
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d/%m/%y"]
+DATETIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M",
+    "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M"
+]
+
+def _parse_datetime(value: str, formats: List[str]) -> Optional[datetime]:
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+def _normalize_date(value: Any) -> str:
+    if isinstance(value, (datetime, date)):
+        return value.strftime("%Y-%m-%d")
+    text = str(value).strip()
+    # Células de data lidas do XLSX chegam como "2024-01-31 00:00:00"
+    parsed = _parse_datetime(text, DATE_FORMATS) or _parse_datetime(text, DATETIME_FORMATS)
+    if not parsed:
+        raise FieldValueError(f"Invalid date '{text}' (expected YYYY-MM-DD or DD/MM/YYYY)")
+    return parsed.strftime("%Y-%m-%d")
+
+def _normalize_datetime(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    text = str(value).strip()
+    parsed = _parse_datetime(text, DATETIME_FORMATS) or _parse_datetime(text, DATE_FORMATS)
+    if not parsed:
+        raise FieldValueError(f"Invalid date/time '{text}' (expected YYYY-MM-DD HH:MM)")
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S")
+
+def _normalize_time(value: Any) -> str:
+    text = str(value).strip()
+    match = TIME_RE.match(text)
+    if not match:
+        raise FieldValueError(f"Invalid time '{text}' (expected HH:MM)")
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+def _grouped(text: str, separator: str) -> bool:
+    # Milhares bem formados: 1.234.567 / 1,234,567
+    return bool(re.fullmatch(r"\d{1,3}(?:" + re.escape(separator) + r"\d{3})+", text))
+
+def _normalize_number(value: Any) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    text = str(value).strip().replace(" ", "")
+    sign = ""
+    if text[:1] in ("-", "+"):
+        sign, text = text[0], text[1:]
+
+    # Aceita 1.234,56 e 1,234.56: com os dois separadores, o último é o
+    # decimal e o outro precisa agrupar milhares. Formas ambíguas (1,234) ou
+    # malformadas (1.234,5.6) são rejeitadas em vez de adivinhadas
+    if "," in text and "." in text:
+        decimal = "," if text.rfind(",") > text.rfind(".") else "."
+        thousands = "." if decimal == "," else ","
+        integer, _, fraction = text.rpartition(decimal)
+        if not _grouped(integer, thousands) or not fraction.isdigit():
+            raise FieldValueError(f"Invalid number '{value}'")
+        text = f"{integer.replace(thousands, '')}.{fraction}"
+    elif text.count(",") == 1 or text.count(".") == 1:
+        # Um único separador seguido de três dígitos (1,234 / 1.234) pode ser
+        # milhar ou decimal, conforme a planilha; 0,123 e 1234,567 não
+        separator = "," if "," in text else "."
+        integer, fraction = text.split(separator)
+        if len(fraction) == 3 and re.fullmatch(r"[1-9]\d{0,2}", integer):
+            raise FieldValueError(f"Ambiguous number '{value}' (use 1234 or 1,5 / 1.5)")
+        text = f"{integer}.{fraction}"
+    elif text.count(",") > 1 or text.count(".") > 1:
+        separator = "," if "," in text else "."
+        if not _grouped(text, separator):
+            raise FieldValueError(f"Invalid number '{value}'")
+        text = text.replace(separator, "")
+
+    if not re.fullmatch(r"\d+(?:\.\d+)?|\.\d+", text):
+        raise FieldValueError(f"Invalid number '{value}'")
+    return sign + text
+
+def _normalize_email(value: Any) -> str:
+    text = str(value).strip()
+    if not EMAIL_RE.match(text):
+        raise FieldValueError(f"Invalid email '{text}'")
+    return text
+
+def _option_normalizer(options: List[str], multiple: bool) -> Callable[[Any], str]:
+    lookup = {option.strip().lower(): option for option in options}
+
+    def normalize(value: Any) -> str:
+        items = [item.strip() for item in str(value).split(",")] if multiple else [str(value).strip()]
+        normalized = []
+        for item in items:
+            if not item:
+                continue
+            option = lookup.get(item.lower())
+            if option is None:
+                raise FieldValueError(f"Option '{item}' does not exist (allowed: {', '.join(options)})")
+            normalized.append(option)
+        return ", ".join(normalized)
+
+    return normalize
+
+def _assignee_normalizer(members: List[Dict]) -> Callable[[Any], str]:
+    # Aceita o id, o email ou o nome do membro e sempre envia o id
+    lookup = {}
+    for member in members:
+        user = member.get('user', member)
+        for key in (user.get('name'), user.get('email'), user.get('id')):
+            if key:
+                lookup[str(key).strip().lower()] = str(user['id'])
+
+    def normalize(value: Any) -> str:
+        ids = []
+        for item in str(value).split(","):
+            item = item.strip()
+            if not item:
+                continue
+            member_id = lookup.get(item.lower())
+            if member_id is None:
+                raise FieldValueError(f"Unknown assignee '{item}'")
+            ids.append(member_id)
+        return ", ".join(ids)
+
+    return normalize
+
+def _text(value: Any) -> str:
+    return str(value).strip()
+
+def build_normalizer(field: Dict, members: Optional[List[Dict]] = None) -> Callable[[Any], str]:
+    field_type = field.get('type')
+    options = field.get('options') or []
+
+    if field_type in ('date',):
+        return _normalize_date
+    if field_type in ('datetime', 'due_date'):
+        return _normalize_datetime
+    if field_type == 'time':
+        return _normalize_time
+    if field_type in ('number', 'currency'):
+        return _normalize_number
+    if field_type == 'email':
+        return _normalize_email
+    if field_type in ('select', 'radio_horizontal', 'radio_vertical') and options:
+        return _option_normalizer(options, multiple=False)
+    if field_type in ('checklist_horizontal', 'checklist_vertical') and options:
+        return _option_normalizer(options, multiple=True)
+    if field_type == 'assignee_select' and members is not None:
+        return _assignee_normalizer(members)
+    return _text
+
+def validate_rows(
+    rows: Iterable[Tuple[Any, str, Dict[str, Any]]],
+    fields: List[Dict],
+    members: Optional[List[Dict]] = None
+) -> Tuple[List[Tuple[Any, str, Dict[str, str]]], List[Dict]]:
+    rows = list(rows)
+    fields_by_id = {str(field['id']): field for field in fields}
+
+    # Validação coluna a coluna: cada normalizador é montado uma única vez
+    # e aplicado a todos os valores daquele campo
+    columns: Dict[Any, List[int]] = {}
+    for position, (_, _, field_updates) in enumerate(rows):
+        for field_id in field_updates:
+            columns.setdefault(field_id, []).append(position)
+
+    normalized_rows = [dict() for _ in rows]
+    errors_by_row: Dict[int, List[Dict]] = {}
+
+    for field_id, positions in columns.items():
+        field = fields_by_id.get(str(field_id), {"id": field_id, "label": field_id})
+        normalize = build_normalizer(field, members)
+        for position in positions:
+            row_ref, card_id, field_updates = rows[position]
+            value = field_updates[field_id]
+            if value is None or not str(value).strip():
+                # Célula vazia não altera o campo (o envio já ignora valores
+                # vazios) e não invalida a linha
+                continue
+            try:
+                normalized_rows[position][field_id] = normalize(value)
+            except FieldValueError as e:
+                errors_by_row.setdefault(position, []).append({
+                    "row": row_ref,
+                    "card_id": card_id,
+                    "field_id": field_id,
+                    "label": field.get('label', field_id),
+                    "value": value,
+                    "message": str(e)
+                })
+
+    valid_rows = []
+    errors = []
+    for position, (row_ref, card_id, _) in enumerate(rows):
+        if position in errors_by_row:
+            errors.extend(errors_by_row[position])
+        else:
+            valid_rows.append((row_ref, card_id, normalized_rows[position]))
+
+    if errors:
+        logger.info(f"Local validation rejected {len(errors_by_row)} of {len(rows)} rows")
+    return valid_rows, errors
+
+def needs_members(fields: List[Dict], field_ids: Iterable[str]) -> bool:
+    selected = {str(field_id) for field_id in field_ids}
+    return any(field.get('type') == 'assignee_select' and str(field['id']) in selected for field in fields)
+
+def group_errors_by_row(errors: List[Dict]) -> Dict[Any, List[Dict]]:
+    grouped: Dict[Any, List[Dict]] = {}
+    for error in errors:
+        grouped.setdefault(error["row"], []).append(error)
+    return grouped
+
+def rejected_result(card_id: str, row_errors: List[Dict]) -> Dict:
+    return {
+        "card_id": card_id,
+        "success": False,
+        "message": "Rejected by local validation: " + "; ".join(
+            f"{error['label']}: {error['message']}" for error in row_errors
+        ),
+        "errors": row_errors
+    }
@@ -0,0 +1,266 @@
+import asyncio
+import re
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.comments import Comment
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from app.core.config import settings
+from app.services import pipefy_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _column_width(values: List[Any]) -> float:
+    max_length = max((len(value) for value in values if isinstance(value, str)), default=0)
+    return (max_length + 2) * 1.2
+
+def write_update_template(
+    target: Union[str, BinaryIO],
+    selected_field_details: List[Dict],
+    selected_user: str,
+    card_pages: Optional[Iterable[List[Dict]]] = None,
+    phase_id: Optional[str] = None
+) -> int:
+    # Modo write-only: cada linha é serializada ao ser adicionada e descartada
+    # em seguida, então a memória não cresce com o número de cards
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    # Cabeçalho visível do XLSX (apenas labels)
+    visible_headers = ["ID do card"] + [field['label'] for field in selected_field_details]
+    # Cabeçalho oculto com IDs dos campos
+    hidden_headers = [card_id_header(phase_id)] + [field['id'] for field in selected_field_details]
+    # Responsável selecionado como valor padrão para campos assignee
+    default_row = [None] + [
+        selected_user if field['type'] == 'assignee_select' else None
+        for field in selected_field_details
+    ]
+
+    # No modo write-only larguras e linhas ocultas precisam ser definidas
+    # antes da primeira linha ser escrita
+    for index, column_values in enumerate(zip(visible_headers, hidden_headers, default_row), start=1):
+        ws.column_dimensions[get_column_letter(index)].width = _column_width(list(column_values))
+    ws.row_dimensions[2].hidden = True
+
+    ws.append(visible_headers)
+    ws.append(hidden_headers)
+
+    rows_written = 0
+    if card_pages is None:
+        ws.append(default_row)
+    else:
+        field_ids = [field['id'] for field in selected_field_details]
+        for cards in card_pages:
+            for card in cards:
+                values = pipefy_service.card_field_values(card)
+                ws.append([card['id']] + [values.get(field_id) for field_id in field_ids])
+                rows_written += 1
+
+    wb.save(target)
+    return rows_written
+
+def build_update_template(selected_field_details: List[Dict], selected_user: str) -> bytes:
+    buffer = BytesIO()
+    write_update_template(buffer, selected_field_details, selected_user)
+    return buffer.getvalue()
+
+RESULT_HEADERS = ["Status", "Mensagem", "Latência (ms)"]
+RESULT_OK = "OK"
+RESULT_FAILED = "Erro"
+RESULT_SKIPPED = "Ignorada"
+
+FAILED_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+FAILED_FONT = Font(color="9C0006")
+COMMENT_AUTHOR = "Pipefy"
+
+# Mensagens do dispatch em lote: "field <id>: <erro>; field <id>: <erro>"
+FIELD_ERROR_PATTERN = re.compile(r"field (\S+): ([^;]+)")
+
+def failed_fields(result: Dict) -> Dict[str, str]:
+    # Campo -> mensagem, vindo da validação local ou do erro do Pipefy
+    failures: Dict[str, str] = {}
+    for error in result.get('errors') or []:
+        if error.get('field_id'):
+            failures[str(error['field_id'])] = error.get('message', "")
+    for field_id, message in FIELD_ERROR_PATTERN.findall(str(result.get('message') or "")):
+        failures.setdefault(field_id, message.strip())
+    return failures
+
+def _failed_cell(ws, value: Any, message: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    cell.fill = FAILED_FILL
+    cell.font = FAILED_FONT
+    cell.comment = Comment(message, COMMENT_AUTHOR)
+    return cell
+
+def write_result_workbook(
+    source: Union[str, BinaryIO],
+    target: Union[str, BinaryIO],
+    results_by_row: Dict[int, Dict]
+) -> int:
+    # A planilha enviada é relida em read_only e copiada linha a linha para
+    # um workbook write-only com as colunas de resultado; nenhum dos dois
+    # mantém a planilha inteira em memória
+    if hasattr(source, "seek"):
+        source.seek(0)
+    wb_in = load_workbook(filename=source, read_only=True, data_only=True)
+    try:
+        ws_in = wb_in.active
+        rows = ws_in.iter_rows(values_only=True)
+        headers = list(next(rows, ()))
+        field_ids = list(next(rows, ()))
+        width = max(len(headers), len(field_ids))
+        columns = {str(field_id): index for index, field_id in enumerate(field_ids) if field_id is not None and index > 0}
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(ws_in.title)
+        for index in range(1, width + 1):
+            ws.column_dimensions[get_column_letter(index)].width = _column_width(
+                [headers[index - 1] if index <= len(headers) else None]
+            )
+        ws.column_dimensions[get_column_letter(width + 2)].width = 60
+        ws.row_dimensions[2].hidden = True
+
+        ws.append(headers + [None] * (width - len(headers)) + RESULT_HEADERS)
+        ws.append(field_ids + [None] * (width - len(field_ids)))
+
+        annotated = 0
+        for row_index, row in enumerate(rows, start=3):
+            values = list(row) + [None] * (width - len(row))
+            result = results_by_row.get(row_index)
+            if result is None:
+                status = RESULT_SKIPPED if values and values[0] else None
+                ws.append(values + [status, None, None])
+                continue
+
+            annotated += 1
+            if result.get('success'):
+                ws.append(values + [RESULT_OK, result.get('message'), result.get('latency_ms')])
+                continue
+
+            failures = failed_fields(result)
+            cells: List[Any] = list(values)
+            for field_id, message in failures.items():
+                column = columns.get(field_id)
+                if column is not None:
+                    cells[column] = _failed_cell(ws, values[column], message)
+            if not any(field_id in columns for field_id in failures):
+                # Falha do card inteiro (ex.: card inexistente): marca o ID
+                cells[0] = _failed_cell(ws, values[0], str(result.get('message') or ""))
+            ws.append(cells + [RESULT_FAILED, result.get('message'), result.get('latency_ms')])
+
+        wb.save(target)
+        return annotated
+    finally:
+        wb_in.close()
+
+def iter_file_chunks(path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+CARD_ID_HEADER = "card_id"
+
+def card_id_header(phase_id: Optional[str] = None) -> str:
+    # A primeira célula da linha oculta pode indicar a fase da aba
+    # ("card_id:phase:<id>") para planilhas com várias abas
+    return f"{CARD_ID_HEADER}:phase:{phase_id}" if phase_id else CARD_ID_HEADER
+
+def sheet_target(header: Any) -> Tuple[Optional[str], Optional[str]]:
+    # Retorna ("phase" | "template" | None, id) a partir da célula A2
+    parts = str(header or "").split(":")
+    if len(parts) == 3 and parts[0] == CARD_ID_HEADER and parts[1] in ("phase", "template") and parts[2]:
+        return parts[1], parts[2]
+    return None, None
+
+def _read_sheet_rows(ws) -> Tuple[List[Any], List[Tuple[int, str, Tuple[Optional[str], ...]]]]:
+    # Hidden row with field IDs
+    field_ids = list(next(ws.iter_rows(min_row=2, max_row=2, values_only=True), ()))
+
+    rows = []
+    for row_index, row in enumerate(ws.iter_rows(min_row=3, values_only=True), start=3):
+        if not row or not row[0]:  # Skip if no card ID
+            continue
+        values = tuple(
+            str(value) if value is not None else None
+            for value in row[1:len(field_ids)]
+        )
+        rows.append((row_index, str(row[0]), values))
+
+    return field_ids, rows
+
+def row_updates(field_ids: List[Any], values: Tuple[Optional[str], ...]) -> Dict[str, str]:
+    return {
+        field_ids[i]: value
+        for i, value in enumerate(values, start=1)
+        if value is not None
+    }
+
+def parse_update_workbook(source: Union[str, bytes, BinaryIO]) -> Tuple[List[Any], List[Tuple[int, str, Dict[str, str]]]]:
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    # read_only lê as linhas sob demanda direto do arquivo (em disco ou em
+    # memória), sem montar o objeto de cada célula da planilha inteira
+    wb = load_workbook(filename=source, read_only=True, data_only=True)
+    try:
+        field_ids, rows = _read_sheet_rows(wb.active)
+        return field_ids, [
+            (row_index, card_id, row_updates(field_ids, values))
+            for row_index, card_id, values in rows
+        ]
+    finally:
+        wb.close()
+
+def list_sheet_names(path: str) -> List[str]:
+    wb = load_workbook(filename=path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def parse_sheet(path: str, sheet_name: str) -> Tuple[str, List[Any], List[Tuple[int, str, Tuple[Optional[str], ...]]]]:
+    # Executado nos processos do pool: devolve apenas tuplas de strings, que
+    # são baratas de serializar entre processos
+    wb = load_workbook(filename=path, read_only=True, data_only=True)
+    try:
+        field_ids, rows = _read_sheet_rows(wb[sheet_name])
+        return sheet_name, field_ids, rows
+    finally:
+        wb.close()
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=settings.XLSX_PARSE_WORKERS or None)
+    return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=True, cancel_futures=True)
+        _parse_pool = None
+
+async def parse_workbook_sheets(path: str) -> AsyncIterator[Tuple[str, List[Any], List[Tuple[int, str, Tuple[Optional[str], ...]]]]]:
+    loop = asyncio.get_running_loop()
+    sheet_names = await loop.run_in_executor(None, list_sheet_names, path)
+    pool = get_parse_pool()
+
+    # Cada aba é analisada em paralelo; os resultados são entregues na ordem
+    # em que ficam prontos
+    futures = [loop.run_in_executor(pool, parse_sheet, path, sheet_name) for sheet_name in sheet_names]
+    for future in asyncio.as_completed(futures):
+        yield await future
@@ -0,0 +1,50 @@
+# teste_webhooks.py
+# Reenvia os payloads gravados em app/webhook_payloads para uma instância
+# local da API, assinados com PIPEFY_WEBHOOK_SECRET.
+#
+#   python -m app.teste_webhooks                     # todos os payloads
+#   python -m app.teste_webhooks card_move.json      # apenas os informados
+import glob
+import hashlib
+import hmac
+import os
+import sys
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(__file__), "webhook_payloads")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "http://localhost:8000/api/v1/webhooks/pipefy")
+
+def replay(path: str, secret: str):
+    with open(path, "rb") as f:
+        body = f.read()
+
+    signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    response = requests.post(
+        WEBHOOK_URL,
+        data=body,
+        headers={"Content-Type": "application/json", "X-Pipefy-Signature": signature},
+        timeout=10
+    )
+    print(f"{os.path.basename(path)}: {response.status_code} {response.text}")
+    return response.status_code == 200
+
+def main(names):
+    secret = os.getenv("PIPEFY_WEBHOOK_SECRET")
+    if not secret:
+        print("PIPEFY_WEBHOOK_SECRET não configurado")
+        return 1
+
+    if names:
+        paths = [os.path.join(PAYLOADS_DIR, name) for name in names]
+    else:
+        paths = sorted(glob.glob(os.path.join(PAYLOADS_DIR, "*.json")))
+
+    failures = [path for path in paths if not replay(path, secret)]
+    print(f"{len(paths) - len(failures)}/{len(paths)} payloads aceitos")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,120 @@
+import base64
+import gzip
+import json
+import os
+import random
+from datetime import timedelta
+from typing import Callable, Dict, List, Tuple
+
+# Valores fixos para que as configurações carreguem sem um .env real
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "openpipes_benchmark")
+os.environ.setdefault("ENCRYPTION_KEY", base64.urlsafe_b64encode(b"0" * 32).decode())
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from jose import jwt
+from app.core.config import settings
+from app.core import security
+from app.core.responses import trusted_json
+from app.models.user import UserInDB
+from app.api.v1.endpoints.pipefy import PipeInDB
+from app.services import xlsx_service
+from benchmarks import logging_cost
+
+SEED = 20240101
+FIELD_TYPES = ["short_text", "long_text", "number", "date", "select", "assignee_select"]
+
+def _fields(count: int) -> List[Dict]:
+    return [
+        {"id": f"field_{i}", "label": f"Campo {i}", "type": FIELD_TYPES[i % len(FIELD_TYPES)]}
+        for i in range(count)
+    ]
+
+def _results(count: int) -> List[Dict]:
+    rng = random.Random(SEED)
+    return [
+        {
+            "card_id": str(900000000 + i),
+            "success": rng.random() > 0.1,
+            "message": "All fields updated successfully" if i % 10 else "Pipefy API error: invalid value"
+        }
+        for i in range(count)
+    ]
+
+def _user_docs(count: int) -> List[Dict]:
+    return [
+        {
+            "_id": ObjectId(f"{i:024x}"),
+            "email": f"user{i}@example.com",
+            "full_name": f"Usuário {i}",
+            "hashed_password": "$2b$12$" + "a" * 53,
+            "subscription_plan": "free",
+            "pipefy_token": None
+        }
+        for i in range(count)
+    ]
+
+def _pipe_docs(count: int) -> List[Dict]:
+    return [
+        {"id": f"{i:024x}", "name": f"Pipe {i}", "pipeId": str(300000000 + i), "user_id": f"{i % 7:024x}"}
+        for i in range(count)
+    ]
+
+def _update_workbook(rows: int, fields: List[Dict]) -> bytes:
+    from openpyxl import Workbook
+    from io import BytesIO
+
+    rng = random.Random(SEED)
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["ID do card"] + [field["label"] for field in fields])
+    ws.append(["card_id"] + [field["id"] for field in fields])
+    for i in range(rows):
+        ws.append([str(900000000 + i)] + [f"valor {rng.randint(0, 10**6)}" for _ in fields])
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def payload_sizes() -> List[Tuple[str, int]]:
+    # Bytes na rede da resposta de 10k resultados, sem e com gzip
+    results = _results(10000)
+    default_body = JSONResponse(jsonable_encoder({"results": results})).body
+    trusted_body = trusted_json({"results": results}).body
+    return [
+        ("response_10k_results_default", len(default_body)),
+        ("response_10k_results_trusted", len(trusted_body)),
+        ("response_10k_results_gzip", len(gzip.compress(trusted_body, settings.RESPONSE_GZIP_LEVEL))),
+    ]
+
+def build_cases() -> List[Tuple[str, Callable[[], object], int]]:
+    # (nome, função, número de execuções por amostra)
+    template_fields = _fields(40)
+    workbook = _update_workbook(2000, _fields(10))
+    results = _results(10000)
+    user_docs = _user_docs(1000)
+    pipe_docs = _pipe_docs(1000)
+
+    token = security.create_access_token({"sub": "bench@example.com"}, expires_delta=timedelta(minutes=30))
+    secret = "pipefy-api-token-" + "x" * 200
+    encrypted = security.encrypt_token(secret)
+    hashed = security.get_password_hash("Benchmark@123")
+
+    return [
+        ("xlsx_generate_template_40_fields", lambda: xlsx_service.build_update_template(template_fields, "123"), 20),
+        ("xlsx_parse_2000_rows", lambda: xlsx_service.parse_update_workbook(workbook), 3),
+        ("json_encode_10k_results", lambda: json.dumps({"results": results}), 10),
+        # Resposta de 10k resultados: caminho padrão (jsonable_encoder + json) x orjson direto
+        ("response_10k_results_default", lambda: JSONResponse(jsonable_encoder({"results": results})).body, 5),
+        ("response_10k_results_trusted", lambda: trusted_json({"results": results}).body, 10),
+        ("gzip_10k_results", lambda: gzip.compress(trusted_json({"results": results}).body, settings.RESPONSE_GZIP_LEVEL), 5),
+        ("jwt_encode", lambda: security.create_access_token({"sub": "bench@example.com"}), 500),
+        ("jwt_decode", lambda: jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]), 500),
+        ("fernet_encrypt", lambda: security.encrypt_token(secret), 500),
+        ("fernet_decrypt", lambda: security.decrypt_token(encrypted), 500),
+        ("bcrypt_verify", lambda: security.verify_password("Benchmark@123", hashed), 2),
+        ("model_user_in_db_1000", lambda: [UserInDB(**doc) for doc in user_docs], 5),
+        ("model_pipe_in_db_1000", lambda: [PipeInDB(**doc) for doc in pipe_docs], 10),
+    ] + logging_cost.build_cases()
@@ -0,0 +1,67 @@
+# Custo de log por mutation no caminho do pipefy_request, antes e depois do
+# logging estruturado. Cada caso usa um logger isolado escrevendo em
+# os.devnull, então mede só o trabalho feito na thread que faz a chamada.
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueListener
+from typing import Callable, List, Tuple
+from app.core.config import settings
+from app.core.structured_logging import SamplingFilter, SizeBoundedQueueHandler, StructuredFormatter, log_event
+from app.services import pipefy_service
+
+def _mutation_payload():
+    operations = [
+        {
+            "card_id": str(900000000 + i),
+            "field_updates": {f"campo_{j}": f"valor {i}-{j}" for j in range(5)},
+            "destination_phase_id": "310000001"
+        }
+        for i in range(10)
+    ]
+    document, variables, aliases = pipefy_service.build_card_mutation_document(operations)
+    response = {"data": {alias: {"success": True, "card": {"id": "1"}} for alias in aliases}}
+    return document, variables, json.dumps(response)
+
+def _isolated_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"benchmarks.{name}")
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+def build_cases() -> List[Tuple[str, Callable[[], object], int]]:
+    document, variables, response_text = _mutation_payload()
+    devnull = open(os.devnull, "w")
+
+    # Antes: f-strings com documento, variáveis e resposta inteiros, formatados
+    # e escritos de forma síncrona em INFO
+    sync_handler = logging.StreamHandler(devnull)
+    sync_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    before = _isolated_logger("log_before", sync_handler)
+
+    def log_before():
+        before.info(f"Sending request to Pipefy API. Query: {document}, Variables: {variables}")
+        before.info(f"Pipefy API response status code: {200}")
+        before.info(f"Pipefy API response content: {response_text}")
+
+    # Depois: DEBUG preguiçoso + um evento estruturado amostrado, enfileirado
+    # sem bloquear; formatação e escrita ficam na thread do listener
+    output = logging.StreamHandler(devnull)
+    output.setFormatter(StructuredFormatter(settings.LOG_MESSAGE_MAX_CHARS))
+    queued = SizeBoundedQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE), settings.LOG_FIELD_MAX_CHARS)
+    queued.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+    QueueListener(queued.queue, output).start()
+    after = _isolated_logger("log_after", queued)
+
+    def log_after():
+        after.debug("Pipefy request query=%s variables=%s", document, variables)
+        log_event(after, logging.INFO, "pipefy.request", endpoint="updateCardField", status=200,
+                  elapsed_ms=182.4, response_bytes=len(response_text))
+        after.debug("Pipefy response content=%s", response_text)
+
+    return [
+        ("log_per_mutation_before", log_before, 2000),
+        ("log_per_mutation_after", log_after, 2000),
+    ]
@@ -0,0 +1,143 @@
+# Uso:
+#   python -m benchmarks.run                 # mede e compara com o baseline salvo
+#   python -m benchmarks.run --save          # grava as medições atuais como baseline
+#   python -m benchmarks.run --threshold 15  # tolerância mínima de regressão em %
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Dict, Tuple
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 20.0
+DEFAULT_REPEAT = 7
+# Cada amostra dura pelo menos isto; casos de microssegundos com poucas
+# execuções por amostra medem mais o relógio e o escalonador do que o código
+MIN_SAMPLE_SECONDS = 0.2
+# A tolerância de cada caso cresce com o ruído medido nele, até um teto:
+# dobrar de tempo é sempre regressão
+NOISE_FACTOR = 3.0
+MAX_NOISE_THRESHOLD = 100.0
+
+def _sample(func, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+def calibrate(func, number: int) -> int:
+    # Dobra o número de execuções até a amostra ficar longa o bastante
+    while _sample(func, number) < MIN_SAMPLE_SECONDS:
+        number *= 2
+    return number
+
+def measure(func, number: int, repeat: int) -> Tuple[float, float]:
+    # Retorna (melhor tempo por operação, ruído em %). O mínimo é o tempo com
+    # menos interferência externa; o ruído é a distância da mediana até ele
+    number = calibrate(func, number)
+    samples = [_sample(func, number) / number for _ in range(repeat)]
+    best = min(samples)
+    return best, (statistics.median(samples) - best) / best * 100
+
+def run_cases(only=None, repeat: int = DEFAULT_REPEAT) -> Tuple[Dict[str, float], Dict[str, float]]:
+    from benchmarks.hot_paths import build_cases
+
+    timings = {}
+    noise = {}
+    for name, func, number in build_cases():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        timings[name], noise[name] = measure(func, number, repeat)
+        print(f"{name:<40} {timings[name] * 1e6:>14.1f} us/op  ±{noise[name]:.1f}%")
+    return timings, noise
+
+def report_sizes(only=None) -> Dict[str, int]:
+    from benchmarks.hot_paths import payload_sizes
+
+    sizes = {}
+    for name, size in payload_sizes():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        sizes[name] = size
+        print(f"{name:<40} {size:>14,} bytes")
+    return sizes
+
+def load_baseline() -> Dict:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_baseline(timings: Dict[str, float], noise: Dict[str, float]):
+    baseline = load_baseline()
+    baseline.setdefault("timings", {}).update(timings)
+    baseline.setdefault("noise", {}).update({name: round(value, 2) for name, value in noise.items()})
+    baseline["machine"] = {"python": platform.python_version(), "platform": platform.platform()}
+    with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Baseline saved to {BASELINE_PATH}")
+
+def case_threshold(threshold: float, *noise: float) -> float:
+    # Nunca abaixo da tolerância pedida; em casos ruidosos (no baseline ou
+    # nesta execução), um múltiplo do ruído observado
+    return max([threshold] + [min(NOISE_FACTOR * value, MAX_NOISE_THRESHOLD) for value in noise])
+
+def compare(
+    timings: Dict[str, float],
+    noise: Dict[str, float],
+    baseline: Dict[str, float],
+    baseline_noise: Dict[str, float],
+    threshold: float
+) -> int:
+    regressions = 0
+    for name, current in timings.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<40} no baseline")
+            continue
+        change = (current - previous) / previous * 100
+        limit = case_threshold(threshold, noise.get(name, 0.0), baseline_noise.get(name, 0.0))
+        status = "REGRESSION" if change > limit else "ok"
+        if change > limit:
+            regressions += 1
+        print(f"{name:<40} {change:>+8.1f}%  (limit {limit:.0f}%)  {status}")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks dos caminhos críticos locais")
+    parser.add_argument("--save", action="store_true", help="grava as medições como novo baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="regressão máxima tolerada em %%")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--only", nargs="*", help="executa apenas os casos cujo nome contém estes trechos")
+    args = parser.parse_args(argv)
+
+    # Silencia os logs da aplicação; os casos de logging usam loggers próprios
+    logging.getLogger().setLevel(logging.WARNING)
+    timings, noise = run_cases(args.only, args.repeat)
+    print()
+    report_sizes(args.only)
+
+    if args.save:
+        save_baseline(timings, noise)
+        return 0
+
+    recorded = load_baseline()
+    baseline = recorded.get("timings", {})
+    if not baseline:
+        print("No baseline recorded yet. Run with --save on the reference machine first.")
+        return 1
+
+    print()
+    regressions = compare(timings, noise, baseline, recorded.get("noise", {}), args.threshold)
+    if regressions:
+        print(f"\n{regressions} benchmark(s) regressed beyond their tolerance")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())